@@ -1,10 +1,12 @@
 from flask import Flask
 
+from app.audio import AudioUploadRequest
 from config import Config, init_db, init_auth, init_jinja_filters  # init_sentry
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.request_class = AudioUploadRequest
     app.config.from_object(config_class)
 
     # Apply configurations
@@ -13,6 +15,32 @@ def create_app(config_class=Config):
     init_jinja_filters(app)
     # init_sentry(app)
 
+    # Request latency histograms and the /metrics endpoint
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    # Root trace span per request, exported to a file or a collector
+    from app.tracing import init_tracing
+    init_tracing(app)
+
+    # Statement counts per request and N+1 warnings
+    from app.query_stats import init_query_stats
+    init_query_stats(app)
+
+    # Sampling profiles of requests, on demand
+    from app.profiler import init_profiler
+    init_profiler(app)
+
+    # Keep the in-memory content catalog fresh
+    from app.catalog import init_catalog
+    init_catalog(app)
+
+    # CLI commands for schema migrations, content seeding and re-scoring
+    from app.cli import db_cli, content_cli, speaking_cli
+    app.cli.add_command(db_cli)
+    app.cli.add_command(content_cli)
+    app.cli.add_command(speaking_cli)
+
     # register blueprints
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
@@ -20,4 +48,7 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    from app.admin import bp as admin_bp
+    app.register_blueprint(admin_bp)
+
     return app
@@ -0,0 +1,10 @@
+from flask_wtf import FlaskForm
+from wtforms import FloatField, SelectField, SubmitField
+from wtforms.validators import InputRequired, NumberRange
+
+
+class SampleRateForm(FlaskForm):
+    endpoint = SelectField('Endpoint', validators=[InputRequired()])
+    rate = FloatField('Share of requests', default=0.05,
+                      validators=[InputRequired(), NumberRange(min=0, max=1)])
+    submit = SubmitField('Set')
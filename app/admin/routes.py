@@ -0,0 +1,55 @@
+from collections import Counter
+
+from flask import Response, abort, current_app, flash, redirect, render_template, url_for
+from flask_login import current_user
+
+from app.admin import bp
+from app.admin.forms import SampleRateForm
+from app.profiler import get_profile_store
+
+
+@bp.before_request
+def require_admin():
+    # internal pages don't exist for anyone else
+    if not (current_user.is_authenticated and current_user.is_admin):
+        abort(404)
+
+
+@bp.route('/profiles', methods=['GET', 'POST'])
+def profiles():
+    store = get_profile_store()
+    form = SampleRateForm()
+    form.endpoint.choices = sorted(endpoint for endpoint in current_app.view_functions
+                                   if not endpoint.startswith(('static', 'admin.')))
+
+    if form.validate_on_submit():
+        store.set_sample_rate(form.endpoint.data, form.rate.data)
+        flash(f'Profiling {form.rate.data:.0%} of {form.endpoint.data} requests.')
+        return redirect(url_for('admin.profiles'))
+
+    saved = {endpoint: store.list(endpoint) for endpoint in store.endpoints()}
+    return render_template('admin/profiles.html', form=form, saved=saved,
+                           sample_rates=store.sample_rates())
+
+
+@bp.route('/profiles/<endpoint_name>/<name>')
+def profile(endpoint_name, name):
+    saved = get_profile_store().load(endpoint_name, name) or abort(404)
+
+    # leaf frames are where the samples were taken: the hottest functions
+    stacks = [line.rsplit(' ', 1) for line in saved['collapsed'].splitlines()]
+    self_samples = Counter()
+    for stack, n in stacks:
+        self_samples[stack.rsplit(';', 1)[-1]] += int(n)
+    total = sum(self_samples.values()) or 1
+
+    return render_template('admin/profile.html', profile=saved, total=total,
+                           hottest_functions=self_samples.most_common(25),
+                           hottest_stacks=[(stack, int(n)) for stack, n in stacks[:25]])
+
+
+@bp.route('/profiles/<endpoint_name>/<name>.folded')
+def profile_folded(endpoint_name, name):
+    saved = get_profile_store().load(endpoint_name, name) or abort(404)
+    return Response(saved['collapsed'], mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={endpoint_name}-{name}.folded'})
@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Hashable, Optional
+
+from flask import current_app
+
+from app.metrics import (ADMISSION_EVALUATIONS, ADMISSION_MEMORY_RESERVED_BYTES, ADMISSION_REJECTED,
+                         ADMISSION_WAIT_SECONDS)
+
+
+class AdmissionRejected(Exception):
+    """
+    The evaluation was not admitted.
+
+    Attributes:
+    - status: 429 when the user is over their own cap, 503 when the server is full.
+    - retry_after: Suggested seconds before retrying.
+    """
+
+    def __init__(self, status: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Caps how many evaluations run at once, in total, per user and by memory.
+
+    An evaluation over the global cap, or one whose estimated memory would
+    take the running evaluations over `memory_budget`, waits in a bounded FIFO queue for up to
+    `queue_timeout` seconds. Everything else is rejected immediately: a user
+    who already has `max_per_user` evaluations running or queued gets a 429,
+    and a full queue or an expired wait gets a 503, both with a Retry-After
+    estimated from recent evaluation times.
+
+    Limits are per process, so the server-wide cap is `max_concurrent` times
+    the number of gunicorn workers. An evaluation larger than the whole memory
+    budget still runs, alone.
+
+    Attributes:
+    - max_concurrent: Evaluations running at the same time.
+    - max_per_user: Evaluations a user may have running or queued.
+    - max_queue: Evaluations allowed to wait for a free slot.
+    - queue_timeout: Seconds an evaluation may wait before it is rejected.
+    - memory_budget: Bytes the running evaluations may reserve, 0 for no limit.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_per_user: int = 1,
+                 max_queue: int = 8, queue_timeout: float = 30, memory_budget: int = 0):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_budget = memory_budget
+
+        self._condition = threading.Condition()
+        self._running = 0
+        self._reserved = 0  # bytes of memory held by the running evaluations
+        self._queue = deque()
+        self._per_user = Counter()
+        self._avg_duration = 30.0  # seconds, moving average of evaluation time
+
+        self.admitted = 0
+        self.rejected = Counter()  # by reason
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    @contextmanager
+    def admit(self, user_id: Hashable, memory: int = 0):
+        """
+        Hold an evaluation slot for the duration of the with block.
+
+        Args:
+            user_id: The user the evaluation is for.
+            memory: Estimated bytes the evaluation holds, reserved against memory_budget.
+
+        Raises:
+            AdmissionRejected: If the evaluation cannot run now or within queue_timeout.
+        """
+        self._acquire(user_id, memory)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user_id, memory, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'running': self._running, 'queued': len(self._queue),
+                    'memory_reserved': self._reserved,
+                    'admitted': self.admitted, 'rejected': dict(self.rejected),
+                    'wait_seconds_total': self.wait_seconds_total,
+                    'max_wait_seconds': self.max_wait_seconds}
+
+    def _can_start(self, memory: int) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        return (not self.memory_budget or not self._running
+                or self._reserved + memory <= self.memory_budget)
+
+    def _acquire(self, user_id: Hashable, memory: int) -> None:
+        with self._condition:
+            if self._per_user[user_id] >= self.max_per_user:
+                self._reject('user', 429)
+            if not self._queue and self._can_start(memory):
+                self._admit(user_id, memory, waited=0)
+                return
+            if len(self._queue) >= self.max_queue:
+                self._reject('queue_full', 503)
+
+            ticket = object()
+            self._queue.append(ticket)
+            ADMISSION_EVALUATIONS.labels('queued').inc()
+            self._per_user[user_id] += 1
+            enqueued = time.monotonic()
+            deadline = enqueued + self.queue_timeout
+            try:
+                while not (self._queue[0] is ticket and self._can_start(memory)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._forget(user_id)
+                        self._reject('timeout', 503)
+                    self._condition.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                ADMISSION_EVALUATIONS.labels('queued').dec()
+                # the next ticket may now be at the head
+                self._condition.notify_all()
+            self._forget(user_id)
+            self._admit(user_id, memory, waited=time.monotonic() - enqueued)
+
+    def _admit(self, user_id: Hashable, memory: int, waited: float) -> None:
+        self._running += 1
+        self._reserved += memory
+        ADMISSION_MEMORY_RESERVED_BYTES.inc(memory)
+        self._per_user[user_id] += 1
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        ADMISSION_EVALUATIONS.labels('running').inc()
+        ADMISSION_WAIT_SECONDS.observe(waited)
+
+    def _release(self, user_id: Hashable, memory: int, duration: float) -> None:
+        with self._condition:
+            self._running -= 1
+            self._reserved -= memory
+            ADMISSION_MEMORY_RESERVED_BYTES.dec(memory)
+            self._forget(user_id)
+            ADMISSION_EVALUATIONS.labels('running').dec()
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+            self._condition.notify_all()
+
+    def _forget(self, user_id: Hashable) -> None:
+        self._per_user[user_id] -= 1
+        if not self._per_user[user_id]:
+            del self._per_user[user_id]
+
+    def _reject(self, reason: str, status: int) -> None:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+        # time for the evaluations ahead of a retry to drain through the slots
+        ahead = self._running + len(self._queue)
+        retry_after = max(1, math.ceil(self._avg_duration * ahead / self.max_concurrent))
+        raise AdmissionRejected(status, retry_after, reason)
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide controller, configured from the current app."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                config = current_app.config
+                _controller = AdmissionController(
+                    max_concurrent=config['EVALUATION_MAX_CONCURRENT'],
+                    max_per_user=config['EVALUATION_MAX_PER_USER'],
+                    max_queue=config['EVALUATION_MAX_QUEUE'],
+                    queue_timeout=config['EVALUATION_QUEUE_TIMEOUT_SECONDS'],
+                    memory_budget=config['EVALUATION_MEMORY_BUDGET_MB'] * 1024 * 1024)
+    return _controller
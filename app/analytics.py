@@ -0,0 +1,120 @@
+import atexit
+import queue
+import threading
+import time
+
+import requests
+
+from app.metrics import ANALYTICS_EVENTS
+
+
+class AnalyticsDispatcher:
+    """
+    Sends analytics events to Amplitude's batch HTTP API from a background thread.
+
+    `track` only puts the event on a bounded in-memory queue, so requests never
+    wait on the analytics round trip. The sender thread posts a batch once
+    `batch_size` events are queued or `flush_interval` seconds have passed
+    since the first event of the batch. When the queue is full new events are
+    dropped and counted rather than blocking the request.
+
+    Attributes:
+    - api_url: Batch endpoint, e.g. https://api2.amplitude.com/batch or a local sink.
+    - api_key: Amplitude project API key.
+    - batch_size: Maximum number of events per request.
+    - flush_interval: Maximum seconds an event waits before being sent.
+    """
+
+    def __init__(self, api_url: str, api_key: str, max_queue_size: int = 10000,
+                 batch_size: int = 100, flush_interval: float = 5.0,
+                 request_timeout: float = 10.0):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.request_timeout = request_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._session = requests.Session()
+
+        self.sent = 0  # events accepted by the API
+        self.dropped = 0  # events discarded because the queue was full
+        self.failed = 0  # events lost to failed requests
+
+    def track(self, event: dict) -> bool:
+        """
+        Queue an event without blocking.
+
+        Returns:
+            bool: False if the event was dropped.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            ANALYTICS_EVENTS.labels('dropped').inc()
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {'queued': self._queue.qsize(), 'sent': self.sent,
+                'dropped': self.dropped, 'failed': self.failed}
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stop the sender after it has flushed the events still queued."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        # started on first use rather than at import, so it runs in the worker
+        # process and not in a gunicorn master that forks afterwards
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analytics-dispatcher',
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+
+    def _next_batch(self) -> list:
+        """Block for the first event, then collect until the batch is full or due."""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch: list) -> None:
+        try:
+            response = self._session.post(self.api_url,
+                                          json={'api_key': self.api_key, 'events': batch},
+                                          timeout=self.request_timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.failed += len(batch)
+            ANALYTICS_EVENTS.labels('failed').inc(len(batch))
+            print(f'Failed to send {len(batch)} analytics events: {e}')
+        else:
+            self.sent += len(batch)
+            ANALYTICS_EVENTS.labels('sent').inc(len(batch))
@@ -0,0 +1,283 @@
+import hashlib
+import io
+import mmap
+import os
+import struct
+import subprocess
+from tempfile import SpooledTemporaryFile
+from typing import IO, Iterator, Optional, Union
+
+from flask import Request, current_app
+
+from app.memory import track_buffer
+from app.metrics import backend_call
+
+CHUNK_SIZE = 64 * 1024  # bytes per chunk when streaming audio to an API
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# EBML element ids used to find the duration of a WebM recording
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_CLUSTER = 0x1F43B675
+_CLUSTER_TIMECODE = 0xE7
+_BLOCK_GROUP = 0xA0
+_BLOCK = 0xA1
+_SIMPLE_BLOCK = 0xA3
+
+# master elements whose children are scanned instead of skipped
+_CONTAINERS = {_SEGMENT, _INFO, _CLUSTER, _BLOCK_GROUP}
+
+
+class AudioUploadRequest(Request):
+    """
+    Request that spools uploaded files to disk above AUDIO_SPOOL_MAX_MEMORY.
+
+    Werkzeug already streams each multipart part into the file returned by
+    `_get_file_stream`; this only makes the in-memory threshold configurable,
+    so a whole submission no longer has to fit into a small byte limit.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None) -> IO[bytes]:
+        max_size = current_app.config['AUDIO_SPOOL_MAX_MEMORY']
+        return SpooledTemporaryFile(max_size=max_size, mode='rb+')
+
+
+class InvalidAudioError(ValueError):
+    pass
+
+
+class AudioBuffer:
+    """
+    Read-only audio bytes shared by the evaluation stages without copying.
+
+    Backed by `bytes`, the in-memory buffer of a spooled upload, or an `mmap`
+    of the upload's temp file once it was spooled to disk. Stages read through
+    `memoryview` slices (`chunks`) or a seekable `reader()`, so transcription,
+    transcoding and the pronunciation upload all share one copy of the audio.
+    Its bytes are counted in the memory accounting until it is freed.
+
+    Attributes:
+    - name: File name sent to APIs that infer the format from it.
+    """
+
+    __slots__ = ('name', '_data', '_view', '__weakref__')
+
+    def __init__(self, data: Union[bytes, memoryview, mmap.mmap], name: str = 'audio.webm'):
+        self.name = name
+        self._data = data  # keeps the mmap or spooled file buffer alive
+        self._view = memoryview(data).toreadonly()
+        track_buffer(self, self._view.nbytes)
+
+    @classmethod
+    def from_upload(cls, file: IO[bytes], name: str = 'audio.webm') -> 'AudioBuffer':
+        """
+        Wrap an uploaded file, a FileStorage or any binary file object.
+
+        Files on disk are memory-mapped and in-memory spooled files share
+        their bytes (BytesIO.getvalue() does not copy an unshared buffer);
+        other objects are read once.
+        """
+        stream = getattr(file, 'stream', file)
+        if isinstance(stream, SpooledTemporaryFile):
+            # fileno() would move an in-memory spooled file to disk
+            stream = stream._file
+        if isinstance(stream, io.BytesIO):
+            return cls(stream.getvalue(), name)
+        try:
+            fileno = stream.fileno()
+        except (AttributeError, OSError):
+            stream.seek(0)
+            return cls(stream.read(), name)
+        if os.fstat(fileno).st_size == 0:
+            return cls(b'', name)
+        return cls(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), name)
+
+    def __len__(self):
+        return self._view.nbytes
+
+    @property
+    def view(self) -> memoryview:
+        return self._view
+
+    def digest(self) -> str:
+        """SHA-256 of the audio, hashed straight from the buffer."""
+        return hashlib.sha256(self._view).hexdigest()
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Yield consecutive memoryview slices, a fresh iterator on every call."""
+        for start in range(0, len(self), chunk_size):
+            yield self._view[start:start + chunk_size]
+
+    def reader(self) -> '_AudioBufferReader':
+        """Return a new seekable binary file reading from this buffer."""
+        return _AudioBufferReader(self._view, self.name)
+
+
+class _AudioBufferReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview; has no fileno on purpose."""
+
+    def __init__(self, view: memoryview, name: str):
+        self._view = view
+        self._position = 0
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._position:self._position + len(buffer)]
+        size = data.nbytes
+        buffer[:size] = data
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._view.nbytes}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def transcode_to_opus(audio: AudioBuffer) -> AudioBuffer:
+    """
+    Convert a recording to 16 kHz mono Opus with ffmpeg.
+
+    The audio is piped through ffmpeg directly rather than decoded to PCM in
+    Python (as pydub does), so only the compressed input and output are held
+    in memory.
+    """
+    command = [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+               '-ar', '16000', '-ac', '1', '-c:a', 'libopus', '-f', 'opus', 'pipe:1']
+    with backend_call('ffmpeg') as call:
+        call.set_attribute('bytes', len(audio))
+        result = subprocess.run(command, input=audio.view, capture_output=True)
+        call.set_attribute('exit_code', result.returncode)
+    if result.returncode != 0:
+        raise InvalidAudioError(f'ffmpeg failed: {result.stderr.decode(errors="replace").strip()}')
+    return AudioBuffer(result.stdout, name='audio.opus')
+
+
+def get_webm_duration(stream: IO[bytes]) -> float:
+    """
+    Return the duration of a WebM recording in seconds without decoding it.
+
+    Browsers' MediaRecorder usually writes no Duration element, so unless one
+    is present the duration is taken from the last block's timestamp. Only
+    element headers are read, everything else is skipped with seek.
+
+    Args:
+        stream: Seekable binary file positioned anywhere; it is rewound afterwards.
+
+    Returns:
+        float: The duration in seconds.
+
+    Raises:
+        InvalidAudioError: If the stream is not a WebM file, is malformed or has no audio blocks.
+    """
+    stream.seek(0)
+    if _read_id(stream) != 0x1A45DFA3:  # EBML header
+        raise InvalidAudioError('Not a WebM file')
+    header_size = _read_size(stream)
+    if header_size is None:
+        raise InvalidAudioError('Not a WebM file')
+    stream.seek(header_size, 1)
+
+    timecode_scale = 1_000_000  # nanoseconds per tick, the Matroska default
+    duration = None
+    cluster_timecode = 0
+    last_timecode = None
+
+    while True:
+        element_id = _read_id(stream)
+        if element_id is None:
+            break
+        size = _read_size(stream)
+        if size is None and element_id not in _CONTAINERS:
+            break  # truncated or an unknown-size leaf, nothing more to learn
+
+        if element_id in _CONTAINERS:
+            continue
+        data_start = stream.tell()
+        if element_id == _TIMECODE_SCALE:
+            timecode_scale = _read_uint(stream, size)
+        elif element_id == _DURATION:
+            duration = _read_float(stream, size)
+        elif element_id == _CLUSTER_TIMECODE:
+            cluster_timecode = _read_uint(stream, size)
+        elif element_id in (_SIMPLE_BLOCK, _BLOCK):
+            _read_size(stream)  # track number
+            relative = stream.read(2)
+            if len(relative) < 2:
+                break
+            relative = struct.unpack('>h', relative)[0]
+            last_timecode = max(last_timecode or 0, cluster_timecode + relative)
+        stream.seek(data_start + size)
+
+    stream.seek(0)
+    if duration is None:
+        if last_timecode is None:
+            raise InvalidAudioError('WebM file has no audio blocks')
+        duration = last_timecode
+    return duration * timecode_scale / 1e9
+
+
+def _read_vint(stream: IO[bytes], keep_marker: bool) -> Optional[tuple[int, int]]:
+    first = stream.read(1)
+    if not first:
+        return None
+    first = first[0]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise InvalidAudioError('Invalid EBML variable-length integer')
+    value = first if keep_marker else first & (0xFF >> length)
+    rest = stream.read(length - 1)
+    if len(rest) != length - 1:
+        return None
+    for byte in rest:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _read_id(stream: IO[bytes]) -> Optional[int]:
+    vint = _read_vint(stream, keep_marker=True)
+    return vint and vint[0]
+
+
+def _read_size(stream: IO[bytes]) -> Optional[int]:
+    """Read an element size, None for the reserved 'unknown size' value."""
+    vint = _read_vint(stream, keep_marker=False)
+    if vint is None:
+        return None
+    value, length = vint
+    if value == (1 << (7 * length)) - 1:
+        return None
+    return value
+
+
+def _read_uint(stream: IO[bytes], size: int) -> int:
+    if size > 8:
+        raise InvalidAudioError(f'Invalid EBML unsigned integer size {size}')
+    return int.from_bytes(_read_exactly(stream, size), 'big')
+
+
+def _read_float(stream: IO[bytes], size: int) -> float:
+    if size not in (4, 8):
+        raise InvalidAudioError(f'Invalid EBML float size {size}')
+    return struct.unpack('>f' if size == 4 else '>d', _read_exactly(stream, size))[0]
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise InvalidAudioError('Truncated WebM file')
+    return data
@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import random
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import select
+
+# random picks that may hit seen question sets before the unseen ones are listed
+_UNSEEN_PICK_TRIES = 8
+
+
+@dataclass(frozen=True)
+class CatalogSection:
+    """An IELTS exam section together with its subsections ordered by part number."""
+    id: int
+    name: str
+    description: str
+    subsections: tuple[CatalogSubsection, ...]
+
+
+@dataclass(frozen=True)
+class CatalogSubsection:
+    """A part of an IELTS section, e.g. Speaking Part 2."""
+    id: int
+    name: str
+    part_number: int
+    description: str
+    time_limit_minutes: int
+    section_id: int
+
+
+@dataclass(frozen=True)
+class CatalogTopic:
+    id: int
+    name: str
+    description: str
+
+
+@dataclass(frozen=True)
+class CatalogQuestion:
+    id: int
+    text: str
+    question_set_id: int
+
+
+@dataclass(frozen=True)
+class CatalogQuestionSet:
+    """
+    A set of questions for a subsection-topic pair. Iterating yields its questions.
+    Inactive sets are no longer given out but stay available to past attempts.
+    `index` numbers the sets of a subsection densely in id order, new sets
+    come last, so it is stable across content reloads.
+    """
+    id: int
+    subsection: CatalogSubsection
+    topic: Optional[CatalogTopic]
+    questions: tuple[CatalogQuestion, ...]
+    index: int
+    is_active: bool = True
+
+    @property
+    def subsection_id(self) -> int:
+        return self.subsection.id
+
+    @property
+    def topic_id(self) -> Optional[int]:
+        return self.topic.id if self.topic else None
+
+    def __iter__(self):
+        yield from self.questions
+
+
+class ContentCatalog:
+    """
+    Immutable in-memory snapshot of the static IELTS content.
+
+    Sections, subsections, topics, question sets and questions never change
+    while the app is running, so they are loaded once per worker and served
+    from dictionaries afterwards. Every lookup is O(1); the database is only
+    queried for user data.
+
+    Attributes:
+    - version: A digest of the loaded content, changes whenever the content does.
+    """
+
+    def __init__(self, sections: tuple[CatalogSection, ...],
+                 question_sets: tuple[CatalogQuestionSet, ...],
+                 version: str):
+        self.version = version
+
+        subsections = tuple(sub for section in sections for sub in section.subsections)
+        questions = tuple(q for question_set in question_sets for q in question_set)
+
+        self._sections_by_id = MappingProxyType({s.id: s for s in sections})
+        self._sections_by_name = MappingProxyType({s.name.lower(): s for s in sections})
+        self._subsections_by_id = MappingProxyType({s.id: s for s in subsections})
+        self._subsections_by_part = MappingProxyType(
+            {(s.section_id, s.part_number): s for s in subsections})
+        self._question_sets_by_id = MappingProxyType({qs.id: qs for qs in question_sets})
+        self._questions_by_id = MappingProxyType({q.id: q for q in questions})
+
+        # candidate question sets for random selection
+        by_subsection, by_topic = {}, {}
+        for qs in question_sets:
+            if not qs.is_active:
+                continue
+            by_subsection.setdefault(qs.subsection_id, []).append(qs)
+            if qs.topic:
+                by_topic.setdefault((qs.subsection_id, qs.topic_id), []).append(qs)
+        self._question_sets_by_subsection = MappingProxyType(
+            {key: tuple(sets) for key, sets in by_subsection.items()})
+        self._question_sets_by_topic = MappingProxyType(
+            {key: tuple(sets) for key, sets in by_topic.items()})
+
+    def __repr__(self):
+        return f"<ContentCatalog {self.version}>"
+
+    def section(self, section_id: int) -> Optional[CatalogSection]:
+        return self._sections_by_id.get(section_id)
+
+    def section_by_name(self, name: str) -> Optional[CatalogSection]:
+        """Case-insensitive lookup, mirrors the former `ILIKE` query."""
+        return self._sections_by_name.get(name.lower())
+
+    def subsection(self, subsection_id: int) -> Optional[CatalogSubsection]:
+        return self._subsections_by_id.get(subsection_id)
+
+    def subsection_by_part(self, section_id: int, part_number: int) -> Optional[CatalogSubsection]:
+        return self._subsections_by_part.get((section_id, part_number))
+
+    def question_set(self, question_set_id: int) -> Optional[CatalogQuestionSet]:
+        return self._question_sets_by_id.get(question_set_id)
+
+    def question(self, question_id: int) -> Optional[CatalogQuestion]:
+        return self._questions_by_id.get(question_id)
+
+    def random_question_set(self, subsection_id: int,
+                            topic_id: Optional[int] = None,
+                            seen: Optional[SeenQuestionSets] = None) -> Optional[CatalogQuestionSet]:
+        """
+        Pick a random question set for a subsection without touching the database.
+
+        Args:
+            subsection_id (int): Subsection to pick the question set for.
+            topic_id (int, optional): Restrict candidates to this topic (Part 3 follows Part 2).
+            seen (SeenQuestionSets, optional): Question sets the user was already given.
+                They are avoided unless the user has seen every candidate.
+
+        Returns:
+            CatalogQuestionSet: The picked question set, or None if there are no candidates.
+        """
+        if topic_id is not None:
+            candidates = self._question_sets_by_topic.get((subsection_id, topic_id), ())
+        else:
+            candidates = self._question_sets_by_subsection.get(subsection_id, ())
+        if not candidates:
+            return None
+
+        if seen:
+            # rejection sampling, O(1) while most candidates are unseen; the
+            # scan only runs once the user has seen most of them
+            for _ in range(_UNSEEN_PICK_TRIES):
+                question_set = random.choice(candidates)
+                if question_set not in seen:
+                    return question_set
+            unseen = tuple(qs for qs in candidates if qs not in seen)
+            candidates = unseen or candidates
+        return random.choice(candidates)
+
+
+class SeenQuestionSets:
+    """
+    Compact bitsets of the question sets a user has already been shown, one
+    per subsection.
+
+    Bit N of a subsection's bitset is set when its question set with index N
+    was seen, so a bitset grows with the number of sets in the subsection,
+    not with their ids. The sets serialize to a short url-safe token, small
+    enough to live in the session cookie.
+    """
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, bits: Optional[dict] = None):
+        self._bits = bits or {}  # subsection id -> bitset
+
+    def __contains__(self, question_set: CatalogQuestionSet) -> bool:
+        return bool(self._bits.get(question_set.subsection_id, 0) >> question_set.index & 1)
+
+    def __bool__(self):
+        return any(self._bits.values())
+
+    def add(self, question_set: CatalogQuestionSet) -> None:
+        subsection_id = question_set.subsection_id
+        self._bits[subsection_id] = self._bits.get(subsection_id, 0) | 1 << question_set.index
+
+    def to_token(self) -> str:
+        parts = []
+        for subsection_id, bits in self._bits.items():
+            raw = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+            parts.append(f"{subsection_id}:{base64.urlsafe_b64encode(raw).decode('ascii')}")
+        return ','.join(parts)
+
+    @classmethod
+    def from_token(cls, token: Optional[str]) -> SeenQuestionSets:
+        """Parse a token produced by `to_token`, an invalid token gives an empty set."""
+        if not token:
+            return cls()
+        bits = {}
+        try:
+            for part in token.split(','):
+                subsection_id, _, raw = part.partition(':')
+                raw = base64.urlsafe_b64decode(raw.encode('ascii'))
+                bits[int(subsection_id)] = int.from_bytes(raw, 'little')
+        except (ValueError, UnicodeEncodeError):
+            return cls()
+        return cls(bits)
+
+
+def load_catalog() -> ContentCatalog:
+    """
+    Build a new catalog snapshot from the database. Requires an app context.
+
+    The whole content is read with a single outer-joined query, so loading
+    the catalog costs one round trip however large the content is.
+    """
+    from app.models import Section, Subsection, Topic, QuestionSet, Question
+    from config.database import db
+
+    rows = db.session.execute(
+        select(Section.id, Section.name, Section.description,
+               Subsection.id, Subsection.name, Subsection.part_number,
+               Subsection.description, Subsection.time_limit_minutes,
+               QuestionSet.id, QuestionSet.is_active,
+               Topic.id, Topic.name, Topic.description,
+               Question.id, Question.text)
+        .outerjoin(Subsection, Subsection.section_id == Section.id)
+        .outerjoin(QuestionSet, QuestionSet.subsection_id == Subsection.id)
+        .outerjoin(Topic, Topic.id == QuestionSet.topic_id)
+        .outerjoin(Question, Question.question_set_id == QuestionSet.id)
+        .order_by(Section.id, Subsection.part_number, QuestionSet.id, Question.id)
+    ).all()
+
+    sections, subsections, topics, question_sets, questions = {}, {}, {}, {}, {}
+    for (section_id, section_name, section_desc,
+         subsection_id, subsection_name, part_number, subsection_desc, time_limit,
+         question_set_id, question_set_active, topic_id, topic_name, topic_desc,
+         question_id, question_text) in rows:
+        sections.setdefault(section_id, (section_name, section_desc))
+        if subsection_id is not None and subsection_id not in subsections:
+            subsections[subsection_id] = CatalogSubsection(
+                id=subsection_id, name=subsection_name, part_number=part_number,
+                description=subsection_desc, time_limit_minutes=time_limit,
+                section_id=section_id)
+        if topic_id is not None and topic_id not in topics:
+            topics[topic_id] = CatalogTopic(id=topic_id, name=topic_name,
+                                            description=topic_desc)
+        if question_set_id is not None:
+            question_sets.setdefault(question_set_id, (subsection_id, topic_id, question_set_active))
+            if question_id is not None:
+                questions.setdefault(question_set_id, []).append(
+                    CatalogQuestion(id=question_id, text=question_text,
+                                    question_set_id=question_set_id))
+
+    catalog_sections = tuple(
+        CatalogSection(id=section_id, name=name, description=description,
+                       subsections=tuple(sub for sub in subsections.values()
+                                         if sub.section_id == section_id))
+        for section_id, (name, description) in sections.items())
+
+    # rows come in id order within a subsection, so new sets get the next index
+    indexes = {}
+    catalog_question_sets = []
+    for question_set_id, (subsection_id, topic_id, is_active) in question_sets.items():
+        indexes[subsection_id] = index = indexes.get(subsection_id, -1) + 1
+        catalog_question_sets.append(
+            CatalogQuestionSet(id=question_set_id,
+                               subsection=subsections[subsection_id],
+                               topic=topics.get(topic_id),
+                               questions=tuple(questions.get(question_set_id, ())),
+                               index=index,
+                               is_active=is_active))
+    catalog_question_sets = tuple(catalog_question_sets)
+
+    return ContentCatalog(catalog_sections, catalog_question_sets,
+                          version=_content_version(catalog_sections, catalog_question_sets))
+
+
+def _content_version(sections, question_sets) -> str:
+    """Digest of the whole content; two snapshots with equal versions are interchangeable."""
+    digest = hashlib.sha1()
+    digest.update(repr(sections).encode('utf-8'))
+    digest.update(repr(question_sets).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+_catalog: Optional[ContentCatalog] = None
+_loaded_at = 0.0  # monotonic time of the last (re)load
+_reload_lock = threading.Lock()
+
+
+def get_catalog() -> ContentCatalog:
+    """Return the current snapshot, loading it on first use."""
+    if _catalog is None:
+        reload_catalog()
+    return _catalog
+
+
+def reload_catalog() -> bool:
+    """
+    Rebuild the snapshot from the database and swap it in atomically.
+
+    Readers holding the previous snapshot keep using it undisturbed.
+
+    Returns:
+        bool: True if the content version changed.
+    """
+    global _catalog, _loaded_at
+    with _reload_lock:
+        new_catalog = load_catalog()
+        changed = _catalog is None or _catalog.version != new_catalog.version
+        if changed:
+            _catalog = new_catalog
+        _loaded_at = time.monotonic()
+        return changed
+
+
+def _refresh_if_stale() -> None:
+    """Reload the catalog once it is older than CONTENT_CATALOG_REFRESH_SECONDS."""
+    max_age = current_app.config.get('CONTENT_CATALOG_REFRESH_SECONDS')
+    if not max_age or _catalog is None:
+        return
+    if time.monotonic() - _loaded_at < max_age:
+        return
+    # only one request per worker pays for the reload, the others keep going
+    if _reload_lock.locked():
+        return
+    if reload_catalog():
+        print(f'Content catalog reloaded, version {_catalog.version}')
+
+
+def init_catalog(app):
+    """
+    Register the periodic catalog refresh.
+
+    The catalog itself is loaded by gunicorn's post_worker_init hook (see
+    gunicorn.conf.py) or, outside gunicorn, lazily by the first request.
+    """
+    app.before_request(_refresh_if_stale)
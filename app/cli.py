@@ -0,0 +1,126 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+db_cli = AppGroup('db', help='Manage the database schema with Alembic migrations.')
+content_cli = AppGroup('content', help='Manage the static IELTS content.')
+speaking_cli = AppGroup('speaking', help='Maintain the speaking attempts of the users.')
+
+
+def _alembic_config():
+    """Alembic config from alembic.ini, pointed at the app's database."""
+    from alembic.config import Config as AlembicConfig
+
+    project_root = os.path.dirname(current_app.root_path)
+    config = AlembicConfig(os.path.join(project_root, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(project_root, 'migrations'))
+    database_url = current_app.config['SQLALCHEMY_DATABASE_URI']
+    config.set_main_option('sqlalchemy.url', database_url.replace('%', '%%'))
+    return config
+
+
+# Tables of revision 0001, the schema db.create_all() built before the migrations
+INITIAL_TABLES = frozenset({
+    'sections', 'subsections', 'topics', 'question_sets', 'questions', 'users', 'user_progress',
+    'user_subsection_attempts', 'user_subsection_answers', 'user_speaking_attempt_results'})
+
+
+def _stamp_unversioned_schema(config) -> None:
+    """
+    Mark a database built by db.create_all() as revision 0001, so upgrading
+    it does not create its tables again. Databases with an alembic_version
+    table, and empty ones, are left alone.
+    """
+    from alembic import command
+    from sqlalchemy import inspect
+    from config.database import db
+
+    tables = set(inspect(db.engine).get_table_names())
+    if 'alembic_version' in tables or not tables & INITIAL_TABLES:
+        return
+    missing = INITIAL_TABLES - tables
+    if missing:
+        raise click.ClickException(
+            f'The database has no migration version and lacks {", ".join(sorted(missing))}; '
+            f'bring it to the 0001 schema and run `flask db stamp 0001` first.')
+    click.echo('Unversioned schema from db.create_all() found, stamping it as 0001.')
+    command.stamp(config, '0001')
+
+
+@db_cli.command('upgrade')
+@click.argument('revision', default='head')
+def db_upgrade(revision):
+    """
+    Upgrade the schema to REVISION (default: head). A schema created by
+    db.create_all() is stamped as 0001 first.
+    """
+    from alembic import command
+    config = _alembic_config()
+    _stamp_unversioned_schema(config)
+    command.upgrade(config, revision)
+
+
+@db_cli.command('downgrade')
+@click.argument('revision')
+def db_downgrade(revision):
+    """Downgrade the schema to REVISION."""
+    from alembic import command
+    command.downgrade(_alembic_config(), revision)
+
+
+@db_cli.command('stamp')
+@click.argument('revision', default='head')
+def db_stamp(revision):
+    """Mark the database as being at REVISION without running migrations."""
+    from alembic import command
+    command.stamp(_alembic_config(), revision)
+
+
+@content_cli.command('seed')
+def content_seed():
+    """Insert or update sections, subsections, topics and questions."""
+    from app.utils import seed_content
+    seed_content()
+    click.echo('Content seeded.')
+
+
+@speaking_cli.command('rescore')
+@click.option('--checkpoint', 'checkpoint_path', default='rescore-checkpoint.json', show_default=True,
+              help='Progress file; a run with an existing one continues where it stopped.')
+@click.option('--since', type=click.DateTime(), help='Only attempts made at or after this time (UTC).')
+@click.option('--limit', type=int, help='Stop after this many attempts.')
+@click.option('--rate', type=click.FloatRange(0, min_open=True), default=30, show_default=True,
+              help='Attempts started per minute, each one ChatGPT call plus any follow-ups.')
+@click.option('--threads', type=click.IntRange(1), default=4, show_default=True,
+              help='Attempts evaluated at once.')
+@click.option('--batch-size', type=click.IntRange(1), default=200, show_default=True,
+              help='Attempts read from the database at a time.')
+@click.option('--dry-run', is_flag=True, help='Compute the new scores without saving them.')
+def speaking_rescore(checkpoint_path, since, limit, rate, threads, batch_size, dry_run):
+    """
+    Re-score past attempts with the current prompt, models and score formula.
+
+    The stored transcripts and pronunciation assessments are evaluated again,
+    so only ChatGPT is called; Whisper and Azure are not.
+    """
+    from app.rescoring import SCORE_COLUMNS, Checkpoint, rescore_attempts
+
+    try:
+        checkpoint = Checkpoint.load(checkpoint_path, dry_run)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if checkpoint.last_id:
+        click.echo(f'Resuming after attempt {checkpoint.last_id}.')
+
+    checkpoint = rescore_attempts(checkpoint, since=since, limit=limit, per_minute=rate,
+                                  threads=threads, batch_size=batch_size, report=click.echo)
+
+    rescored = checkpoint.counts['changed'] + checkpoint.counts['unchanged']
+    click.echo(f"{rescored} attempts re-scored, {checkpoint.counts['changed']} changed, "
+               f"{checkpoint.counts['incomplete']} incomplete, {checkpoint.counts['failed']} failed, "
+               f"up to attempt {checkpoint.last_id}.")
+    if rescored:
+        click.echo('Average change: ' + ', '.join(
+            f'{key} {checkpoint.shift[key] / rescored:+.2f}' for key in SCORE_COLUMNS))
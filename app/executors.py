@@ -0,0 +1,104 @@
+import atexit
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from flask import current_app
+
+from app.metrics import EXECUTOR_TASKS
+from app.profiler import sample_thread
+
+# executor name -> config key with its number of threads
+EXECUTORS = {
+    'transcription': 'TRANSCRIPTION_EXECUTOR_WORKERS',  # Whisper requests
+    'assessment': 'ASSESSMENT_EXECUTOR_WORKERS',  # Azure pronunciation requests
+    'transcode': 'TRANSCODE_EXECUTOR_WORKERS',  # ffmpeg processes
+    'llm': 'LLM_EXECUTOR_WORKERS',  # ChatGPT requests
+}
+
+
+class NamedExecutor(ThreadPoolExecutor):
+    """
+    Process-wide thread pool for one kind of external call.
+
+    Counts the tasks waiting for a thread and the ones running, so the pools
+    can be watched under load. Tasks run in a copy of the submitter's context,
+    so they belong to the submitter's trace and profile. Tasks submitted here must not wait on tasks of
+    the same executor, or a saturated pool deadlocks.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f'{name}-executor')
+        self.name = name
+        self.max_workers = max_workers
+        self.active = 0
+        self.queued = 0
+        self._counts_lock = threading.Lock()
+        self._active_gauge = EXECUTOR_TASKS.labels(name, 'active')
+        self._queued_gauge = EXECUTOR_TASKS.labels(name, 'queued')
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        with self._counts_lock:
+            self.queued += 1
+        self._queued_gauge.inc()
+        try:
+            return super().submit(self._run, contextvars.copy_context(), fn, *args, **kwargs)
+        except RuntimeError:
+            with self._counts_lock:
+                self.queued -= 1
+            self._queued_gauge.dec()
+            raise
+
+    def _run(self, context: contextvars.Context, fn: Callable, *args, **kwargs):
+        with self._counts_lock:
+            self.queued -= 1
+            self.active += 1
+        self._queued_gauge.dec()
+        self._active_gauge.inc()
+        try:
+            with sample_thread(context):
+                return context.run(fn, *args, **kwargs)
+        finally:
+            with self._counts_lock:
+                self.active -= 1
+            self._active_gauge.dec()
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return {'max_workers': self.max_workers, 'active': self.active,
+                    'queued': self.queued}
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def init_executors(config) -> None:
+    """Create the executors sized from config; called once per gunicorn worker."""
+    with _executors_lock:
+        if _executors:
+            return
+        for name, config_key in EXECUTORS.items():
+            _executors[name] = NamedExecutor(name, config[config_key])
+        atexit.register(shutdown_executors)
+
+
+def get_executor(name: str) -> NamedExecutor:
+    """Return the named executor, creating all of them on first use outside gunicorn."""
+    if not _executors:
+        init_executors(current_app.config)
+    return _executors[name]
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Let running and queued tasks finish, then stop the threads."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def executor_stats() -> dict:
+    return {name: executor.stats() for name, executor in _executors.items()}
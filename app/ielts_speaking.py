@@ -1,31 +1,29 @@
 import base64
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import Optional
 from collections import namedtuple
 
-from openai import OpenAI
-
-client = OpenAI()
 import requests
 from flask import abort, flash
-from tenacity import retry, stop_after_attempt, wait_fixed, RetryError
 from werkzeug.datastructures import FileStorage
 
-from app.models import QuestionSet
+from app.catalog import CatalogQuestionSet
+from app.metrics import backend_call
+from app.pipeline import Pipeline, RetryPolicy, Stage, StageError
+from app.services import services
 from app.utils import get_chunk, convert_audio_to_opus_bytesio, \
-    get_dialog_text, add_pronunciation_score, add_fluency_and_coherence_score, measure_time
+    get_dialog_text, add_pronunciation_score, add_fluency_and_coherence_score
 
 
-@measure_time
-def evaluate_ielts_speaking(question_set: QuestionSet, audio_files_list: list) -> tuple:
+def evaluate_ielts_speaking(question_set: CatalogQuestionSet, audio_files_list: list) -> tuple:
     """Evaluate IELTS speaking responses with transcript generation and pronunciation assessment.
 
-    This function transcribes audio responses to IELTS speaking questions,
-    validates that all questions have been answered, and then evaluates the
-    responses using ChatGPT and Azure's pronunciation API.
+    This function runs LEGACY_SPEAKING_PIPELINE: it transcribes audio responses
+    to IELTS speaking questions, validates that all questions have been answered,
+    and then evaluates the responses using ChatGPT and Azure's pronunciation API
+    in parallel.
 
     Args:
         question_set (object): The set of IELTS speaking questions.
@@ -36,57 +34,48 @@ def evaluate_ielts_speaking(question_set: QuestionSet, audio_files_list: list) -
                the second is the question-answer data with pronunciation assessments.
 
     Raises:
-        RetryError: If all attempts to transcribe the audio files fail.
         HTTPException: If a user doesn't answer all questions (HTTP 400) or
-                       if an error occurs during the transcription process (HTTP 500).
+                       if an error occurs during the evaluation (HTTP 500).
     """
-    # Transcribe all audio files, retrying as necessary
-    try:
-        transcriptions_list = transcribe_audio_files_in_bulk(audio_files_list)
-    except RetryError as e:
-        print('Failed to transcribe all audio files after multiple attempts. Last attempt:', e.last_attempt)
-        flash('An error occurred while transcribing the audio files. Please try again.')
-        abort(500)
-
-    # Validate that all questions have received an answer
-    if not all(transcriptions_list):
-        flash('It seems you did not answer all the questions, please try again')
-        abort(400)
-
-    # Combine audio files, transcriptions, and questions into a tuple of dictionaries
-    zipped = zip(audio_files_list, transcriptions_list, question_set.questions)
-    answers_data = tuple({'answer_audio': file,
-                          'answer_transcription': transcript,
-                          'question': question}
-                         for file, transcript, question in zipped)
-
     # Collect attempt info for future needs
     Attempt = namedtuple('Attempt', ('subsection', 'question_set', 'topic'))
     attempt = Attempt(question_set.subsection, question_set, question_set.topic)
 
-    # Evaluate the spoken responses using ChatGPT and Azure's pronunciation API
-    gpt_speech_evaluation, answers_data = get_chatgpt_and_azure_speech_assessment(answers_data, attempt)
-    add_pronunciation_score(gpt_speech_evaluation, answers_data)
-    add_fluency_and_coherence_score(gpt_speech_evaluation, answers_data)
+    try:
+        run = LEGACY_SPEAKING_PIPELINE.run(audio_files=audio_files_list,
+                                           question_set=question_set,
+                                           attempt=attempt)
+    except StageError as e:
+        # Validate that all questions have received an answer
+        if isinstance(e.cause, UnansweredQuestionsError):
+            flash('It seems you did not answer all the questions, please try again')
+            abort(400)
+        print(e)
+        if e.stage == 'transcribe':
+            flash('An error occurred while transcribing the audio files. Please try again.')
+        else:
+            flash('An error has occurred, please try again')
+        abort(500)
 
-    return gpt_speech_evaluation, answers_data
+    return run['speaking_result'], run['answers_data']
 
 
-@measure_time
-def transcribe_audio_files_in_bulk(audio_files: list) -> tuple:
-    """Transcribe multiple audio files in parallel.
+def get_answers_data(audio_files: list, transcriptions: tuple, question_set: CatalogQuestionSet) -> tuple:
+    """Combine audio files, transcriptions, and questions into a tuple of dictionaries.
 
-    Args:
-        audio_files (list): A list of audio files to transcribe.
-
-    Returns:
-        tuple: A tuple containing transcriptions of all the audio files.
+    Raises:
+        UnansweredQuestionsError: If any answer has no transcription.
     """
-    with ThreadPoolExecutor() as executor:
-        return tuple(executor.map(transcribe_single_audio_file, audio_files))
+    if not all(transcriptions):
+        raise UnansweredQuestionsError()
+
+    zipped = zip(audio_files, transcriptions, question_set.questions)
+    return tuple({'answer_audio': file,
+                  'answer_transcription': transcript,
+                  'question': question}
+                 for file, transcript, question in zipped)
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
 def transcribe_single_audio_file(audio_file: FileStorage) -> Optional[str]:
     """Transcribe a single audio file using the OpenAI Whisper API.
 
@@ -95,14 +84,13 @@ def transcribe_single_audio_file(audio_file: FileStorage) -> Optional[str]:
 
     Returns:
         str: The transcribed text if successful, 'None' if not.
-
-    Raises:
-        RetryError: If all attempts to transcribe the audio file fail.
     """
+    audio_file.seek(0)
     audio_file.name = "audio.webm"
-    audio_transcript = client.audio.transcribe(model="whisper-1",
-                                               file=audio_file,
-                                               language="en")
+    with backend_call('whisper'):
+        audio_transcript = services.get('openai').audio.transcribe(model="whisper-1",
+                                                   file=audio_file,
+                                                   language="en")
     audio_file.seek(0)
     audio_transcript = audio_transcript.get("text")
     if not audio_transcript or audio_transcript in ('you', 'Thank you.'):
@@ -110,29 +98,15 @@ def transcribe_single_audio_file(audio_file: FileStorage) -> Optional[str]:
     return audio_transcript
 
 
-def get_chatgpt_and_azure_speech_assessment(answers_data: tuple, attempt: namedtuple) -> tuple:
-    """Perform parallel assessment of user answers using ChatGPT and Azure's pronunciation assessment.
-
-    Args:
-        answers_data (tuple): A tuple containing data for each question-answer pair.
-        attempt (namedtuple): A dict with subsection, question_set and topic
-
-    Returns:
-        tuple: A tuple containing the updated question-answer data and the ChatGPT speech evaluation.
-    """
-    with ThreadPoolExecutor() as executor:
-        chatgpt_assessment_future = executor.submit(
-            evaluate_speech_with_chatgpt, answers_data, attempt)
-        azure_pronunciation_assessment_future = executor.submit(
-            assess_pronunciation_in_bulk, answers_data)
-
-        gpt_speaking_eval = chatgpt_assessment_future.result()
-        answers_data = azure_pronunciation_assessment_future.result()
-
-    return gpt_speaking_eval, answers_data
+def add_scores(gpt_speech_evaluation: dict, answers_data: tuple, pronunciation_assessments: tuple) -> dict:
+    """Add the Azure based pronunciation and fluency scores to the ChatGPT evaluation."""
+    for answer_data, assessment in zip(answers_data, pronunciation_assessments):
+        answer_data['pronunciation_assessment'] = assessment
+    add_pronunciation_score(gpt_speech_evaluation, answers_data)
+    add_fluency_and_coherence_score(gpt_speech_evaluation, answers_data)
+    return gpt_speech_evaluation
 
 
-@measure_time
 def evaluate_speech_with_chatgpt(answers_data: tuple, attempt: namedtuple) -> dict:
     """Evaluate a user's speech using ChatGPT.
 
@@ -144,7 +118,6 @@ def evaluate_speech_with_chatgpt(answers_data: tuple, attempt: namedtuple) -> di
         dict: A dictionary containing the ChatGPT evaluation.
 
     Raises:
-        RetryError: If all attempts to get a response from ChatGPT fail.
         JSONDecodeError: If there is an error deserializing the JSON response from ChatGPT.
     """
     system_message = "You act as a professional IELTS examiner."
@@ -175,24 +148,11 @@ Your answer should be a straightforward JSON object without extra spaces or line
         {"role": "user", "content": prompt}
     ]
 
-    # Getting a response from ChatGPT
-    try:
-        chatgpt_response_text = get_chatgpt_response(chatgpt_messages)
-    except RetryError as e:
-        print("All attempts failed. Last attempt:", e.last_attempt)
-        flash("An error has occurred, please try again")
-        abort(500)
-
-    # Deserializing JSON and return result
-    try:
-        return json.loads(chatgpt_response_text)
-    except json.decoder.JSONDecodeError:
-        print("JSON deserialization error")
-        flash("An error has occurred, please try again")
-        abort(500)
+    # Getting a response from ChatGPT and deserializing it, errors are retried by the pipeline
+    chatgpt_response_text = get_chatgpt_response(chatgpt_messages)
+    return json.loads(chatgpt_response_text)
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
 def get_chatgpt_response(messages: list, model="gpt-3.5-turbo", temperature=0) -> str:
     """Get a response from ChatGPT.
 
@@ -204,62 +164,39 @@ def get_chatgpt_response(messages: list, model="gpt-3.5-turbo", temperature=0) -
     Returns:
         str: The text content of the response from ChatGPT.
 
-    Raises:
-        RetryError: If all attempts to get a response from ChatGPT fail.
-        JSONDecodeError: If there is an error deserializing the JSON response from ChatGPT.
     """
-    completion = client.chat.completions.create(model=model,
-    messages=messages,
-    temperature=temperature)
+    with backend_call('gpt'):
+        completion = services.get('openai').chat.completions.create(model=model,
+        messages=messages,
+        temperature=temperature)
     chatgpt_response_text = completion.choices[0].message["content"]
     return chatgpt_response_text
 
 
-@measure_time
-def assess_pronunciation_in_bulk(answers_data: tuple) -> tuple:
-    """Assess pronunciation for multiple audio responses in parallel using Azure's pronunciation API.
-
-    Args:
-        answers_data (tuple): A tuple containing data for each question-answer pair.
-
-    Returns:
-        tuple: A tuple containing the updated question-answer data with pronunciation assessments.
-    """
-    with ThreadPoolExecutor() as executor:
-        executor.map(get_azure_pronunciation_assessment, answers_data)
-    return answers_data
-
-
-def get_azure_pronunciation_assessment(answer_data: dict) -> None:
+def get_azure_pronunciation_assessment(answer_data: dict) -> dict:
     """Request a pronunciation assessment for a single answer from Azure's pronunciation API.
 
     Args:
         answer_data (dict): A dictionary containing data for a single question-answer pair.
 
+    Returns:
+        dict: The pronunciation assessment.
+
     Raises:
-        RetryError: If all attempts to get a response from Azure's pronunciation API fail.
-        Exception: If an unexpected error occurs.
+        AzureRecognitionError: If Azure could not recognise the speech.
     """
+    answer_data['answer_audio'].seek(0)
     audio_file = convert_audio_to_opus_bytesio(answer_data['answer_audio'])
     transcription_text = answer_data['answer_transcription']
 
-    try:
-        pronunciation_evaluation = request_azure_pronunciation_assessment(
-            audio_file, transcription_text)
-    except RetryError as e:
-        print('All attempts failed. Last attempt:', e.last_attempt)
-        flash('An error has occurred, please try again')
-        abort(500)
-    else:
-        if pronunciation_evaluation['RecognitionStatus'] != 'Success':
-            print('RecognitionStatus != Success')
-            flash('An error occurred while trying to transcribe your speech, please try again.')
-            abort(500)
-        else:
-            answer_data['pronunciation_assessment'] = pronunciation_evaluation
+    pronunciation_evaluation = request_azure_pronunciation_assessment(
+        audio_file, transcription_text)
+    if pronunciation_evaluation['RecognitionStatus'] != 'Success':
+        print('RecognitionStatus != Success')
+        raise AzureRecognitionError(pronunciation_evaluation['RecognitionStatus'])
+    return pronunciation_evaluation
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
 def request_azure_pronunciation_assessment(audio_file: BytesIO,
                                            transcript: str) -> dict:
     """Send a request to Azure's pronunciation API to assess the pronunciation of a transcribed audio file.
@@ -270,13 +207,11 @@ def request_azure_pronunciation_assessment(audio_file: BytesIO,
 
     Returns:
         dict: A dictionary containing the pronunciation assessment.
-
-    Raises:
-        RetryError: If all attempts to get a response from Azure's pronunciation API fail.
     """
     language_code = "en-US"
     azure_region = "germanywestcentral"
     azure_api_key = os.getenv("AZURE_API_KEY")
+    azure_endpoint = os.getenv("AZURE_SPEECH_ENDPOINT", f"https://{azure_region}.stt.speech.microsoft.com")
 
     pronunciation_assessment_params = json.dumps({
         "ReferenceText": transcript,
@@ -288,7 +223,7 @@ def request_azure_pronunciation_assessment(audio_file: BytesIO,
     pronunciation_assessment_params = base64.b64encode(
         pronunciation_assessment_params.encode('utf-8')).decode("utf-8")
 
-    azure_api_url = f"https://{azure_region}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1?language={language_code}&usePipelineVersion=0"
+    azure_api_url = f"{azure_endpoint}/speech/recognition/conversation/cognitiveservices/v1?language={language_code}&usePipelineVersion=0"
     azure_api_headers = {
         'Accept': 'application/json;text/xml',
         'Connection': 'Keep-Alive',
@@ -299,8 +234,40 @@ def request_azure_pronunciation_assessment(audio_file: BytesIO,
         'Expect': '100-continue'
     }
 
-    azure_api_response = requests.post(url=azure_api_url,
-                                       data=get_chunk(audio_file),
-                                       headers=azure_api_headers)
+    with backend_call('azure') as call:
+        call.set_attribute('bytes', audio_file.getbuffer().nbytes)
+        azure_api_response = requests.post(url=azure_api_url,
+                                           data=get_chunk(audio_file),
+                                           headers=azure_api_headers)
+        call.set_attribute('http.status_code', azure_api_response.status_code)
     audio_file.seek(0)
     return azure_api_response.json()
+
+
+class UnansweredQuestionsError(Exception):
+    pass
+
+
+class AzureRecognitionError(Exception):
+    pass
+
+
+_RETRY_API_CALL = RetryPolicy(attempts=5, wait_seconds=1)
+
+LEGACY_SPEAKING_PIPELINE = Pipeline('ielts_speaking', [
+    Stage('transcribe', transcribe_single_audio_file,
+          inputs=('audio_files',), outputs=('transcriptions',), map_over=('audio_files',),
+          backend='whisper', executor='transcription', timeout=120, retry=_RETRY_API_CALL),
+    Stage('answers', get_answers_data,
+          inputs=('audio_files', 'transcriptions', 'question_set'), outputs=('answers_data',)),
+    Stage('llm_evaluate', evaluate_speech_with_chatgpt,
+          inputs=('answers_data', 'attempt'), outputs=('gpt_speech_evaluation',),
+          backend='gpt', executor='llm', timeout=180, retry=_RETRY_API_CALL),
+    Stage('assess_pronunciation', get_azure_pronunciation_assessment,
+          inputs=('answers_data',), outputs=('pronunciation_assessments',),
+          map_over=('answers_data',), backend='azure', executor='assessment', timeout=180,
+          retry=RetryPolicy(attempts=5, wait_seconds=1, give_up_on=(AzureRecognitionError,))),
+    Stage('score', add_scores,
+          inputs=('gpt_speech_evaluation', 'answers_data', 'pronunciation_assessments'),
+          outputs=('speaking_result',)),
+])
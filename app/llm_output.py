@@ -0,0 +1,145 @@
+import json
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Annotated
+
+from pydantic import BaseModel, Field, StringConstraints, TypeAdapter, ValidationError
+
+from app.metrics import LLM_OUTPUT_REPAIRS
+
+SCORE_FIELDS = ('coherence', 'lexicalResource', 'grammaticalRangeAndAccuracy')
+FEEDBACK_FIELD = 'generalFeedback'
+FIELDS = SCORE_FIELDS + (FEEDBACK_FIELD,)
+FEEDBACK_MAX_LENGTH = 300
+
+_CODE_FENCE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL | re.IGNORECASE)
+
+
+Feedback = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1,
+                                            max_length=FEEDBACK_MAX_LENGTH)]
+
+
+class CriterionScore(BaseModel):
+    score: int = Field(ge=0, le=9)
+
+
+class SpeakingEvaluation(BaseModel):
+    """The evaluation ChatGPT returns, RESPONSE_JSON_SCHEMA in app/prompts.py."""
+    coherence: CriterionScore
+    lexicalResource: CriterionScore
+    grammaticalRangeAndAccuracy: CriterionScore
+    generalFeedback: Feedback
+
+
+# fields are validated one by one, so the valid ones need not be asked for again
+_FIELD_ADAPTERS = {**{name: TypeAdapter(CriterionScore) for name in SCORE_FIELDS},
+                   FEEDBACK_FIELD: TypeAdapter(Feedback)}
+
+
+class MalformedEvaluationError(ValueError):
+    """The reply still lacks valid fields after repairs and follow-up questions."""
+
+    def __init__(self, missing: tuple):
+        super().__init__(f'ChatGPT evaluation is missing valid {", ".join(missing)}')
+        self.missing = missing
+
+
+@dataclass
+class ParsedEvaluation:
+    """
+    The usable part of a reply.
+
+    Attributes:
+    - values: Fields that passed validation, after local repairs.
+    - missing: Fields that are absent or invalid, to be asked for again.
+    - repairs: Defects fixed locally, e.g. 'code_fence' or 'score_clamped'.
+    """
+    values: dict
+    missing: tuple
+    repairs: list = field(default_factory=list)
+
+
+def parse_evaluation(text: str, fields: tuple = FIELDS) -> ParsedEvaluation:
+    """
+    Validate a ChatGPT reply against SpeakingEvaluation, repairing what can
+    be repaired without asking again: code fences, text around the JSON
+    object, scores given as strings, floats or bare numbers, scores outside
+    0-9 and feedback over the length limit. Only `fields` are expected, for
+    replies to a follow-up that asked for some of them.
+    """
+    repairs = []
+    data = _extract_object(text, repairs)
+    values, missing = {}, []
+    for name in fields:
+        adapter = _FIELD_ADAPTERS[name]
+        try:
+            value = adapter.validate_python(_repair_field(name, data.get(name), repairs))
+        except ValidationError:
+            missing.append(name)
+            continue
+        values[name] = adapter.dump_python(value)
+
+    for repair in repairs:
+        LLM_OUTPUT_REPAIRS.labels(repair).inc()
+    return ParsedEvaluation(values, tuple(missing), repairs)
+
+
+def _extract_object(text: str, repairs: list) -> dict:
+    """The first JSON object in text, {} if there is none."""
+    fenced = _CODE_FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+        repairs.append('code_fence')
+    start = text.find('{')
+    if start == -1:
+        return {}
+    try:
+        data, end = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return {}
+    if text[:start].strip() or text[end:].strip():
+        repairs.append('surrounding_text')
+    return data if isinstance(data, dict) else {}
+
+
+def _repair_field(name: str, value, repairs: list):
+    if name == FEEDBACK_FIELD:
+        if isinstance(value, str) and len(value.strip()) > FEEDBACK_MAX_LENGTH:
+            repairs.append('feedback_trimmed')
+            # cut at the last sentence, or word, that fits
+            value = value.strip()[:FEEDBACK_MAX_LENGTH]
+            cut = max(value.rfind('. '), value.rfind('! ')) + 1 or value.rfind(' ')
+            value = value[:cut].rstrip() if cut > 0 else value
+        return value
+
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        value = {'score': value}  # "coherence": 7
+        repairs.append('score_unwrapped')
+    if not isinstance(value, dict):
+        return value
+    score = value.get('score')
+    if isinstance(score, str):
+        try:
+            score = float(score.strip())
+        except ValueError:
+            return value
+        repairs.append('score_coerced')
+    if isinstance(score, float):
+        if not math.isfinite(score):
+            return value  # NaN or Infinity, left to fail validation
+        if score != round(score):
+            repairs.append('score_coerced')
+        score = round(score)
+    if isinstance(score, int) and not isinstance(score, bool) and not 0 <= score <= 9:
+        score = min(max(score, 0), 9)
+        repairs.append('score_clamped')
+    return {**value, 'score': score}
+
+
+def reask_message(missing: tuple) -> dict:
+    """The follow-up asking only for the fields that were missing or invalid."""
+    names = ', '.join(f'"{name}"' for name in missing)
+    return {"role": "user",
+            "content": f"Your answer lacked valid values for {names}. Reply with a JSON object "
+                       f"containing only {names}, following the same JSON schema."}
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, TypeVar
+
+from flask import current_app
+
+from app.metrics import LLM_MODEL_CALL_SECONDS, LLM_MODEL_FAILOVERS
+from app.tracing import current_span
+
+T = TypeVar('T')
+
+DEFAULT_PART = '*'
+SLOW_SHARE = 0.1  # of calls over slow_seconds makes a model slow, i.e. its 90th percentile is
+
+
+def parse_model_table(text: str) -> dict:
+    """
+    Parse LLM_MODELS, e.g. '*=gpt-3.5-turbo,gpt-4o-mini;3=gpt-4o-mini,gpt-3.5-turbo':
+    per speaking part the primary model and its alternates in order of
+    preference, '*' for the parts not listed.
+    """
+    table = {}
+    for entry in filter(None, (e.strip() for e in text.split(';'))):
+        part, _, models = entry.partition('=')
+        part = part.strip()
+        models = [m.strip() for m in models.split(',') if m.strip()]
+        if not models or not (part == DEFAULT_PART or part.isdigit()):
+            raise ValueError(f'Invalid LLM_MODELS entry {entry!r}')
+        table[part if part == DEFAULT_PART else int(part)] = tuple(models)
+    return table
+
+
+class ModelHealth:
+    """
+    The latest calls to one model within the last `window` seconds, in this process.
+
+    Attributes:
+    - window: Seconds a call counts for.
+    - max_calls: Calls kept, the newest.
+    """
+
+    def __init__(self, window: float, max_calls: int = 100):
+        self.window = window
+        self._calls = deque(maxlen=max_calls)  # (finished at, seconds, failed)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, seconds, failed))
+            self._expire(now)
+
+    def stats(self, slow_seconds: float) -> tuple[int, float, float]:
+        """Number of calls, and the shares of them that failed and that took over slow_seconds."""
+        with self._lock:
+            self._expire(time.monotonic())
+            calls = list(self._calls)
+        if not calls:
+            return 0, 0.0, 0.0
+        errors = sum(failed for _, _, failed in calls)
+        slow = sum(seconds > slow_seconds for _, seconds, _ in calls)
+        return len(calls), errors / len(calls), slow / len(calls)
+
+    def _expire(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+
+class ModelRouter:
+    """
+    Chooses the ChatGPT model for a speaking part and fails over between models.
+
+    Every part has a list of models in `table`, the primary first. A model is
+    passed over while it is unhealthy: at least `min_calls` calls in the
+    health window, and more than `max_error_rate` of them failed or the 90th
+    percentile took over `slow_seconds`. Its calls age out of the window
+    while it is passed over, so it gets traffic again after `window` seconds
+    and stays in use if it has recovered. When all models are unhealthy the
+    first configured one is used.
+
+    A call that fails is retried right away with the next healthy model, an
+    unhealthy one is never a fallback. Health is per gunicorn worker, like
+    the admission limits.
+
+    Attributes:
+    - table: Speaking part ('*' for any other) -> models in order of preference.
+    """
+
+    def __init__(self, table: dict, window: float = 120, min_calls: int = 5,
+                 max_error_rate: float = 0.5, slow_seconds: float = 30):
+        self.table = table
+        self.window = window
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.slow_seconds = slow_seconds
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def health(self, model: str) -> ModelHealth:
+        with self._lock:
+            if model not in self._health:
+                self._health[model] = ModelHealth(self.window)
+            return self._health[model]
+
+    def is_healthy(self, model: str) -> bool:
+        calls, error_rate, slow_rate = self.health(model).stats(self.slow_seconds)
+        return calls < self.min_calls or (error_rate <= self.max_error_rate
+                                          and slow_rate <= SLOW_SHARE)
+
+    def models(self, part_number: int) -> list:
+        """The models to try for a part, healthy ones first."""
+        configured = self.table.get(part_number) or self.table.get(DEFAULT_PART)
+        if not configured:
+            raise LookupError(f'No ChatGPT model is configured for part {part_number}')
+        healthy = [model for model in configured if self.is_healthy(model)]
+        if healthy and healthy[0] != configured[0]:
+            LLM_MODEL_FAILOVERS.labels(configured[0], 'unhealthy').inc()
+        return healthy + [model for model in configured if model not in healthy]
+
+    def call(self, part_number: int, func: Callable[..., T],
+             models: Optional[list] = None) -> tuple[T, str]:
+        """
+        Call func(model=...) with the models for the part until one succeeds.
+        After the first model only healthy ones are tried.
+
+        Parameters:
+        - part_number (int): The speaking part the call is for.
+        - func (Callable): The call, taking the model as a keyword argument.
+        - models (list): Models to use instead of the routed ones, e.g. to
+          continue a conversation with the model that started it.
+
+        Returns:
+        - tuple: The result of func and the model that produced it.
+
+        Raises:
+        - Exception: What the last model raised, when all of them failed.
+        """
+        models = models or self.models(part_number)
+        models = models[:1] + [model for model in models[1:] if self.is_healthy(model)]
+        for i, model in enumerate(models):
+            started = time.perf_counter()
+            try:
+                result = func(model=model)
+            except Exception:
+                seconds = time.perf_counter() - started
+                self.health(model).record(seconds, failed=True)
+                LLM_MODEL_CALL_SECONDS.labels(model, 'error').observe(seconds)
+                if i == len(models) - 1:
+                    raise
+                LLM_MODEL_FAILOVERS.labels(model, 'error').inc()
+                current_span().set_attribute('failed_over_from', model)
+                continue
+            seconds = time.perf_counter() - started
+            self.health(model).record(seconds, failed=False)
+            LLM_MODEL_CALL_SECONDS.labels(model, 'ok').observe(seconds)
+            return result, model
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            config = current_app.config
+            _router = ModelRouter(parse_model_table(config['LLM_MODELS']),
+                                  window=config['LLM_HEALTH_WINDOW_SECONDS'],
+                                  min_calls=config['LLM_HEALTH_MIN_CALLS'],
+                                  max_error_rate=config['LLM_MAX_ERROR_RATE'],
+                                  slow_seconds=config['LLM_SLOW_SECONDS'])
+        return _router
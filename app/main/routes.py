@@ -1,10 +1,14 @@
-from flask import render_template, request, redirect, url_for
+from functools import partial
+
+from flask import current_app, render_template, request, redirect, url_for
 from flask_login import login_required, current_user
 
-from app.ielts_speaking import evaluate_ielts_speaking
-from app.speaking_eval import SpeechEvaluator
+from app.admission import get_admission_controller, AdmissionRejected
+from app.catalog import get_catalog
 from app.main import bp
+from app.memory import estimate_evaluation_memory
 from app.models import *
+from app.submissions import evaluations, IdempotencyKeyReused
 from app.utils import get_current_subsection_and_last_topic, get_practice_data, \
     get_audio_files, save_speaking_results_to_database, send_amplitude_event
 
@@ -19,8 +23,8 @@ def index():
 @bp.route('/section/<name>')
 @login_required
 def render_section(name):
-    section = Section.get_by_name(name)
-    subsections = section.get_user_subsections_progress(current_user)
+    section = get_catalog().section_by_name(name) or abort(404)
+    subsections = current_user.get_subsections_progress(section)
 
     return render_template("section.html",
                            section=section,
@@ -31,7 +35,7 @@ def render_section(name):
 @login_required
 def speaking_practice_get():
     # Retrieve the 'speaking' section
-    section = Section.get_by_name("speaking")
+    section = get_catalog().section_by_name("speaking")
     # Get the current user's progress in this section
     user_progress = current_user.get_section_progress(section.id)
     # Determine the current subsection and last topic based on user's progress
@@ -48,6 +52,9 @@ def speaking_practice_get():
 @bp.route('/section/speaking/practice', methods=["POST"])
 @login_required
 def speaking_practice_post():
+    # the evaluation pipeline and its API clients are only needed here
+    from app.speaking_eval import SpeechEvaluator
+
     # Retrieving and checking questions_set from the request
     question_set_id = request.form.get('question_set_id')
     questions_set = QuestionSet.validate_question_set(question_set_id)
@@ -56,7 +63,22 @@ def speaking_practice_post():
     audio_files = get_audio_files(questions_set)
 
     speech_evaluator = SpeechEvaluator(questions_set, audio_files)
-    speaking_results = speech_evaluator.evaluate_speaking()
+
+    # A double click or a browser retry attaches to the evaluation already
+    # running (or finished) for the same answers instead of paying for another
+    submission = (current_user.id, questions_set.id, speech_evaluator.audio_digest)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    try:
+        speaking_results = evaluations.run(
+            submission, partial(evaluate_admitted, speech_evaluator),
+            idempotency_key=idempotency_key and (current_user.id, idempotency_key),
+            ttl=current_app.config['SUBMISSION_RESULT_TTL_SECONDS'])
+    except IdempotencyKeyReused:
+        flash("An error has occurred, please try again")
+        abort(422, "Idempotency key was already used for different answers.")
+    except AdmissionRejected as e:
+        flash("We are evaluating too many answers right now, please try again in a minute")
+        abort(e.status, e.reason, retry_after=e.retry_after)
 
     return render_template("dashboard.html")
 
@@ -86,6 +108,13 @@ def speaking_practice_post():
     #                         user_subsection_attempt_id=subsection_attempt.id))
 
 
+def evaluate_admitted(speech_evaluator):
+    """Run the evaluation once the admission controller gives it a slot."""
+    memory = estimate_evaluation_memory(speech_evaluator.audio_bytes)
+    with get_admission_controller().admit(current_user.id, memory):
+        return speech_evaluator.evaluate_speaking()
+
+
 @bp.route('/section/speaking/attempt/<int:user_subsection_attempt_id>/')
 @login_required
 def get_speaking_attempt(user_subsection_attempt_id):
@@ -96,7 +125,7 @@ def get_speaking_attempt(user_subsection_attempt_id):
 
     # check that the user requests his answer
     user_progress = user_subsection_attempt.user_progress
-    if current_user != user_progress.user:
+    if current_user.id != user_progress.user_id:
         abort(403)
 
     # Your results
@@ -104,7 +133,7 @@ def get_speaking_attempt(user_subsection_attempt_id):
     speaking_scores = result.get_speaking_scores()
 
     # Advanced Pronunciation Analysis
-    answers = user_subsection_attempt.get_transcribed_user_answers
+    answers = user_subsection_attempt.user_answers
     pron_scores = user_subsection_attempt.get_overall_pron_scores()
 
     return render_template('subsection_results.html', result=result,
@@ -152,7 +181,7 @@ def reset_section_progress():
     # Retrieve section
     section_name = request.form.get('section_name')
     if section_name:
-        section = Section.get_by_name(section_name)
+        section = get_catalog().section_by_name(section_name) or abort(404)
         # Get the current user's progress in this section
         user_progress = current_user.get_section_progress(section.id)
         if user_progress:
@@ -0,0 +1,170 @@
+import contextvars
+import os
+import resource
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import current_app
+
+from app.metrics import (AUDIO_BUFFER_BYTES, EVALUATION_AUDIO_BYTES, EVALUATION_RSS_GROWTH_BYTES,
+                         PROCESS_PEAK_RSS_BYTES, PROCESS_RSS_BYTES)
+
+_current_usage: contextvars.ContextVar[Optional['EvaluationMemory']] = contextvars.ContextVar(
+    'evaluation_memory', default=None)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # no procfs (macOS): the peak so far is the best available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class EvaluationMemory:
+    """
+    Memory held by one evaluation.
+
+    Audio buffers created while `tracking()` is active, in the request or in
+    the executor threads working for it, are counted until they are freed.
+    RSS is sampled by the process-wide RssSampler during `evaluating()`; as
+    evaluations share the process, its growth is an upper bound for one.
+
+    Attributes:
+    - audio_bytes: Bytes held by the evaluation's live audio buffers.
+    - peak_audio_bytes: Most bytes held at once.
+    - start_rss: RSS when the evaluation started.
+    - peak_rss: Largest RSS sampled while it ran.
+    """
+
+    def __init__(self):
+        self.audio_bytes = 0
+        self.peak_audio_bytes = 0
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int) -> None:
+        with self._lock:
+            self.audio_bytes += nbytes
+            self.peak_audio_bytes = max(self.peak_audio_bytes, self.audio_bytes)
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self.audio_bytes -= nbytes
+
+    def observe_rss(self, rss: int) -> None:
+        self.peak_rss = max(self.peak_rss, rss)
+
+    @contextmanager
+    def tracking(self):
+        """Account audio buffers created inside the with block to this evaluation."""
+        token = _current_usage.set(self)
+        try:
+            yield self
+        finally:
+            _current_usage.reset(token)
+
+    @contextmanager
+    def evaluating(self):
+        """Track buffers and sample RSS while the evaluation runs, then record the peaks."""
+        sampler = get_rss_sampler()
+        self.start_rss = self.peak_rss = current_rss()
+        sampler.watch(self)
+        try:
+            with self.tracking():
+                yield self
+        finally:
+            sampler.unwatch(self)
+            self.observe_rss(current_rss())
+            EVALUATION_AUDIO_BYTES.observe(self.peak_audio_bytes)
+            EVALUATION_RSS_GROWTH_BYTES.observe(self.peak_rss - self.start_rss)
+
+    def summary(self) -> dict:
+        return {'peak_audio_bytes': self.peak_audio_bytes, 'start_rss': self.start_rss,
+                'peak_rss': self.peak_rss}
+
+
+def estimate_evaluation_memory(audio_bytes: int) -> int:
+    """
+    Bytes to reserve for evaluating answers of audio_bytes: the buffers and
+    their transcoded copies, plus what the API responses, the prompt and the
+    results take regardless of the audio. Compare with the
+    ielts_evaluation_rss_growth_bytes histogram when tuning the settings.
+    """
+    config = current_app.config
+    return int(config['EVALUATION_MEMORY_OVERHEAD_MB'] * 1024 * 1024
+               + config['EVALUATION_MEMORY_PER_AUDIO_BYTE'] * audio_bytes)
+
+
+def track_buffer(buffer, nbytes: int) -> None:
+    """Count a new audio buffer's bytes for the process and the current evaluation until it is freed."""
+    usage = _current_usage.get()
+    AUDIO_BUFFER_BYTES.inc(nbytes)
+    if usage is not None:
+        usage.add(nbytes)
+    weakref.finalize(buffer, _release_buffer, usage, nbytes)
+
+
+def _release_buffer(usage: Optional[EvaluationMemory], nbytes: int) -> None:
+    AUDIO_BUFFER_BYTES.dec(nbytes)
+    if usage is not None:
+        usage.release(nbytes)
+
+
+class RssSampler:
+    """
+    Thread reading the process RSS every interval, started with the first
+    evaluation. Sets the RSS gauges and the peak of every running evaluation.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak_rss = 0
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, usage: EvaluationMemory) -> None:
+        with self._lock:
+            self._watched.add(usage)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, usage: EvaluationMemory) -> None:
+        with self._lock:
+            self._watched.discard(usage)
+
+    def _run(self) -> None:
+        while True:
+            rss = current_rss()
+            self.peak_rss = max(self.peak_rss, rss)
+            PROCESS_RSS_BYTES.set(rss)
+            PROCESS_PEAK_RSS_BYTES.set(self.peak_rss)
+            with self._lock:
+                watched = list(self._watched)
+            for usage in watched:
+                usage.observe_rss(rss)
+            time.sleep(self.interval)
+
+
+_sampler: Optional[RssSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def get_rss_sampler() -> RssSampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = RssSampler(current_app.config['MEMORY_SAMPLE_INTERVAL_MS'] / 1000)
+        return _sampler
@@ -0,0 +1,157 @@
+import hmac
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess, REGISTRY)
+
+from app.tracing import span
+
+# Under gunicorn every worker writes its values to files in
+# PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and /metrics adds them
+# up, so any worker can answer a scrape for all of them.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# External calls take seconds, page requests milliseconds
+_CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ielts_http_request_duration_seconds', 'Request latency per route',
+    ('method', 'endpoint', 'status'), buckets=_REQUEST_BUCKETS)
+
+STAGE_SECONDS = Histogram(
+    'ielts_pipeline_stage_duration_seconds', 'Time from a stage becoming ready until it finished',
+    ('pipeline', 'stage'), buckets=_CALL_BUCKETS)
+
+BACKEND_CALL_SECONDS = Histogram(
+    'ielts_backend_call_duration_seconds', 'Duration of single calls to an external backend',
+    ('backend',), buckets=_CALL_BUCKETS)
+BACKEND_ERRORS = Counter(
+    'ielts_backend_errors', 'Failed calls to an external backend', ('backend',))
+BACKEND_RETRIES = Counter(
+    'ielts_backend_retries', 'Calls retried by a pipeline stage', ('backend',))
+
+EXECUTOR_TASKS = Gauge(
+    'ielts_executor_tasks', 'Tasks on the shared executors', ('executor', 'state'),
+    multiprocess_mode='livesum')
+
+ADMISSION_EVALUATIONS = Gauge(
+    'ielts_admission_evaluations', 'Evaluations holding or waiting for a slot', ('state',),
+    multiprocess_mode='livesum')
+ADMISSION_WAIT_SECONDS = Histogram(
+    'ielts_admission_wait_seconds', 'Time admitted evaluations waited in the queue',
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 20, 30, 60))
+ADMISSION_REJECTED = Counter(
+    'ielts_admission_rejected', 'Evaluations rejected by admission control', ('reason',))
+
+LLM_TOKENS = Histogram(
+    'ielts_llm_tokens', 'Tokens per ChatGPT call: prompt and completion as billed, '
+                        'estimated_prompt as estimated before the call', ('kind',),
+    buckets=(100, 250, 500, 1000, 1500, 2000, 3000, 4000, 8000, 16000))
+LLM_MODEL_CALL_SECONDS = Histogram(
+    'ielts_llm_model_call_duration_seconds', 'ChatGPT calls per model', ('model', 'outcome'),
+    buckets=_CALL_BUCKETS)
+LLM_MODEL_FAILOVERS = Counter(
+    'ielts_llm_model_failovers', 'Calls moved from a model to the next one of its part, '
+                                 'after an error or while it is unhealthy', ('model', 'reason'))
+LLM_OUTPUT_REPAIRS = Counter(
+    'ielts_llm_output_repairs', 'Defects of ChatGPT replies fixed without a new call, and '
+                                'follow-up calls for missing fields (reask)', ('repair',))
+DIALOGS_SHORTENED = Counter(
+    'ielts_dialogs_shortened', 'Dialogs with answers shortened to PROMPT_DIALOG_MAX_TOKENS',
+    ('part',))
+
+# Memory of the audio processing, see app/memory.py
+_BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+
+AUDIO_BUFFER_BYTES = Gauge(
+    'ielts_audio_buffer_bytes', 'Bytes held by live audio buffers', multiprocess_mode='livesum')
+ADMISSION_MEMORY_RESERVED_BYTES = Gauge(
+    'ielts_admission_memory_reserved_bytes', 'Memory reserved by running evaluations',
+    multiprocess_mode='livesum')
+PROCESS_RSS_BYTES = Gauge(
+    'ielts_process_rss_bytes', 'Sampled resident set size per worker', multiprocess_mode='liveall')
+PROCESS_PEAK_RSS_BYTES = Gauge(
+    'ielts_process_peak_rss_bytes', 'Largest sampled resident set size per worker',
+    multiprocess_mode='liveall')
+EVALUATION_AUDIO_BYTES = Histogram(
+    'ielts_evaluation_audio_bytes', 'Peak bytes of audio buffers held by one evaluation',
+    buckets=_BYTES_BUCKETS)
+EVALUATION_RSS_GROWTH_BYTES = Histogram(
+    'ielts_evaluation_rss_growth_bytes', 'Peak RSS during an evaluation over the RSS at its start',
+    buckets=_BYTES_BUCKETS)
+
+ANALYTICS_EVENTS = Counter(
+    'ielts_analytics_events', 'Analytics events by outcome', ('outcome',))
+
+
+@contextmanager
+def backend_call(backend: str):
+    """
+    Time one call to an external backend and count it as an error if it raises.
+
+    The call is also traced; the span is yielded so the caller can add
+    attributes such as bytes sent or the response status.
+    """
+    started = time.perf_counter()
+    try:
+        with span(f'{backend} call', backend=backend) as call_span:
+            yield call_span
+    except Exception:
+        BACKEND_ERRORS.labels(backend).inc()
+        raise
+    finally:
+        BACKEND_CALL_SECONDS.labels(backend).observe(time.perf_counter() - started)
+
+
+def init_metrics(app) -> None:
+    """Time every request and serve the metrics on /metrics."""
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.teardown_request(_observe_failed_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def metrics_view():
+    """
+    Prometheus text exposition, for scrapers presenting METRICS_TOKEN as a
+    bearer token. Without a configured token the endpoint does not exist.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        abort(401)
+
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _observe_request(response):
+    _observe(response.status_code)
+    return response
+
+
+def _observe_failed_request(exception):
+    # after_request is skipped when a view raised an unhandled exception
+    if exception is not None:
+        _observe(500)
+
+
+def _observe(status: int) -> None:
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint != 'metrics':
+        HTTP_REQUEST_SECONDS.labels(request.method, request.endpoint or 'unmatched',
+                                    status).observe(time.perf_counter() - started)
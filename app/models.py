@@ -1,21 +1,86 @@
 from datetime import datetime
 from typing import Optional
 from collections import defaultdict
+from dataclasses import asdict, dataclass
 
-from flask import abort, flash
+from flask import abort, current_app, flash
 from flask_login import UserMixin
-from sqlalchemy import func, desc
+from sqlalchemy import desc, event
 from werkzeug.security import check_password_hash, generate_password_hash
 from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import selectinload
 from itertools import zip_longest
 import uuid
 
 from config.database import db
 from config.auth import login
+from app.cache import TTLCache
+from app.catalog import (get_catalog, CatalogSection, CatalogSubsection,
+                         CatalogQuestionSet)
 from app.content.scores import SPEAKING_SCORES_FEEDBACK, SPEAKING_FINAL_FEEDBACK
 
 
-class User(UserMixin, db.Model):
+class UserDataMixin:
+    """Queries for a user's own data, shared by User and CachedUser."""
+
+    @property
+    def is_admin(self) -> bool:
+        """May open the internal pages, see ADMIN_EMAILS."""
+        return self.email in current_app.config['ADMIN_EMAILS']
+
+    def get_section_progress(self, section_id):
+        return UserProgress.query.filter(
+            UserProgress.user_id == self.id,
+            UserProgress.section_id == section_id,
+            ~UserProgress.is_completed
+        ).first()
+
+    def get_subsections_progress(self, section: CatalogSection) -> list:
+        """
+        Returns a list of subsections with user's progress status.
+
+        Function retrieves progress of a user for each subsection in a section.
+        The progress status can be "Completed", "In Progress", or "Upcoming".
+
+        Args:
+            section (CatalogSection): Section from the content catalog.
+
+        Returns:
+            list[dict]: Subsection fields with progress status.
+        """
+
+        # get user's progress in this section
+        user_progress = self.get_section_progress(section.id)
+
+        # get user attempts for this subsection
+        user_attempts = user_progress.attempts if user_progress else ()
+
+        # iterating over subsections and set statuses and attempt id if any
+        subsections = []
+        is_completed = False
+        for subsection, attempt in zip_longest(section.subsections, user_attempts):
+            subsection = asdict(subsection)
+            if attempt:
+                subsection['status'] = "Completed"
+                subsection['attempt_id'] = attempt.id  # set attempt_id for completed subsection
+            else:
+                if not is_completed:
+                    subsection['status'] = "Available"
+                    is_completed = True
+                else:
+                    subsection['status'] = "Upcoming"
+            subsections.append(subsection)
+        return subsections
+
+    def get_sections_history(self):
+        # the history page shows final scores, computed from every attempt
+        user_progress = UserProgress.query.filter(
+            UserProgress.user_id == self.id
+        ).options(selectinload(UserProgress.attempts)).all()
+        return user_progress
+
+
+class User(UserDataMixin, UserMixin, db.Model):
     """User model. Represents registered users of the app."""
 
     __tablename__ = 'users'
@@ -47,23 +112,58 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.hashed_password, password)
 
-    def get_section_progress(self, section_id):
-        return UserProgress.query.filter(
-            UserProgress.user_id == self.id,
-            UserProgress.section_id == section_id,
-            UserProgress.is_completed is False
-        ).first()
 
-    def get_sections_history(self):
-        user_progress = UserProgress.query.filter(
-            UserProgress.user_id == self.id
-        ).all()
-        return user_progress
+@dataclass(frozen=True, eq=False)
+class CachedUser(UserDataMixin, UserMixin):
+    """
+    Lightweight, detached snapshot of a User used as `current_user`.
+
+    Holds only the identity and profile fields pages need, so it can be
+    cached across requests without keeping a database session alive.
+    """
+    id: uuid.UUID
+    email: str
+    is_email_verified: bool
+    first_name: Optional[str]
+    last_name: Optional[str]
+    profile_picture: Optional[str]
+    locale: Optional[str]
+
+    @classmethod
+    def from_user(cls, user: User) -> 'CachedUser':
+        return cls(id=user.id, email=user.email,
+                   is_email_verified=user.is_email_verified,
+                   first_name=user.first_name, last_name=user.last_name,
+                   profile_picture=user.profile_picture, locale=user.locale)
+
+
+# Per-worker cache of user snapshots, keyed by the user id stored in the session
+_user_cache = TTLCache(maxsize=1024, ttl=30)
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(id)
+    """
+    Load the user for the current request.
+
+    Flask-Login memoizes the result for the rest of the request, this adds a
+    short-TTL cache across requests so most page views don't query `users`.
+    """
+    user = _user_cache.get(id)
+    if user is None:
+        user = User.query.get(id)
+        if user is None:
+            return None
+        user = CachedUser.from_user(user)
+        _user_cache.set(id, user)
+    return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    # profile or password changed, other workers catch up when their TTL expires
+    _user_cache.pop(str(target.id))
 
 
 class Section(db.Model):
@@ -80,47 +180,6 @@ class Section(db.Model):
     def __repr__(self):
         return f"<Section {self.name}>"
 
-    @staticmethod
-    def get_by_name(name):
-        return Section.query.filter(Section.name.ilike(name)).first_or_404()
-
-    def get_user_subsections_progress(self, user) -> list:
-        """
-        Returns a list of subsections with user's progress status.
-
-        Function retrieves progress of a user for each subsection in a section.
-        The progress status can be "Completed", "In Progress", or "Upcoming".
-
-        Args:
-            user (User): User instance.
-
-        Returns:
-            list[Subsection]: Subsections with progress status.
-        """
-
-        # get user's progress in this section
-        user_progress = user.get_section_progress(self.id)
-
-        # get subsections for this section
-        subsections = Subsection.query.filter_by(section=self).all()
-
-        # get user attempts for this subsection
-        user_attempts = user_progress.attempts if user_progress else ()
-
-        # iterating over subsections and set statuses and attempt id if any
-        is_completed = False
-        for subsection, attempt in zip_longest(subsections, user_attempts):
-            if attempt:
-                subsection.status = "Completed"
-                subsection.attempt_id = attempt.id  # set attempt_id for completed subsection
-            else:
-                if not is_completed:
-                    subsection.status = "Available"
-                    is_completed = True
-                else:
-                    subsection.status = "Upcoming"
-        return subsections
-
 
 class Subsection(db.Model):
     """Subsection model. Represents a subsection in an IELTS exam section."""
@@ -136,14 +195,12 @@ class Subsection(db.Model):
     section_id = db.Column(db.Integer, db.ForeignKey('sections.id'), nullable=False)  # ID of the section this subsection belongs to
     section = db.relationship('Section', back_populates='subsections')  # Relationship to the parent section
 
+    __table_args__ = (
+        db.UniqueConstraint('section_id', 'part_number'),)
+
     def __repr__(self):
         return f"<Subsection {self.name}>"
 
-    @staticmethod
-    def get_by_section_and_part(section, part):
-        return Subsection.query.filter_by(section=section,
-                                          part_number=part).first()
-
 
 class Topic(db.Model):
     """Topic model. Represents a topic that can appear in a subsection."""
@@ -151,7 +208,7 @@ class Topic(db.Model):
     __tablename__ = 'topics'
 
     id = db.Column(db.Integer, primary_key=True)  # Unique topic ID
-    name = db.Column(db.String(128), nullable=False)  # Topic name
+    name = db.Column(db.String(128), unique=True, nullable=False)  # Topic name
     description = db.Column(db.String(255), nullable=False)  # Description of the topic
 
     def __repr__(self):
@@ -173,28 +230,25 @@ class QuestionSet(db.Model):
 
     questions = db.relationship('Question', backref='question_set', lazy='joined')  # List of questions in the set
 
+    is_active = db.Column(db.Boolean, nullable=False, server_default=db.true())  # False once the set is no longer in the seed data; kept for past attempts
+
     __table_args__ = (
-        db.UniqueConstraint('subsection_id', 'topic_id', name='uix_1'),)
+        # one set per subsection and topic is given out, replaced ones are kept inactive
+        db.Index('ix__question_sets__subsection_id_topic_id__active',
+                 subsection_id, topic_id, unique=True, postgresql_where=is_active),)
 
     def __iter__(self):
         yield from self.questions
 
-    @staticmethod
-    def get_random_for_subsection(subsection, last_topic):
-        query = QuestionSet.query.filter_by(subsection=subsection)
-        if last_topic:
-            query = query.filter_by(topic=last_topic)
-        return query.order_by(func.random()).first()
-
     @staticmethod
     def valid_for_subsection(question_set_id, subsection_id):
-        question_set = QuestionSet.query.get(question_set_id)
+        question_set = get_catalog().question_set(question_set_id)
         if not question_set or subsection_id != question_set.subsection_id:
             return False
         return True
 
     @staticmethod
-    def validate_question_set(question_set_id: str) -> Optional['QuestionSet']:
+    def validate_question_set(question_set_id: str) -> Optional[CatalogQuestionSet]:
         if not question_set_id:
             flash("An error has occurred, please try again")
             print("question_set_id is missing")
@@ -205,7 +259,7 @@ class QuestionSet(db.Model):
             flash("An error has occurred, please try again")
             print("question_set_id must be an integer")
             return abort(400, "question_set_id must be an integer")
-        questions_set = QuestionSet.query.get(question_set_id)
+        questions_set = get_catalog().question_set(question_set_id)
         if not questions_set:
             flash("An error has occurred, please try again")
             print("Invalid question_set_id")
@@ -223,6 +277,9 @@ class Question(db.Model):
 
     question_set_id = db.Column(db.Integer, db.ForeignKey('question_sets.id'), nullable=False)  # ID of the question set this question belongs to
 
+    __table_args__ = (
+        db.UniqueConstraint('question_set_id', 'text'),)
+
 
 class UserProgress(db.Model):
     """UserProgress model. Represents the progress of a user in a section."""
@@ -236,19 +293,29 @@ class UserProgress(db.Model):
     is_completed = db.Column(db.Boolean, nullable=False, default=False)  # Boolean indicating if the section has been completed
     completed_at = db.Column(db.DateTime)  # The time when the section was completed
 
-    section = db.relationship('Section', lazy='joined')
     attempts = db.relationship('UserSubsectionAttempt', backref='user_progress', cascade='all, delete')  # Tracks user's attempts in subsections
 
+    __table_args__ = (
+        # User.get_sections_history
+        db.Index('ix__user_progress__user_id', user_id),
+        # User.get_section_progress, only the unfinished progress is looked up
+        db.Index('ix__user_progress__user_id_section_id__not_completed',
+                 user_id, section_id, postgresql_where=~is_completed),)
+
     def __init__(self, *args, **kwargs):
         super(UserProgress, self).__init__(*args, **kwargs)
-        self.next_subsection_id = Subsection.query.filter_by(
-            section_id=self.section_id, part_number=2).first().id
+        self.next_subsection_id = get_catalog().subsection_by_part(
+            self.section_id, 2).id
 
-    def update_next_subsection(self, section):
-        current_subsection = Subsection.query.get(self.next_subsection_id)
+    @property
+    def section(self) -> CatalogSection:
+        return get_catalog().section(self.section_id)
+
+    def update_next_subsection(self, section: CatalogSection):
+        catalog = get_catalog()
+        current_subsection = catalog.subsection(self.next_subsection_id)
         next_part = current_subsection.part_number + 1
-        next_subsection = Subsection.query.filter_by(section=section,
-                                                     part_number=next_part).first()
+        next_subsection = catalog.subsection_by_part(section.id, next_part)
 
         # if not next_subsection -> section completed
         if not next_subsection:
@@ -259,11 +326,13 @@ class UserProgress(db.Model):
             self.next_subsection_id = next_subsection.id
 
     def get_last_topic(self):
-        last_attempt = UserSubsectionAttempt.query.filter(
+        last_question_set_id = db.session.query(
+            UserSubsectionAttempt.question_set_id
+        ).filter(
             UserSubsectionAttempt.user_progress_id == self.id
-        ).order_by(desc(UserSubsectionAttempt.id)).first()
+        ).order_by(desc(UserSubsectionAttempt.id)).limit(1).scalar()
 
-        return last_attempt.question_set.topic
+        return get_catalog().question_set(last_question_set_id).topic
 
     @staticmethod
     def create_or_update_user_progress(user, user_progress, section,
@@ -271,14 +340,14 @@ class UserProgress(db.Model):
         if not user_progress:
 
             # checking that question_set_id from POST request is valid
-            subsection = Subsection.get_by_section_and_part(section, 1)
+            subsection = get_catalog().subsection_by_part(section.id, 1)
             subsection_id = subsection.id
             question_set_is_valid = QuestionSet.valid_for_subsection(
                 question_set_id, subsection_id)
             if not question_set_is_valid:
                 abort(400, "Invalid question_set_id")
 
-            user_progress = UserProgress(user=user,
+            user_progress = UserProgress(user_id=user.id,
                                          section_id=section.id)
             db.session.add(user_progress)
 
@@ -347,10 +416,7 @@ class UserSubsectionAttempt(db.Model):
     user_progress_id = db.Column(db.Integer, db.ForeignKey('user_progress.id'), nullable=False)  # ID of the user progress record this attempt is linked to
 
     subsection_id = db.Column(db.Integer, db.ForeignKey('subsections.id'), nullable=False)  # ID of the subsection this attempt is for
-    subsection = db.relationship('Subsection', backref='user_subsection_attempt')  # Relationship to the subsection
-
     question_set_id = db.Column(db.Integer, db.ForeignKey('question_sets.id'), nullable=False)  # ID of the question set this attempt is for
-    question_set = db.relationship('QuestionSet', backref='user_subsection_attempt')  # Relationship to the question set
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # The time when the attempt was made
 
@@ -358,6 +424,19 @@ class UserSubsectionAttempt(db.Model):
 
     results = db.relationship('UserSpeakingAttemptResult', uselist=False, backref='subsection_attempt', lazy='joined', cascade='all, delete')  # Stores result of speaking attempt
 
+    __table_args__ = (
+        # UserProgress.attempts and UserProgress.get_last_topic
+        db.Index('ix__user_subsection_attempts__user_progress_id_id',
+                 user_progress_id, id.desc()),)
+
+    @property
+    def subsection(self) -> CatalogSubsection:
+        return get_catalog().subsection(self.subsection_id)
+
+    @property
+    def question_set(self) -> CatalogQuestionSet:
+        return get_catalog().question_set(self.question_set_id)
+
     def get_overall_pron_scores(self) -> dict:
         answers = tuple(a for a in self.user_answers if
                         a.pronunciation_assessment_json)
@@ -415,7 +494,6 @@ class UserSubsectionAnswer(db.Model):
     user_subsection_attempt_id = db.Column(db.Integer, db.ForeignKey('user_subsection_attempts.id'), nullable=False)  # ID of the attempt this answer is part of
 
     question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)  # ID of the question this answer is for
-    question = db.relationship('Question', backref='user_subsection_answers', lazy='joined')  # Relationship to the question
 
     transcribed_answer = db.Column(db.Text)  # Text of the transcribed answer
     pronunciation_assessment_json = db.Column(JSONB)  # JSON data from pronunciation assessment
@@ -424,6 +502,15 @@ class UserSubsectionAnswer(db.Model):
     completeness_score = db.Column(db.Float)  # Score for completeness
     pronunciation_score = db.Column(db.Float)  # Score for pronunciation
 
+    __table_args__ = (
+        # UserSubsectionAttempt.user_answers
+        db.Index('ix__user_subsection_answers__user_subsection_attempt_id',
+                 user_subsection_attempt_id),)
+
+    @property
+    def question(self):
+        return get_catalog().question(self.question_id)
+
     @staticmethod
     def insert_user_answers(subsection_attempt, answers_evaluation) -> None:
 
@@ -432,7 +519,7 @@ class UserSubsectionAnswer(db.Model):
             scores = pronunciation_assessment.get('NBest')[0]
             user_subsection_answers = UserSubsectionAnswer(
                 subsection_attempt=subsection_attempt,
-                question=answer.get('question'),
+                question_id=answer.get('question').id,
                 transcribed_answer=answer.get('answer_transcription'),
                 pronunciation_assessment_json=pronunciation_assessment,
                 accuracy_score=scores['AccuracyScore'],
@@ -455,6 +542,7 @@ class UserSpeakingAttemptResult(db.Model):
     grammatical_range_accuracy_score = db.Column(db.Integer, nullable=False)  # Score for grammatical range and accuracy
     lexical_resource_score = db.Column(db.Integer, nullable=False)  # Score for lexical resource
     pronunciation_score = db.Column(db.Integer, nullable=False)  # Score for pronunciation
+    llm_model = db.Column(db.String(64))  # ChatGPT model that evaluated the attempt, NULL for attempts before it was recorded
 
     @staticmethod
     def insert_speaking_result(subsection_attempt, speaking_result):
@@ -465,6 +553,7 @@ class UserSpeakingAttemptResult(db.Model):
             grammatical_range_accuracy_score=speaking_result['grammaticalRangeAndAccuracy']['score'],
             lexical_resource_score=speaking_result['lexicalResource']['score'],
             pronunciation_score=speaking_result['pronunciation']['score'],
+            llm_model=speaking_result.get('llm_model'),
         )
         db.session.add(speaking_attempt_result)
 
@@ -514,7 +603,7 @@ class UserSpeakingAttemptResult(db.Model):
     def save_result(user, question_set):
 
         # Get the 'speaking' section
-        section = Section.get_by_name("speaking")
+        section = get_catalog().section_by_name("speaking")
         # Get the current user's progress in this section
         user_progress = user.get_section_progress(section.id)
 
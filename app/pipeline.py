@@ -0,0 +1,279 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from app.executors import get_executor
+from app.metrics import BACKEND_RETRIES, STAGE_SECONDS
+from app.tracing import span
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How often a stage call is attempted.
+
+    Attributes:
+    - attempts: Total number of calls, 1 means no retry.
+    - wait_seconds: Pause between attempts.
+    - give_up_on: Exceptions that are never retried, e.g. invalid user input.
+    """
+    attempts: int = 1
+    wait_seconds: float = 0
+    give_up_on: tuple[type[BaseException], ...] = ()
+
+
+NO_RETRY = RetryPolicy()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One step of a Pipeline.
+
+    The stage is called with the values named by `inputs`, positionally and in
+    that order, and its return value is stored under `outputs` (a tuple is
+    unpacked when there are several outputs). With `map_over` the stage is
+    called once per item of those inputs, zipped, in parallel, and its single
+    output is the tuple of results.
+
+    Attributes:
+    - backend: External service the stage calls, used to label retry metrics.
+    - executor: Named executor the calls run on; None runs the stage in the
+      pipeline's own thread, for cheap steps only.
+    - max_concurrency: Process-wide cap on concurrent calls of this stage, on
+      top of the executor's size.
+    - timeout: Seconds from the stage becoming ready until all its calls must
+      be done; only enforced for stages that run on an executor. Calls still
+      running then finish their current attempt but are not retried.
+    - retry: Retry policy applied to each call.
+    """
+    name: str
+    func: Callable[..., Any]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    map_over: tuple[str, ...] = ()
+    backend: Optional[str] = None
+    executor: Optional[str] = None
+    max_concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+    retry: RetryPolicy = NO_RETRY
+
+
+class StageError(Exception):
+    """A stage failed after its retries; the original exception is `cause`."""
+
+    def __init__(self, stage: str, cause: BaseException):
+        super().__init__(f'Stage {stage!r} failed: {cause!r}')
+        self.stage = stage
+        self.cause = cause
+
+
+class StageTimeout(StageError):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(stage, TimeoutError(f'did not finish within {timeout}s'))
+
+
+@dataclass
+class PipelineRun:
+    """Values produced by a pipeline run and the seconds each stage took."""
+    values: dict
+    timings: dict = field(default_factory=dict)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+
+@dataclass
+class _RunningStage:
+    stage: Stage
+    futures: list
+    started: float
+    deadline: Optional[float]
+    stop: threading.Event  # set when the run ends, so calls still running stop retrying
+
+
+class Pipeline:
+    """
+    Runs a graph of stages, each as soon as all of its inputs are available.
+
+    Stages that do not depend on each other run in parallel on their
+    executors; the thread calling `run` waits for them and runs the inline
+    stages itself. The graph is checked when the pipeline is built: every
+    output is produced by one stage only and there are no cycles. Inputs that
+    no stage produces must be passed to `run`.
+    """
+
+    def __init__(self, name: str, stages: list[Stage]):
+        self.name = name
+        self.stages = tuple(stages)
+
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f'{output!r} is produced by both {producers[output]!r} and {stage.name!r}')
+                producers[output] = stage.name
+            if not set(stage.map_over) <= set(stage.inputs):
+                raise ValueError(f'Stage {stage.name!r} maps over values that are not its inputs')
+            if stage.map_over and len(stage.outputs) != 1:
+                raise ValueError(f'Mapped stage {stage.name!r} must have exactly one output')
+
+        self.external_inputs = frozenset(
+            name for stage in self.stages for name in stage.inputs if name not in producers)
+        self._check_acyclic()
+        self._semaphores = {stage.name: threading.BoundedSemaphore(stage.max_concurrency)
+                            for stage in self.stages if stage.max_concurrency}
+
+    def run(self, **inputs) -> PipelineRun:
+        """
+        Run all stages and return their outputs.
+
+        Raises:
+            StageError: With the failing stage's name and exception, once its
+                retries are exhausted or its timeout has passed.
+        """
+        missing = self.external_inputs - inputs.keys()
+        if missing:
+            raise TypeError(f'Pipeline {self.name!r} is missing inputs: {", ".join(sorted(missing))}')
+
+        with span(f'pipeline {self.name}', pipeline=self.name):
+            return self._run(inputs)
+
+    def _run(self, inputs: dict) -> PipelineRun:
+        result = PipelineRun(values=dict(inputs))
+        pending = list(self.stages)
+        running = []
+        try:
+            while pending or running:
+                ready = [stage for stage in pending
+                         if all(name in result.values for name in stage.inputs)]
+                for stage in ready:
+                    if stage.executor is not None:
+                        pending.remove(stage)
+                        running.append(self._submit(stage, result.values))
+
+                inline = next((stage for stage in ready if stage.executor is None), None)
+                if inline is not None:
+                    pending.remove(inline)
+                    started = time.perf_counter()
+                    try:
+                        outputs = self._call_stage_inline(inline, result.values)
+                    except Exception as e:
+                        raise StageError(inline.name, e) from e
+                    self._store(inline, outputs, result, started)
+                    continue
+
+                self._wait_for_next(running, result)
+        finally:
+            # queued calls are cancelled; running ones cannot be, they give up
+            # retrying instead and free their thread after the current attempt
+            for running_stage in running:
+                running_stage.stop.set()
+                for future in running_stage.futures:
+                    future.cancel()
+        return result
+
+    def _submit(self, stage: Stage, values: dict) -> _RunningStage:
+        executor = get_executor(stage.executor)
+        started = time.perf_counter()
+        deadline = started + stage.timeout if stage.timeout is not None else None
+        stop = threading.Event()
+        futures = [executor.submit(self._call, stage, args, deadline, stop)
+                   for args in self._arguments(stage, values)]
+        return _RunningStage(stage, futures, started, deadline, stop)
+
+    def _wait_for_next(self, running: list, result: PipelineRun) -> None:
+        """Wait until a running stage finishes or times out and store its outputs."""
+        deadlines = [r.deadline for r in running if r.deadline is not None]
+        timeout = max(min(deadlines) - time.perf_counter(), 0) if deadlines else None
+        # only unfinished futures: a finished one would end every wait at once
+        wait([f for r in running for f in r.futures if not f.done()],
+             timeout=timeout, return_when=FIRST_COMPLETED)
+
+        now = time.perf_counter()
+        for running_stage in list(running):
+            stage = running_stage.stage
+            futures = running_stage.futures
+            for future in futures:
+                if future.done() and future.exception() is not None:
+                    raise StageError(stage.name, future.exception()) from future.exception()
+            if all(future.done() for future in futures):
+                running.remove(running_stage)
+                values = [future.result() for future in futures]
+                self._store(stage, tuple(values) if stage.map_over else values[0],
+                            result, running_stage.started)
+            elif running_stage.deadline is not None and now >= running_stage.deadline:
+                raise StageTimeout(stage.name, stage.timeout)
+
+    def _call_stage_inline(self, stage: Stage, values: dict) -> Any:
+        results = [self._call(stage, args) for args in self._arguments(stage, values)]
+        return tuple(results) if stage.map_over else results[0]
+
+    @staticmethod
+    def _arguments(stage: Stage, values: dict) -> list[list]:
+        """Positional arguments of each call: one call, or one per mapped item."""
+        if not stage.map_over:
+            return [[values[name] for name in stage.inputs]]
+        items = zip(*(values[name] for name in stage.map_over))
+        calls = []
+        for item in items:
+            mapped = dict(zip(stage.map_over, item))
+            calls.append([mapped[name] if name in mapped else values[name] for name in stage.inputs])
+        return calls
+
+    def _call(self, stage: Stage, args: list, deadline: Optional[float] = None,
+              stop: Optional[threading.Event] = None) -> Any:
+        with span(stage.name, stage=stage.name, backend=stage.backend or '') as stage_span:
+            return self._call_with_retries(stage, args, stage_span, deadline, stop)
+
+    def _call_with_retries(self, stage: Stage, args: list, stage_span,
+                           deadline: Optional[float] = None,
+                           stop: Optional[threading.Event] = None) -> Any:
+        """
+        Call the stage under its retry policy. No retry is started once the
+        stage's deadline has passed or `stop` is set, as nobody waits for the
+        result any more.
+        """
+        policy = stage.retry
+        semaphore = self._semaphores.get(stage.name)
+        for attempt in range(1, policy.attempts + 1):
+            stage_span.set_attribute('retries', attempt - 1)
+            try:
+                if semaphore is None:
+                    return stage.func(*args)
+                with semaphore:
+                    return stage.func(*args)
+            except policy.give_up_on:
+                raise
+            except Exception as e:
+                if attempt == policy.attempts or (stop is not None and stop.is_set()):
+                    raise
+                if deadline is not None and time.perf_counter() + policy.wait_seconds >= deadline:
+                    raise
+                print(f'{self.name}: {stage.name} attempt {attempt} failed: {e!r}')
+                BACKEND_RETRIES.labels(stage.backend or stage.name).inc()
+                if stop is None:
+                    time.sleep(policy.wait_seconds)
+                elif stop.wait(policy.wait_seconds):
+                    raise
+
+    def _store(self, stage: Stage, outputs: Any, result: PipelineRun, started: float) -> None:
+        if len(stage.outputs) == 1:
+            outputs = (outputs,)
+        result.values.update(zip(stage.outputs, outputs))
+        result.timings[stage.name] = time.perf_counter() - started
+        STAGE_SECONDS.labels(self.name, stage.name).observe(result.timings[stage.name])
+
+    def _check_acyclic(self) -> None:
+        available = set(self.external_inputs)
+        remaining = list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if set(stage.inputs) <= available]
+            if not ready:
+                names = ', '.join(stage.name for stage in remaining)
+                raise ValueError(f'Pipeline {self.name!r} has a cycle between: {names}')
+            for stage in ready:
+                remaining.remove(stage)
+                available.update(stage.outputs)
@@ -0,0 +1,336 @@
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+from app.tracing import current_span
+
+_current_profile: contextvars.ContextVar[Optional['Profile']] = contextvars.ContextVar(
+    'current_profile', default=None)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STDLIB = sysconfig.get_path('stdlib')
+RATES_FILE = 'sample_rates.json'
+_SAFE_NAME = re.compile(r'^\w[\w.-]*$')  # endpoint and profile names used as paths
+_THREAD_NUMBER = re.compile(r'_\d+$')
+
+
+class Profile:
+    """
+    Stack samples of one request, in collapsed ("folded") form.
+
+    The request thread is sampled, and executor threads while they run a
+    task submitted by the request. Each sample is one line of frames from
+    the thread's root to the running function, so the result can be fed to
+    flamegraph.pl or speedscope as it is.
+
+    Attributes:
+    - endpoint: Flask endpoint of the request.
+    - stacks: Collapsed stack -> number of samples.
+    - samples: Number of sampling rounds the request was sampled in.
+    """
+
+    def __init__(self, endpoint: str, interval: float):
+        self.endpoint = endpoint
+        self.interval = interval
+        self.started = time.time()
+        self.seconds = 0.0
+        self.stacks = Counter()
+        self.samples = 0
+        self.threads = {}  # thread id -> root frame label
+        self._lock = threading.Lock()
+
+    def add_thread(self, thread: threading.Thread) -> None:
+        with self._lock:
+            self.threads[thread.ident] = _THREAD_NUMBER.sub('', thread.name)
+
+    def remove_thread(self, thread: threading.Thread) -> None:
+        with self._lock:
+            self.threads.pop(thread.ident, None)
+
+    def sample(self, frames: dict) -> None:
+        with self._lock:
+            threads = list(self.threads.items())
+        self.samples += 1
+        for thread_id, root in threads:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                self.stacks[_collapse(root, frame)] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+_frame_labels = {}
+
+
+def _frame_label(code) -> str:
+    label = _frame_labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(PROJECT_ROOT + os.sep):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        elif 'site-packages' in filename:
+            filename = filename.split('site-packages' + os.sep, 1)[1]
+        elif filename.startswith(STDLIB + os.sep):
+            filename = os.path.relpath(filename, STDLIB)
+        label = _frame_labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return label
+
+
+def _collapse(root: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+class Sampler:
+    """
+    One thread per process taking the stacks of all profiled requests every
+    interval. It sleeps while no request is profiled, so profiling costs
+    nothing until it is switched on.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            self._wake.wait()
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wake.clear()
+                    continue
+            frames = sys._current_frames()
+            frames.pop(own_id, None)
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> Sampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(current_app.config['PROFILER_INTERVAL_MS'] / 1000)
+        return _sampler
+
+
+@contextmanager
+def sample_thread(context: contextvars.Context):
+    """Sample the calling thread while it runs a task for a profiled request in context."""
+    profile = context.get(_current_profile)
+    if profile is None:
+        yield
+        return
+    thread = threading.current_thread()
+    profile.add_thread(thread)
+    try:
+        yield
+    finally:
+        profile.remove_thread(thread)
+
+
+class ProfileStore:
+    """
+    Saved profiles, one directory per endpoint, shared by the gunicorn workers.
+
+    Only the newest `retention` profiles of an endpoint are kept. The per
+    endpoint sampling rates set on the internal page are kept here too, so
+    every worker applies them.
+    """
+
+    def __init__(self, path: str, retention: int):
+        self.path = path
+        self.retention = retention
+        self._rates = {}
+        self._rates_mtime = None
+        self._rates_checked = 0.0
+
+    def save(self, profile: Profile, **details) -> str:
+        directory = os.path.join(self.path, profile.endpoint)
+        os.makedirs(directory, exist_ok=True)
+        # sorts by start time, unique across workers
+        name = (f'{time.strftime("%Y%m%dT%H%M%S", time.gmtime(profile.started))}'
+                f'{int(profile.started * 1000) % 1000:03d}-{os.getpid()}-{os.urandom(3).hex()}')
+        record = {'name': name, 'endpoint': profile.endpoint, 'started': profile.started,
+                  'seconds': round(profile.seconds, 3), 'samples': profile.samples,
+                  'interval_ms': profile.interval * 1000, **details,
+                  'collapsed': profile.collapsed()}
+        with open(os.path.join(directory, f'{name}.json.tmp'), 'w') as f:
+            json.dump(record, f)
+        os.replace(os.path.join(directory, f'{name}.json.tmp'), os.path.join(directory, f'{name}.json'))
+        for old in self._names(profile.endpoint)[self.retention:]:
+            try:
+                os.remove(os.path.join(directory, f'{old}.json'))
+            except FileNotFoundError:
+                pass  # removed by another worker
+        return name
+
+    def _names(self, endpoint: str) -> list:
+        """Profile names of an endpoint, newest first."""
+        try:
+            files = os.listdir(os.path.join(self.path, endpoint))
+        except FileNotFoundError:
+            return []
+        return sorted((f[:-len('.json')] for f in files if f.endswith('.json')), reverse=True)
+
+    def endpoints(self) -> list:
+        try:
+            return sorted(d for d in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, d)))
+        except FileNotFoundError:
+            return []
+
+    def list(self, endpoint: str) -> list:
+        """Saved profiles of an endpoint without their stacks, newest first."""
+        profiles = []
+        for name in self._names(endpoint):
+            profile = self.load(endpoint, name)
+            if profile is not None:
+                profile.pop('collapsed')
+                profiles.append(profile)
+        return profiles
+
+    def load(self, endpoint: str, name: str) -> Optional[dict]:
+        if not (_SAFE_NAME.match(endpoint) and _SAFE_NAME.match(name)):
+            return None
+        try:
+            with open(os.path.join(self.path, endpoint, f'{name}.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def sample_rates(self) -> dict:
+        """endpoint -> share of its requests to profile, re-read at most once a second."""
+        now = time.monotonic()
+        if now - self._rates_checked >= 1:
+            self._rates_checked = now
+            try:
+                mtime = os.stat(os.path.join(self.path, RATES_FILE)).st_mtime
+            except FileNotFoundError:
+                self._rates, self._rates_mtime = {}, None
+            else:
+                if mtime != self._rates_mtime:
+                    with open(os.path.join(self.path, RATES_FILE)) as f:
+                        self._rates = json.load(f)
+                    self._rates_mtime = mtime
+        return self._rates
+
+    def set_sample_rate(self, endpoint: str, rate: float) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._rates_checked = 0.0
+        rates = dict(self.sample_rates())
+        if rate > 0:
+            rates[endpoint] = rate
+        else:
+            rates.pop(endpoint, None)
+        with open(os.path.join(self.path, f'{RATES_FILE}.tmp'), 'w') as f:
+            json.dump(rates, f)
+        os.replace(os.path.join(self.path, f'{RATES_FILE}.tmp'), os.path.join(self.path, RATES_FILE))
+        self._rates_checked = 0.0
+
+
+_store = None
+
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    if _store is None:
+        _store = ProfileStore(current_app.config['PROFILER_DIR'],
+                              current_app.config['PROFILER_RETENTION'])
+    return _store
+
+
+def init_profiler(app) -> None:
+    """
+    Profile requests on demand.
+
+    An admin adds ?profile=1 to any URL to profile that request, and the
+    internal profiles page sets a share of an endpoint's requests to profile,
+    e.g. 0.05 of speaking_practice_post. Profiles are saved per endpoint
+    under PROFILER_DIR.
+    """
+    app.before_request(_start_profile)
+    app.after_request(_note_status)
+    app.teardown_request(_end_profile)
+
+
+def _start_profile():
+    if request.endpoint is None or request.endpoint.startswith('static'):
+        return
+    if 'profile' in request.args:
+        if not (current_user.is_authenticated and current_user.is_admin):
+            return
+        trigger = 'admin'
+    else:
+        rate = get_profile_store().sample_rates().get(request.endpoint)
+        if not rate or random.random() >= rate:
+            return
+        trigger = 'sampled'
+
+    profile = Profile(request.endpoint, get_sampler().interval)
+    profile.add_thread(threading.current_thread())
+    g.profile = profile
+    g.profile_trigger = trigger
+    g.profile_token = _current_profile.set(profile)
+    get_sampler().start(profile)
+
+
+def _note_status(response):
+    if 'profile' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def _end_profile(exception):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    get_sampler().stop(profile)
+    _current_profile.reset(g.pop('profile_token'))
+    profile.seconds = time.time() - profile.started
+
+    try:
+        get_profile_store().save(profile, method=request.method, path=request.path,
+                                 status=g.pop('profile_status', 500),
+                                 trigger=g.pop('profile_trigger'),
+                                 trace_id=current_span().trace_id)
+    except OSError as e:
+        print(f'Could not save the profile of {profile.endpoint}: {e}')
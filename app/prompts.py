@@ -0,0 +1,119 @@
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Sequence
+
+TRUNCATION_MARK = ' [...]'
+
+SYSTEM_MESSAGE = "You act as a professional IELTS examiner."
+
+RESPONSE_JSON_SCHEMA = """{"type":"object","properties":{"coherence":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"lexicalResource":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"grammaticalRangeAndAccuracy":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"generalFeedback":{"type":"string","maxLength":300}},"required":["coherence","lexicalResource","grammaticalRangeAndAccuracy","generalFeedback"]}"""
+
+# Identical for every subsection and first in the request, so the provider can
+# reuse its cached prefix across all evaluations
+INSTRUCTIONS = f"""\
+As an AI model simulating a professional IELTS examiner, your task is to evaluate a transcription of a student's dialogue from the IELTS Speaking test.
+Your evaluation should strictly adhere to the official IELTS Speaking Band Descriptors for the following criteria: "Coherence" (a component of "Fluency and Coherence"), "Lexical Resource", "Grammatical Range and Accuracy", and "Pronunciation". Use the standard IELTS scoring methodology, but specifically for the "Fluency and Coherence" criterion, evaluate only "Coherence".
+
+Provide a "score" for each mentioned criterion. This score should be a number from 0 to 9, representing the student's performance on that criterion in accordance with the official IELTS Speaking Band Descriptors for Academic and General Training tests.
+
+In addition, provide a "generalFeedback" text of up to 300 characters. It should be a friendly and personalized note directly addressing the student. Craft it to encapsulate your overall impressions about the student's performance without mentioning specific criteria, and focus instead on providing a broader picture of their achievements.
+
+Answers marked with "{TRUNCATION_MARK.strip()}" were shortened to fit the request; do not treat the cut as a flaw of the answer.
+
+The expected JSON schema for your response is as follows:
+'''
+{RESPONSE_JSON_SCHEMA}
+'''
+Your answer should be a straightforward JSON object without extra spaces or lines, adhering to the above JSON schema."""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of GPT tokens in text without a tokenizer.
+
+    English prose averages three quarters of a word per token and
+    punctuation-heavy text like JSON about four characters; the larger of
+    the two errs on the high side, so a budget keeps its margin. The billed
+    counts of every call are in the ielts_llm_tokens metric for comparison.
+    """
+    return max(math.ceil(len(text.split()) * 4 / 3), math.ceil(len(text) / 4))
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """
+    The static start of an evaluation request for one subsection.
+
+    Attributes:
+    - messages: System message and the instructions with the JSON schema.
+    - tokens: Estimated tokens of the messages.
+    """
+    messages: tuple
+    tokens: int
+
+    def with_dialog(self, dialog: str) -> list:
+        """The messages of a request, the dialog last."""
+        return [*self.messages, {"role": "user", "content": f"Input:\n'''\n{dialog}\n'''"}]
+
+
+@lru_cache(maxsize=None)
+def evaluation_prefix(part_number: int, subsection_name: str) -> PromptPrefix:
+    """Build the static prefix of a subsection once per process."""
+    messages = (
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": INSTRUCTIONS},
+        {"role": "user", "content": f"The dialogue is from the IELTS Speaking Part {part_number}: "
+                                    f"{subsection_name}."},
+    )
+    return PromptPrefix(messages, sum(estimate_tokens(m["content"]) for m in messages))
+
+
+def fit_answers(answers: Sequence[str], budget: int) -> tuple[list, int]:
+    """
+    Shorten the answers to at most budget tokens in total.
+
+    Every answer keeps an equal share; answers shorter than their share are
+    kept whole and leave the rest to the longer ones. Long answers lose
+    their end, cut at a word and marked with TRUNCATION_MARK, so every
+    question still has its answer.
+
+    Returns:
+        The answers and the number of them that were shortened.
+    """
+    costs = [estimate_tokens(answer) for answer in answers]
+    if sum(costs) <= budget:
+        return list(answers), 0
+
+    # water-filling: the largest share that fits the budget
+    remaining, open_answers = max(budget, 0), len(answers)
+    share = remaining // open_answers
+    for cost in sorted(costs):
+        if cost > share:
+            break
+        remaining -= cost
+        open_answers -= 1
+        share = remaining // open_answers if open_answers else 0
+
+    fitted, shortened = [], 0
+    for answer, cost in zip(answers, costs):
+        if cost <= share:
+            fitted.append(answer)
+        else:
+            fitted.append(_shorten(answer, share))
+            shortened += 1
+    return fitted, shortened
+
+
+def _shorten(answer: str, tokens: int) -> str:
+    """The longest start of answer in whole words that fits in tokens with the mark."""
+    words = answer.split()
+    tokens -= estimate_tokens(TRUNCATION_MARK)
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(' '.join(words[:middle])) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return ' '.join(words[:low]) + TRUNCATION_MARK if low else TRUNCATION_MARK.strip()
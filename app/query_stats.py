@@ -0,0 +1,150 @@
+import contextvars
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_current_stats: contextvars.ContextVar[Optional['QueryStats']] = contextvars.ContextVar(
+    'query_stats', default=None)
+
+# literals and expanded IN lists, so statements differing only in values share a shape
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals and IN lists replaced, e.g. to spot N+1 loads."""
+    shape = _IN_LIST.sub('IN (?)', statement)
+    shape = _LITERALS.sub('?', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryStats:
+    """
+    Statements executed during one request or one with block.
+
+    Statements run on executor threads are counted too, the collector
+    follows the context into them. Collectors nest: what a request counts is
+    also counted by the with block around the test client call.
+
+    Attributes:
+    - count: Number of statements.
+    - seconds: Time spent waiting for the database.
+    - shapes: Statement shape -> number of executions.
+    - parent: The enclosing collector, if any.
+    """
+
+    def __init__(self, parent: Optional['QueryStats'] = None):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def record(self, shape: str, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.shapes[shape] += 1
+        if self.parent is not None:
+            self.parent.record(shape, seconds)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Shapes executed more than threshold times, most frequent first."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+@contextmanager
+def collect_queries():
+    """Count the statements executed inside the with block."""
+    stats = QueryStats(_current_stats.get())
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fail with the executed statements if the with block runs more than limit.
+
+    For checks and benchmarks, e.g.
+        with assert_max_queries(3):
+            client.get('/history')
+    """
+    with collect_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        listing = '\n'.join(f'  {n}x {shape}' for shape, n in stats.shapes.most_common())
+        raise AssertionError(f'{stats.count} queries executed, expected at most {limit}:\n{listing}')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement_shape(statement), time.perf_counter() - started)
+
+
+_listening = False
+
+
+def init_query_stats(app) -> None:
+    """
+    Count statements and database time per request.
+
+    Requests repeating one statement shape more than QUERY_REPEAT_WARN_THRESHOLD
+    times are reported as probable N+1 loads. In debug mode the counts are
+    also sent as a Server-Timing header, visible in the browser's dev tools.
+    """
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+    app.before_request(_start_request_stats)
+    app.after_request(_report_request_stats)
+    app.teardown_request(_end_request_stats)
+
+
+def _start_request_stats():
+    g.query_stats = QueryStats(_current_stats.get())
+    g.query_stats_token = _current_stats.set(g.query_stats)
+    g.query_stats_started = time.perf_counter()
+
+
+def _report_request_stats(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+
+    threshold = current_app.config['QUERY_REPEAT_WARN_THRESHOLD']
+    for shape, n in stats.repeated(threshold):
+        print(f'Possible N+1 in {request.endpoint}: {n} executions of {shape[:300]}')
+
+    if current_app.debug:
+        total_ms = (time.perf_counter() - g.query_stats_started) * 1000
+        response.headers.add('Server-Timing',
+                             f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+    return response
+
+
+def _end_request_stats(exception):
+    token = g.pop('query_stats_token', None)
+    if token is not None:
+        _current_stats.reset(token)
@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.catalog import CatalogQuestionSet, get_catalog
+from app.models import UserSpeakingAttemptResult, UserSubsectionAttempt
+from app.pipeline import StageError
+from config.database import db
+
+# ielts_scores key -> UserSpeakingAttemptResult column
+SCORE_COLUMNS = {
+    'fluencyAndCoherence': 'fluency_coherence_score',
+    'grammaticalRangeAndAccuracy': 'grammatical_range_accuracy_score',
+    'lexicalResource': 'lexical_resource_score',
+    'pronunciation': 'pronunciation_score',
+}
+
+
+class RateLimiter:
+    """Spaces calls to `acquire` at least 60 / per_minute seconds apart, across threads."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+@dataclass(frozen=True)
+class StoredAttempt:
+    """
+    What re-scoring needs of an attempt, read from the database.
+
+    Attributes:
+    - id: The attempt.
+    - questions_set: The questions, in the order they were asked.
+    - transcripts: The stored transcript of every answer, in the same order.
+    - pron_scores: The stored Azure assessment of every answer.
+    - scores: The current scores, ielts_scores key -> score.
+    """
+    id: int
+    questions_set: CatalogQuestionSet
+    transcripts: tuple
+    pron_scores: tuple
+    scores: dict
+
+
+def load_attempts(attempt_ids: list) -> Iterator[tuple[int, Optional[StoredAttempt]]]:
+    """
+    The attempts with their answers and results, one query per batch of ids.
+    Attempts without a transcript or an assessment for one of their questions
+    come with None, they cannot be re-scored.
+    """
+    catalog = get_catalog()
+    attempts = db.session.scalars(
+        select(UserSubsectionAttempt).where(UserSubsectionAttempt.id.in_(attempt_ids))
+        .order_by(UserSubsectionAttempt.id)).unique()
+    for attempt in attempts:
+        questions_set = catalog.question_set(attempt.question_set_id)
+        answers = {answer.question_id: answer for answer in attempt.user_answers}
+        stored = [answers.get(question.id) for question in questions_set]
+        if any(answer is None or answer.transcribed_answer is None
+               or not answer.pronunciation_assessment_json for answer in stored):
+            yield attempt.id, None
+            continue
+        yield attempt.id, StoredAttempt(
+            id=attempt.id,
+            questions_set=questions_set,
+            transcripts=tuple(answer.transcribed_answer for answer in stored),
+            pron_scores=tuple(answer.pronunciation_assessment_json for answer in stored),
+            scores={key: getattr(attempt.results, column) for key, column in SCORE_COLUMNS.items()})
+    db.session.expunge_all()
+
+
+def stream_attempt_ids(after_id: int, since: Optional[datetime] = None,
+                       batch_size: int = 200) -> Iterator[list]:
+    """
+    Ids of the attempts with results after after_id, in batches and in id
+    order, read with a server-side cursor on a connection of their own.
+    """
+    query = (select(UserSubsectionAttempt.id)
+             .join(UserSpeakingAttemptResult)
+             .where(UserSubsectionAttempt.id > after_id)
+             .order_by(UserSubsectionAttempt.id))
+    if since is not None:
+        query = query.where(UserSubsectionAttempt.created_at >= since)
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        yield from result.scalars().partitions()
+
+
+def rescore_attempt(stored: StoredAttempt, dry_run: bool = False) -> dict:
+    """
+    Evaluate a stored attempt again with the current prompt, model table and
+    score formula, and save the new result unless dry_run.
+
+    Returns:
+    - dict: The new scores, ielts_scores key -> score.
+    """
+    from app.speaking_eval import RESCORING_PIPELINE
+
+    run = RESCORING_PIPELINE.run(questions_set=stored.questions_set,
+                                 subsection=stored.questions_set.subsection,
+                                 transcripts=stored.transcripts,
+                                 pron_scores=stored.pron_scores)
+    scores = dict(run['ielts_scores'])
+    if not dry_run:
+        db.session.execute(
+            update(UserSpeakingAttemptResult)
+            .where(UserSpeakingAttemptResult.user_subsection_attempt_id == stored.id)
+            .values(general_feedback=run['gpt_evaluation']['generalFeedback'],
+                    llm_model=run['llm_model'],
+                    **{column: scores[key] for key, column in SCORE_COLUMNS.items()}))
+        db.session.commit()
+    return scores
+
+
+@dataclass
+class Checkpoint:
+    """
+    Progress of a re-scoring run, saved to `path` so that an interrupted run
+    continues after the last attempt it finished.
+
+    Attributes:
+    - last_id: Every attempt up to this id is done.
+    - dry_run: Whether the run saves its results; a checkpoint is only resumed in the same mode.
+    - counts: Attempts by outcome: 'changed', 'unchanged', 'incomplete' or 'failed'.
+    - shift: Sum of the score changes per criterion, for the average drift.
+    - failed: Ids of the attempts that could not be re-scored.
+    """
+    path: str
+    last_id: int = 0
+    dry_run: bool = False
+    counts: Counter = field(default_factory=Counter)
+    shift: Counter = field(default_factory=Counter)
+    failed: list = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str, dry_run: bool) -> 'Checkpoint':
+        """The saved progress at path, or a new checkpoint if there is none."""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return cls(path, dry_run=dry_run)
+        if saved['dry_run'] != dry_run:
+            raise ValueError(f'{path} belongs to a {"dry" if saved["dry_run"] else "saving"} run')
+        return cls(path, last_id=saved['last_id'], dry_run=saved['dry_run'],
+                   counts=Counter(saved['counts']), shift=Counter(saved['shift']),
+                   failed=saved['failed'])
+
+    def save(self) -> None:
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump({'last_id': self.last_id, 'dry_run': self.dry_run, 'counts': self.counts,
+                       'shift': self.shift, 'failed': self.failed}, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def rescore_attempts(checkpoint: Checkpoint, since: Optional[datetime] = None,
+                     limit: Optional[int] = None, per_minute: float = 60, threads: int = 4,
+                     batch_size: int = 200, save_every: int = 20,
+                     report: Callable[[str], None] = print) -> Checkpoint:
+    """
+    Re-score the attempts after checkpoint.last_id, oldest first.
+
+    Attempts are read in batches from a server-side cursor and evaluated on a
+    pool of `threads`, started at most `per_minute` times a minute; at most
+    twice as many as there are threads are queued or running at once.
+    Whisper and Azure are not called: the stored transcripts and assessments
+    are used. The checkpoint is saved every `save_every` finished attempts and
+    when the run ends or is interrupted; it only moves past an attempt once
+    every attempt before it is done, so resuming never skips one.
+
+    Parameters:
+    - checkpoint (Checkpoint): Where to start, updated as attempts finish.
+    - since (datetime): Only attempts made at or after this time.
+    - limit (int): Stop after this many attempts.
+    - report (Callable): Receives a line for every failed attempt and the progress.
+    """
+    app = current_app._get_current_object()
+    limiter = RateLimiter(per_minute)
+    pending = deque()  # attempt ids in start order, until the checkpoint passes them
+    finished = set()
+    running = {}  # future -> StoredAttempt
+    started = 0
+
+    def rescore_in_app_context(stored: StoredAttempt) -> dict:
+        with app.app_context():
+            return rescore_attempt(stored, checkpoint.dry_run)
+
+    def finish(attempt_id: int, outcome: str) -> None:
+        checkpoint.counts[outcome] += 1
+        finished.add(attempt_id)
+        while pending and pending[0] in finished:
+            checkpoint.last_id = pending.popleft()
+            finished.discard(checkpoint.last_id)
+        if sum(checkpoint.counts.values()) % save_every == 0:
+            checkpoint.save()
+            report(f'{dict(checkpoint.counts)} up to attempt {checkpoint.last_id}')
+
+    def collect(futures) -> None:
+        for future in futures:
+            stored = running.pop(future)
+            try:
+                scores = future.result()
+            except (StageError, SQLAlchemyError) as e:
+                report(f'Attempt {stored.id} failed: {e}')
+                checkpoint.failed.append(stored.id)
+                finish(stored.id, 'failed')
+                continue
+            changes = {key: scores[key] - stored.scores[key] for key in SCORE_COLUMNS}
+            checkpoint.shift.update(changes)
+            finish(stored.id, 'changed' if any(changes.values()) else 'unchanged')
+
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='rescore')
+    try:
+        for attempt_ids in stream_attempt_ids(checkpoint.last_id, since, batch_size):
+            for attempt_id, stored in load_attempts(attempt_ids):
+                if limit is not None and started >= limit:
+                    break
+                started += 1
+                pending.append(attempt_id)
+                if stored is None:
+                    finish(attempt_id, 'incomplete')
+                    continue
+                while len(running) >= 2 * threads:
+                    collect(wait(running, return_when=FIRST_COMPLETED).done)
+                limiter.acquire()
+                running[pool.submit(rescore_in_app_context, stored)] = stored
+            if limit is not None and started >= limit:
+                break
+        collect(wait(running).done)
+    finally:
+        # on an interrupt the queued attempts are dropped and the running ones finish
+        pool.shutdown(wait=True, cancel_futures=True)
+        collect([future for future in list(running) if future.done() and not future.cancelled()])
+        checkpoint.save()
+    return checkpoint
@@ -0,0 +1,71 @@
+import threading
+from typing import Any, Callable
+
+
+class ServiceRegistry:
+    """
+    Process-wide registry of lazily constructed API clients.
+
+    Clients are expensive to import and build, and most requests (login,
+    history, results) never use them, so each one is created on first use
+    by its registered factory and shared afterwards.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Register a factory, replacing any instance built by the previous one."""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """Return the named client, building it on first use."""
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def built(self, name: str) -> Any:
+        """Return the named client if it was already built, without building it."""
+        return self._instances.get(name)
+
+    def reset(self) -> None:
+        """Drop all built clients, they are rebuilt on next use."""
+        with self._lock:
+            self._instances.clear()
+
+
+services = ServiceRegistry()
+
+
+def _openai_client():
+    from flask import current_app
+    from openai import OpenAI
+
+    # None keeps the official API, a URL points at a stand-in such as fakes.speech_apis
+    return OpenAI(base_url=current_app.config['OPENAI_BASE_URL'],
+                  max_retries=current_app.config['OPENAI_MAX_RETRIES'])
+
+
+def _analytics_dispatcher():
+    from flask import current_app
+    from app.analytics import AnalyticsDispatcher
+
+    config = current_app.config
+    return AnalyticsDispatcher(config['AMPLITUDE_API_URL'],
+                               config['AMPLITUDE_API_KEY'],
+                               max_queue_size=config['ANALYTICS_QUEUE_SIZE'],
+                               batch_size=config['ANALYTICS_BATCH_SIZE'],
+                               flush_interval=config['ANALYTICS_FLUSH_SECONDS'])
+
+
+services.register('openai', _openai_client)
+services.register('analytics', _analytics_dispatcher)
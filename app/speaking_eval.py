@@ -3,21 +3,24 @@ from __future__ import annotations
 import base64
 import json
 import os
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from io import BytesIO
+from functools import partial
 from types import MappingProxyType
 from typing import IO, Optional
 
-from openai import OpenAI
-
-client = OpenAI()
 import requests
-from pydub import AudioSegment
-from tenacity import retry, stop_after_attempt, wait_fixed, RetryError
+from flask import current_app
 
-from app.models import QuestionSet, Subsection
+from app.audio import AudioBuffer, InvalidAudioError, transcode_to_opus
+from app.catalog import get_catalog, CatalogQuestionSet, CatalogSubsection
+from app.memory import EvaluationMemory
+from app.llm_output import MalformedEvaluationError, SpeakingEvaluation, parse_evaluation, reask_message
+from app.llm_router import get_model_router
+from app.metrics import DIALOGS_SHORTENED, LLM_OUTPUT_REPAIRS, LLM_TOKENS, backend_call
+from app.pipeline import Pipeline, RetryPolicy, Stage, StageError
+from app.prompts import estimate_tokens, evaluation_prefix, fit_answers
+from app.services import services
+from app.tracing import current_span
 
 
 @dataclass(frozen=True)
@@ -31,7 +34,7 @@ class SpeakingResults:
 
     Attributes:
     ------------
-    questions_set : QuestionSet
+    questions_set : CatalogQuestionSet
         The set of questions presented during the IELTS speaking test.
 
     answers : tuple[str]
@@ -48,19 +51,23 @@ class SpeakingResults:
         An immutable mapping of evaluated IELTS scores in various categories
         (e.g., pronunciation, grammar).
 
+    llm_model : str
+        The ChatGPT model that evaluated the answers.
+
     Properties:
     ------------
-    subsection : Subsection
+    subsection : CatalogSubsection
         A specific subsection of the IELTS speaking test.
 
-    section : Section
+    section : CatalogSection
         The corresponding section of the IELTS speaking test.
     """
-    questions_set: QuestionSet
+    questions_set: CatalogQuestionSet
     answers: tuple[str]
     answers_pron_scores: tuple[dict]
     general_feedback: str
     ielts_scores: MappingProxyType
+    llm_model: str
 
     @property
     def subsection(self):
@@ -68,7 +75,7 @@ class SpeakingResults:
 
     @property
     def section(self):
-        return self.questions_set.subsection.section
+        return get_catalog().section(self.questions_set.subsection.section_id)
 
 
 class SpeechEvaluator:
@@ -84,86 +91,91 @@ class SpeechEvaluator:
     consolidated into IELTS scores.
 
     Attributes:
-    - questions_set: An instance of the QuestionSet class containing IELTS speaking questions.
+    - questions_set: A CatalogQuestionSet containing IELTS speaking questions.
     - audio_files: A tuple of audio file objects containing the user's spoken responses.
+      They are wrapped in AudioBuffers once and shared by all stages without copies.
+    - memory: EvaluationMemory, the audio bytes and RSS peaks of this evaluation.
     """
 
-    def __init__(self, questions_set: QuestionSet, audio_files: tuple[IO[bytes]]):
+    def __init__(self, questions_set: CatalogQuestionSet, audio_files: tuple[IO[bytes]]):
         self.questions_set = questions_set
         self.subsection = questions_set.subsection
-        self._audio_files = audio_files
+        self.memory = EvaluationMemory()
+        with self.memory.tracking():
+            self._audio_files = tuple(AudioBuffer.from_upload(file) for file in audio_files)
+        self.timings = {}
 
-        self._transcribed_answers = None
-        self._azure_pron_scores = None
-        self._gpt_speech_evaluation = None
-        self._ielts_scores = {}
+    @property
+    def audio_bytes(self) -> int:
+        """Size of the recorded answers."""
+        return sum(len(audio) for audio in self._audio_files)
+
+    @property
+    def audio_digest(self) -> tuple[str]:
+        """Hashes of the recorded answers, identifying this submission's audio."""
+        return tuple(audio.digest() for audio in self._audio_files)
 
     def evaluate_speaking(self) -> SpeakingResults:
-        """Evaluate speaking by orchestrating transcription and assessments."""
+        """
+        Evaluate speaking by running SPEAKING_PIPELINE.
+
+        Whisper transcription and the opus transcoding for Azure run in
+        parallel; ChatGPT and Azure then assess the transcripts in parallel,
+        and the IELTS scores are calculated from both.
+        """
+        try:
+            with self.memory.evaluating():
+                run = SPEAKING_PIPELINE.run(audio=self._audio_files,
+                                            questions_set=self.questions_set,
+                                            subsection=self.subsection)
+        except StageError as e:
+            if isinstance(e.cause, SpeechEvaluationError):
+                raise e.cause
+            print(e)
+            raise SpeechEvaluationError(_STAGE_ERRORS.get(e.stage, 'Evaluation error. Please try again.'))
+        self.timings = run.timings
 
-        # Step 1: Transcribe audio with OpenAI Whisper
-        self._transcribe_audio_files()
+        return SpeakingResults(questions_set=self.questions_set,
+                               answers=run['transcripts'],
+                               answers_pron_scores=run['pron_scores'],
+                               general_feedback=run['gpt_evaluation']['generalFeedback'],
+                               ielts_scores=MappingProxyType(run['ielts_scores']),
+                               llm_model=run['llm_model'])
 
-        # Step 2: Concurrently assess speech with ChatGPT and pronunciation with Azure
-        self._concurrent_speech_and_pronunciation_evaluation()
+    @classmethod
+    def get_dialog_text(cls, questions_set: CatalogQuestionSet, transcripts: tuple[str],
+                        max_tokens: Optional[int] = None) -> str:
+        """
+        Generate a dialog string using questions and transcribed answers.
 
-        # Step 3: Calculate IELTS scores from ChatGPT and Azure responses
-        self._calculate_ielts_scores()
+        Answers are shortened so the dialog stays within max_tokens
+        (PROMPT_DIALOG_MAX_TOKENS by default); the cue card and every question
+        are kept whole, and so is every answer that fits its share.
+        """
+        if max_tokens is None:
+            max_tokens = current_app.config['PROMPT_DIALOG_MAX_TOKENS']
 
-        return SpeakingResults(questions_set=self.questions_set,
-                               answers=self._transcribed_answers,
-                               answers_pron_scores=self._azure_pron_scores,
-                               general_feedback=self._gpt_speech_evaluation['generalFeedback'],
-                               ielts_scores=MappingProxyType(self._ielts_scores))
-
-    def _transcribe_audio_files(self) -> None:
-        """Transcribe audio files using ChatGPT."""
-        with ThreadPoolExecutor() as executor:
-            try:
-                self._transcribed_answers = tuple(executor.map(
-                    ChatGPT.transcribe_audio_file,
-                    self._audio_files))
-            except RetryError:
-                raise SpeechEvaluationError('Transcription error. Please try again.')
-
-    def _concurrent_speech_and_pronunciation_evaluation(self) -> None:
-        """Evaluate speech and pronunciation in parallel."""
-        with ThreadPoolExecutor() as executor:
-            # creating text dialog with questions and user answers
-            dialog = self._get_dialog_text()
-
-            chatgpt_future = executor.submit(ChatGPT.evaluate_speech, dialog, self.subsection)
-            azure_future = executor.submit(self._assess_pronunciation_in_bulk)
-
-            self._gpt_speech_evaluation = chatgpt_future.result()
-            self._azure_pron_scores = azure_future.result()
-
-    # def _assess_pronunciation_in_bulk(self) -> tuple:
-    #     """Evaluate pronunciation with Azure of all transcribed answers in bulk."""
-    #     with ThreadPoolExecutor() as executor:
-    #         audiofile_and_transcript_pairs = zip(self._audio_files, self._transcribed_answers)
-    #         return tuple(executor.map(AzurePronunciationAssessor.get_assessment_from_tuple,
-    #                             audiofile_and_transcript_pairs))
-
-    def _assess_pronunciation_in_bulk(self) -> tuple:
-        results = []
-        audiofile_and_transcript_pairs = zip(self._audio_files,
-                                             self._transcribed_answers)
-
-        for pair in audiofile_and_transcript_pairs:
-            result = AzurePronunciationAssessor.get_assessment_from_tuple(pair)
-            results.append(result)
-            time.sleep(1)  # задержка между запросами
-
-        return tuple(results)
-
-    def _get_dialog_text(self) -> str:
-        """Generate a dialog string using questions and transcribed answers."""
+        dialog = cls._format_dialog(questions_set, transcripts)
+        if len(dialog) <= max_tokens:
+            return dialog  # a token is at least one character
+
+        frame_tokens = estimate_tokens(cls._format_dialog(questions_set, ('',) * len(transcripts)))
+        answers, shortened = fit_answers(transcripts, max_tokens - frame_tokens)
+        if not shortened:
+            return dialog
+        part_number = questions_set.subsection.part_number
+        DIALOGS_SHORTENED.labels(part_number).inc()
+        print(f'Shortened {shortened} of {len(answers)} answers of part {part_number} '
+              f'to fit {max_tokens} tokens')
+        return cls._format_dialog(questions_set, answers)
+
+    @staticmethod
+    def _format_dialog(questions_set: CatalogQuestionSet, transcripts: tuple[str]) -> str:
 
         # Create cue card and answer for IELTS Speaking part 2
-        if self.subsection.part_number == 2:
-            topic = self.questions_set.topic
-            questions = "\n- ".join(question.text for question in self.questions_set)
+        if questions_set.subsection.part_number == 2:
+            topic = questions_set.topic
+            questions = "\n- ".join(question.text for question in questions_set)
             dialog = f'''\
 Cue card:
 ###
@@ -176,30 +188,34 @@ You should say:
 
 Student Answer:
 ###
-{self._transcribed_answers[0]}
+{transcripts[0]}
 ###'''
             return dialog
 
         # Create dialog for IELTS Speaking part 1 or 3
         dialog = []
-        for question, answer in zip(self.questions_set, self._transcribed_answers):
+        for question, answer in zip(questions_set, transcripts):
             question_and_answer = f'Q: {question.text}\nA: {answer}'
             dialog.append(question_and_answer)
         return "\n\n".join(dialog)
 
-    def _calculate_ielts_scores(self) -> None:
+    @classmethod
+    def calculate_ielts_scores(cls, gpt_evaluation: dict, pron_scores: tuple[dict]) -> dict:
         """Calculate IELTS scores based on GPT and Azure evaluations."""
 
-        self._ielts_scores['lexicalResource'] = self._gpt_speech_evaluation['lexicalResource']['score']
-        self._ielts_scores['grammaticalRangeAndAccuracy'] = self._gpt_speech_evaluation['grammaticalRangeAndAccuracy']['score']
-        self._ielts_scores['pronunciation'] = self._get_avg_score_from_azure_pron_eval('PronScore')
-        self._ielts_scores['fluencyAndCoherence'] = self._get_fluency_and_coherence_score()
+        return {
+            'lexicalResource': gpt_evaluation['lexicalResource']['score'],
+            'grammaticalRangeAndAccuracy': gpt_evaluation['grammaticalRangeAndAccuracy']['score'],
+            'pronunciation': cls._get_avg_score_from_azure_pron_eval(pron_scores, 'PronScore'),
+            'fluencyAndCoherence': cls._get_fluency_and_coherence_score(gpt_evaluation, pron_scores),
+        }
 
-    def _get_avg_score_from_azure_pron_eval(self, score_name: str) -> int:
+    @staticmethod
+    def _get_avg_score_from_azure_pron_eval(pron_scores: tuple[dict], score_name: str) -> int:
         """Calculate average pronunciation score from Azure assessments."""
 
         # Extract the specified scores from azure answers evaluation
-        scores = tuple(score['NBest'][0][score_name] for score in self._azure_pron_scores)
+        scores = tuple(score['NBest'][0][score_name] for score in pron_scores)
 
         # Compute the average score on a 100-point scale
         avg_score = sum(scores) / len(scores)
@@ -207,14 +223,15 @@ Student Answer:
         # Convert the score to a 9-point scale and round it
         return round(avg_score / 100 * 9)
 
-    def _get_fluency_and_coherence_score(self) -> int:
+    @classmethod
+    def _get_fluency_and_coherence_score(cls, gpt_evaluation: dict, pron_scores: tuple[dict]) -> int:
         """Derive a fluency and coherence score from Azure and GPT evaluations."""
 
         # Calculate average fluency score from Azure pron evaluation
-        fluency_score = self._get_avg_score_from_azure_pron_eval('FluencyScore')
+        fluency_score = cls._get_avg_score_from_azure_pron_eval(pron_scores, 'FluencyScore')
 
         # Get the coherence score from ChatGPT evaluation
-        coherence_score = self._gpt_speech_evaluation['coherence']['score']
+        coherence_score = gpt_evaluation['coherence']['score']
 
         # Return the average of fluency and coherence scores
         return round((fluency_score + coherence_score) / 2)
@@ -226,16 +243,28 @@ class ChatGPT:
     """
 
     @classmethod
-    def evaluate_speech(cls, dialog: str, subsection: Subsection) -> dict:
+    def evaluate_speech(cls, dialog: str, subsection: CatalogSubsection) -> tuple[dict, str]:
         """
         Evaluate an IELTS Speaking test dialog using ChatGPT.
 
+        The model is chosen for the subsection's part by the ModelRouter, which
+        fails over to the part's alternate models when one errors or is slow.
+
+        The reply is validated against SpeakingEvaluation. Fences, text around
+        the JSON and out-of-range scores are repaired locally; fields that are
+        still missing or invalid are asked for in a follow-up in the same
+        conversation, up to LLM_REASK_ATTEMPTS times, instead of evaluating
+        the whole dialog again.
+
         Parameters:
         - dialog (str): The IELTS Speaking test dialog.
-        - subsection (Subsection): The subsection information.
+        - subsection (CatalogSubsection): The subsection information.
 
         Returns:
-        - dict: The ChatGPT evaluation response.
+        - tuple: The ChatGPT evaluation response and the model that gave it.
+
+        Raises:
+        - MalformedEvaluationError: Fields are still missing after the follow-ups.
 
         Example of returned data:
         {
@@ -246,72 +275,76 @@ class ChatGPT:
         }
         """
 
-        # Preparing system and user messages for ChatGPT interaction
-        system_message = "You act as a professional IELTS examiner."
-        response_json_schema = """{"type":"object","properties":{"coherence":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"lexicalResource":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"grammaticalRangeAndAccuracy":{"type":"object","properties":{"score":{"type":"integer","minimum":0,"maximum":9}}},"generalFeedback":{"type":"string","maxLength":300}},"required":["coherence","lexicalResource","grammaticalRangeAndAccuracy","generalFeedback"]}"""
-        prompt = f"""\
-    As an AI model simulating a professional IELTS examiner, your task is to evaluate a transcription of a student's dialogue from the IELTS Speaking Part {subsection.part_number}: {subsection.name}.
-    Your evaluation should strictly adhere to the official IELTS Speaking Band Descriptors for the following criteria: "Coherence" (a component of "Fluency and Coherence"), "Lexical Resource", "Grammatical Range and Accuracy", and "Pronunciation". Use the standard IELTS scoring methodology, but specifically for the "Fluency and Coherence" criterion, evaluate only "Coherence".
-
-    Provide a "score" for each mentioned criterion. This score should be a number from 0 to 9, representing the student's performance on that criterion in accordance with the official IELTS Speaking Band Descriptors for Academic and General Training tests.
-
-    In addition, provide a "generalFeedback" text of up to 300 characters. It should be a friendly and personalized note directly addressing the student. Craft it to encapsulate your overall impressions about the student's performance without mentioning specific criteria, and focus instead on providing a broader picture of their achievements.
-
-    Input:
-    '''
-    {dialog}
-    '''
-
-    The expected JSON schema for your response is as follows:
-    '''
-    {response_json_schema}
-    '''
-    Your answer should be a straightforward JSON object without extra spaces or lines, adhering to the above JSON schema.\
-    """
-
-        # Structuring messages for sending to ChatGPT
-        chatgpt_messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt}
-        ]
-
-        try:
-            # Obtaining a response from ChatGPT
-            chatgpt_response_text = cls._get_chat_completion(chatgpt_messages)
-            return json.loads(chatgpt_response_text)
-        except (RetryError, json.decoder.JSONDecodeError):
-            raise SpeechEvaluationError("Error during speech evaluation with ChatGPT")
+        # The static instructions and schema of the subsection come first, the
+        # dialog last, so every request shares the provider-cached prefix
+        prefix = evaluation_prefix(subsection.part_number, subsection.name)
+        chatgpt_messages = prefix.with_dialog(dialog)
+
+        estimated_tokens = prefix.tokens + estimate_tokens(chatgpt_messages[-1]["content"])
+        LLM_TOKENS.labels('estimated_prompt').observe(estimated_tokens)
+        current_span().set_attribute('estimated_prompt_tokens', estimated_tokens)
+
+        # Obtaining a response from ChatGPT; API errors are retried by the
+        # pipeline, malformed replies only by the follow-ups below
+        router = get_model_router()
+        chatgpt_response_text, model = router.call(
+            subsection.part_number, partial(cls._get_chat_completion, chatgpt_messages))
+        parsed = parse_evaluation(chatgpt_response_text)
+        evaluation, missing = parsed.values, parsed.missing
+
+        for _ in range(current_app.config['LLM_REASK_ATTEMPTS']):
+            if not missing:
+                break
+            LLM_OUTPUT_REPAIRS.labels('reask').inc()
+            current_span().set_attribute('reasked', ','.join(missing))
+            chatgpt_messages = chatgpt_messages + [{"role": "assistant", "content": chatgpt_response_text},
+                                                  reask_message(missing)]
+            # the follow-up continues the conversation with the same model
+            chatgpt_response_text, model = router.call(
+                subsection.part_number, partial(cls._get_chat_completion, chatgpt_messages),
+                models=[model])
+            parsed = parse_evaluation(chatgpt_response_text, fields=missing)
+            evaluation.update(parsed.values)
+            missing = parsed.missing
+
+        if missing:
+            raise MalformedEvaluationError(missing)
+        return SpeakingEvaluation.model_validate(evaluation).model_dump(), model
 
     @classmethod
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
     def _get_chat_completion(cls, messages: list,
-                             temperature=0,
-                             model="gpt-3.5-turbo") -> str:
-        """Retrieve a ChatGPT completion with retry logic."""
-
-        completion = client.chat.completions.create(model=model,
-        messages=messages,
-        temperature=temperature)
+                             model: str,
+                             temperature=0) -> str:
+        """Retrieve a ChatGPT completion."""
+
+        with backend_call('gpt') as call:
+            call.set_attribute('model', model)
+            completion = services.get('openai').chat.completions.create(model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=current_app.config['LLM_CALL_TIMEOUT_SECONDS'])
+            if completion.usage is not None:
+                call.set_attribute('prompt_tokens', completion.usage.prompt_tokens)
+                call.set_attribute('completion_tokens', completion.usage.completion_tokens)
+                LLM_TOKENS.labels('prompt').observe(completion.usage.prompt_tokens)
+                LLM_TOKENS.labels('completion').observe(completion.usage.completion_tokens)
         return completion.choices[0].message.content
 
     @classmethod
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
-    def transcribe_audio_file(cls, audio_file: IO[bytes]) -> Optional[str]:
+    def transcribe_audio_file(cls, audio: AudioBuffer) -> Optional[str]:
         """Transcribe an audio file using OpenAI Whisper."""
         # Transcribing audio file using OpenAI Whisper ASR API
 
-        audio_file_bytes = BytesIO(audio_file.read())
-        audio_file_bytes.name = 'audio.webm'
+        # A fresh reader per attempt, the upload streams from the shared buffer
+        with backend_call('whisper') as call:
+            call.set_attribute('bytes', len(audio))
+            transcript = services.get('openai').audio.transcriptions.create(
+                model="whisper-1",
+                file=(audio.name, audio.reader()),
+                language='en',
+                response_format='text'
+            )
 
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file_bytes,
-            language='en',
-            response_format='text'
-        )
-
-        # Resetting the file pointer after read operation
-        audio_file.seek(0)
         transcript = transcript.strip()
         print(transcript)
 
@@ -323,17 +356,17 @@ class ChatGPT:
 
 class AzurePronunciationAssessor:
     _LANGUAGE_CODE = "en-US"
-    _AZURE_REGION = "germanywestcentral"
     _azure_api_key = os.getenv("AZURE_API_KEY")
+    # concurrent requests per process, the subscription's rate limit is low
+    MAX_CONCURRENCY = int(os.getenv("AZURE_MAX_CONCURRENCY", 2))
 
     @classmethod
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
-    def get_assessment(cls, audio_file: IO, transcript: str) -> dict:
+    def get_assessment(cls, opus_audio: AudioBuffer, transcript: str) -> dict:
         """
         Get the assessment of the pronunciation from Azure.
 
         Parameters:
-        - audio_file (IO): An input audio file.
+        - opus_audio (AudioBuffer): The recorded answer, transcoded by transcode_to_opus.
         - transcript (str): The transcript to assess against.
 
         Returns:
@@ -364,9 +397,6 @@ class AzurePronunciationAssessor:
             ]
         }
         """
-        audio_file.seek(0)
-        audio_file = cls._convert_audio_to_opus_bytesio(audio_file)
-
         pronunciation_assessment_params = json.dumps({
             "ReferenceText": transcript,
             "GradingSystem": "HundredMark",
@@ -378,7 +408,7 @@ class AzurePronunciationAssessor:
         pronunciation_assessment_params = base64.b64encode(
             pronunciation_assessment_params.encode('utf-8')).decode("utf-8")
 
-        azure_api_url = f"https://{cls._AZURE_REGION}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1?language={cls._LANGUAGE_CODE}&usePipelineVersion=0"
+        azure_api_url = f"{current_app.config['AZURE_SPEECH_ENDPOINT']}/speech/recognition/conversation/cognitiveservices/v1?language={cls._LANGUAGE_CODE}&usePipelineVersion=0"
         azure_api_headers = {
             'Accept': 'application/json;text/xml',
             'Connection': 'Keep-Alive',
@@ -389,71 +419,66 @@ class AzurePronunciationAssessor:
             'Expect': '100-continue'
         }
 
-        try:
-            azure_api_response = cls._get_azure_response(
-                url=azure_api_url,
-                data=cls._get_chunk(audio_file),
-                headers=azure_api_headers)
-        except RetryError:
-            raise SpeechEvaluationError('Error during Azure pronunciation evaluation')
+        azure_api_response = cls._get_azure_response(
+            url=azure_api_url,
+            audio=opus_audio,
+            headers=azure_api_headers)
         return azure_api_response.json()
 
-    @classmethod
-    def get_assessment_from_tuple(cls, audiofile_and_transcript: tuple) -> dict:
-        return cls.get_assessment(*audiofile_and_transcript)
-
     @staticmethod
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
-    def _get_azure_response(url, data, headers):
-        print('_get_azure_response')
-        time.sleep(1)
-        response = requests.post(url=url, data=data, headers=headers)
-        print(response.status_code)
-        if response.status_code != 200:
-            print(response.text)
-            raise Exception("Ошибка при отправке файла: " + response.text)
+    def _get_azure_response(url, audio: AudioBuffer, headers):
+        # Retries are spaced by the stage's RetryPolicy; chunks() is a new
+        # iterator per attempt, so retries resend the whole file
+        with backend_call('azure') as call:
+            call.set_attribute('bytes', len(audio))
+            response = requests.post(url=url, data=audio.chunks(), headers=headers)
+            call.set_attribute('http.status_code', response.status_code)
+            if response.status_code != 200:
+                raise Exception("Ошибка при отправке файла: " + response.text)
         return response
 
-    @staticmethod
-    def _get_chunk(audio_file: IO, chunk_size=1024):
-        while True:
-            chunk = audio_file.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
-
-    @staticmethod
-    def _convert_audio_to_opus_bytesio(audio_file: IO) -> BytesIO:
-        """
-        Convert audio file to OPUS format with a 16000 Hz frame rate and single channel,
-        returning it as a BytesIO object.
-
-        Parameters:
-        - audio_file (IO): An input audio file.
-
-        Returns:
-        - BytesIO: The converted audio in OPUS format as a BytesIO object.
-        """
-        # Convert FileStorage to Bytes
-        blob = BytesIO(audio_file.read())
-        blob.name = 'audio.webm'
-
-        # Load the file in webm format
-        audio = AudioSegment.from_file(blob, format="webm")
-
-        # Set audio parameters
-        audio = audio.set_frame_rate(16000)
-        audio = audio.set_channels(1)
-
-        # Convert back to BytesIO
-        output_blob = BytesIO()
-        audio.export(output_blob, format="opus")
-
-        # Reset the pointer to the start of BytesIO to read from the beginning
-        output_blob.seek(0)
-
-        return output_blob
-
 
 class SpeechEvaluationError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+_RETRY_API_CALL = RetryPolicy(attempts=5, wait_seconds=1, give_up_on=(SpeechEvaluationError,))
+# every attempt already fails over through the healthy models of the part, and
+# a reply still malformed after the follow-ups is not worth resending the whole dialog
+_RETRY_LLM_CALL = RetryPolicy(attempts=2, wait_seconds=1,
+                              give_up_on=(SpeechEvaluationError, MalformedEvaluationError))
+
+# Shown to the user when a stage fails with anything but a SpeechEvaluationError
+_STAGE_ERRORS = {
+    'transcribe': 'Transcription error. Please try again.',
+    'transcode': 'Could not process the audio recording. Please try again.',
+    'llm_evaluate': 'Error during speech evaluation with ChatGPT',
+    'assess_pronunciation': 'Error during Azure pronunciation evaluation',
+}
+
+SPEAKING_PIPELINE = Pipeline('speaking_eval', [
+    Stage('transcribe', ChatGPT.transcribe_audio_file,
+          inputs=('audio',), outputs=('transcripts',), map_over=('audio',),
+          backend='whisper', executor='transcription', timeout=120, retry=_RETRY_API_CALL),
+    Stage('transcode', transcode_to_opus,
+          inputs=('audio',), outputs=('opus_audio',), map_over=('audio',),
+          backend='ffmpeg', executor='transcode', timeout=60,
+          retry=RetryPolicy(attempts=2, give_up_on=(InvalidAudioError,))),
+    Stage('dialog', SpeechEvaluator.get_dialog_text,
+          inputs=('questions_set', 'transcripts'), outputs=('dialog',)),
+    Stage('llm_evaluate', ChatGPT.evaluate_speech,
+          inputs=('dialog', 'subsection'), outputs=('gpt_evaluation', 'llm_model'),
+          backend='gpt', executor='llm', timeout=180, retry=_RETRY_LLM_CALL),
+    Stage('assess_pronunciation', AzurePronunciationAssessor.get_assessment,
+          inputs=('opus_audio', 'transcripts'), outputs=('pron_scores',),
+          map_over=('opus_audio', 'transcripts'), backend='azure', executor='assessment',
+          max_concurrency=AzurePronunciationAssessor.MAX_CONCURRENCY, timeout=180,
+          retry=_RETRY_API_CALL),
+    Stage('score', SpeechEvaluator.calculate_ielts_scores,
+          inputs=('gpt_evaluation', 'pron_scores'), outputs=('ielts_scores',)),
+])
+
+# Re-scoring a stored attempt: its transcripts and pronunciation assessments
+# are passed in, so only ChatGPT is called again
+RESCORING_PIPELINE = Pipeline('speaking_rescore', [
+    stage for stage in SPEAKING_PIPELINE.stages if stage.name in ('dialog', 'llm_evaluate', 'score')])
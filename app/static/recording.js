@@ -24,6 +24,9 @@ let mediaRecorder;
 let recordedChunks = [];
 let recordedAudioFiles = []; // array to store recorded audio files
 
+// One key per practice attempt, so a resubmission is not evaluated twice
+const idempotencyKey = crypto.randomUUID();
+
 // Button click event listener
 microphoneButton.addEventListener('click', function() {
   initializeMediaRecorder();
@@ -198,6 +201,7 @@ completePracticeButton.addEventListener('click', function() {
 
     fetch('/section/speaking/practice', {
       method: 'POST',
+      headers: {'Idempotency-Key': idempotencyKey},
       body: formData
     })
     .then(response => {
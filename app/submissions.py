@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Optional
+
+from app.cache import TTLCache
+
+
+class IdempotencyKeyReused(Exception):
+    """The idempotency key was already used for a different submission."""
+
+
+class InFlightRegistry:
+    """
+    Runs each distinct submission once, however many times it is posted.
+
+    A submission is identified by (user, question set, audio hash). The first
+    request for a key runs the evaluation; duplicates arriving while it runs
+    wait for the same result instead of starting their own, and duplicates
+    arriving afterwards get the stored result until it expires. Failed
+    evaluations are not stored, so a retry after an error runs again.
+
+    The registry is per process: duplicates are only caught when they reach
+    the same gunicorn worker, which is the common case for a double click on
+    a keep-alive connection.
+
+    Attributes:
+    - ttl: Seconds a completed result is kept.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600):
+        self.ttl = ttl
+        self._running = {}
+        self._completed = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._idempotency_keys = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, func: Callable[[], Any],
+            idempotency_key: Optional[Hashable] = None, ttl: Optional[float] = None) -> Any:
+        """
+        Return func()'s result for this key, running it only if no request
+        with the same key is running or completed.
+
+        Args:
+            key: Identity of the submission.
+            func: Evaluation to run when the key is new.
+            idempotency_key: Client-chosen key of the attempt, scoped by the
+                caller (e.g. to the user).
+            ttl: Seconds to keep the result, defaults to the registry's ttl.
+
+        Raises:
+            IdempotencyKeyReused: If idempotency_key was seen with another key.
+        """
+        with self._lock:
+            if idempotency_key is not None:
+                known_key = self._idempotency_keys.get(idempotency_key)
+                if known_key is not None and known_key != key:
+                    raise IdempotencyKeyReused()
+                self._idempotency_keys.set(idempotency_key, key, ttl)
+
+            future = self._completed.get(key) or self._running.get(key)
+            owner = future is None
+            if owner:
+                future = self._running[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._running[key]
+                if future.exception() is None:
+                    self._completed.set(key, future, ttl)
+        return future.result()
+
+
+evaluations = InFlightRegistry()
@@ -0,0 +1,278 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+import requests
+from flask import g, request
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span',
+                                                                                 default=None)
+
+
+class Span:
+    """
+    One timed operation of a trace.
+
+    Spans started while another span is current become its children. The
+    current span lives in a context variable, so it follows the code into
+    asyncio tasks, and NamedExecutor copies it into the executor threads.
+
+    Attributes:
+    - trace_id: 32 hex digits shared by all spans of a request or job.
+    - span_id: 16 hex digits.
+    - parent_id: span_id of the parent, None for the root span.
+    - attributes: Details such as backend, bytes, retries or http status.
+    - status: 'ok' or 'error'.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns',
+                 'attributes', 'status')
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = 'ok'
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.status = 'error'
+        self.attributes['error.type'] = type(exception).__name__
+        self.attributes['error.message'] = str(exception)[:500]
+
+    def to_dict(self) -> dict:
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                'name': self.name, 'start_time_ns': self.start_ns, 'end_time_ns': self.end_ns,
+                'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+                'status': self.status, 'attributes': self.attributes}
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled, so callers never check for it."""
+    trace_id = span_id = parent_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class JsonlExporter:
+    """
+    Appends each finished span as one JSON line to a local file.
+
+    Every line is written with a single O_APPEND write, so several gunicorn
+    workers can share the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def export(self, span: Span) -> None:
+        os.write(self._fd, (json.dumps(span.to_dict(), default=str) + '\n').encode())
+
+    def shutdown(self) -> None:
+        os.close(self._fd)
+
+
+class OtlpExporter:
+    """
+    Sends spans in OTLP/JSON batches to a collector's /v1/traces endpoint.
+
+    Like the analytics dispatcher, spans go on a bounded queue and a daemon
+    thread posts them, so a slow collector never delays requests; spans that
+    do not fit in the queue are dropped.
+
+    Attributes:
+    - endpoint: e.g. http://127.0.0.1:4318/v1/traces or fakes.trace_collector.
+    - service_name: Reported as the service.name resource attribute.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = 'ielts-practice',
+                 max_queue_size: int = 10000, batch_size: int = 256,
+                 flush_interval: float = 2.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._session = requests.Session()
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + (0 if self._stopping.is_set() else self.flush_interval)
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch: list) -> None:
+        try:
+            self._session.post(self.endpoint, json=self._payload(batch), timeout=10).raise_for_status()
+        except requests.RequestException as e:
+            print(f'Failed to export {len(batch)} spans: {e}')
+
+    def _payload(self, batch: list) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [
+                {'traceId': span.trace_id, 'spanId': span.span_id,
+                 'parentSpanId': span.parent_id or '', 'name': span.name,
+                 'startTimeUnixNano': str(span.start_ns), 'endTimeUnixNano': str(span.end_ns),
+                 'attributes': [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+                 'status': {'code': 2 if span.status == 'error' else 1}}
+                for span in batch]}],
+        }]}
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+_exporter = None
+
+
+def configure_tracing(exporter) -> None:
+    """Send finished spans to exporter; None disables tracing."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+    _exporter = exporter
+    if exporter is not None:
+        atexit.register(exporter.shutdown)
+
+
+def current_span():
+    """The span of the running operation, or a no-op span."""
+    return _current_span.get() or _NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the with block as a child of the current span, or as the root span
+    of a new trace (e.g. for a CLI job) when there is none.
+
+    Exceptions leaving the block mark the span as failed and are re-raised.
+    """
+    if _exporter is None:
+        yield _NOOP_SPAN
+        return
+
+    new_span = Span(name, _current_span.get(), **attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(new_span)
+
+
+def _finish(finished: Span) -> None:
+    finished.end_ns = time.time_ns()
+    try:
+        _exporter.export(finished)
+    except Exception as e:
+        print(f'Failed to export span {finished.name}: {e}')
+
+
+def init_tracing(app) -> None:
+    """Open a root span per request when TRACING_EXPORTER is configured."""
+    exporter_name = app.config['TRACING_EXPORTER']
+    if not exporter_name:
+        return
+    if exporter_name == 'jsonl':
+        configure_tracing(JsonlExporter(app.config['TRACING_JSONL_PATH']))
+    elif exporter_name == 'otlp':
+        configure_tracing(OtlpExporter(app.config['TRACING_OTLP_ENDPOINT']))
+    else:
+        raise ValueError(f'Unknown TRACING_EXPORTER {exporter_name!r}, expected jsonl or otlp')
+
+    app.before_request(_start_request_span)
+    app.after_request(_tag_response)
+    app.teardown_request(_end_request_span)
+
+
+def _start_request_span():
+    root = Span(f'{request.method} {request.endpoint or "unmatched"}', None,
+                **{'http.method': request.method, 'http.route': str(request.url_rule or ''),
+                   'http.request_bytes': request.content_length or 0})
+    g.trace_span = root
+    g.trace_token = _current_span.set(root)
+
+
+def _tag_response(response):
+    root = g.get('trace_span')
+    if root is not None:
+        root.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            root.status = 'error'
+        # lets a slow or failed submission be looked up in the traces
+        response.headers['X-Trace-Id'] = root.trace_id
+    return response
+
+
+def _end_request_span(exception):
+    root = g.pop('trace_span', None)
+    if root is None:
+        return
+    if exception is not None:
+        root.record_exception(exception)
+    _current_span.reset(g.pop('trace_token'))
+    _finish(root)
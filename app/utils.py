@@ -1,121 +1,131 @@
-import os
 import time
 import uuid
 from collections import namedtuple
 from io import BytesIO
 
-from amplitude import Amplitude, BaseEvent
-from flask import request, session, flash, abort
-from pydub import AudioSegment
-from sqlalchemy.dialects.postgresql import UUID
+from flask import current_app, request, session, flash, abort
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
 from sqlalchemy.exc import IntegrityError, OperationalError
 from werkzeug.datastructures import FileStorage
 
+from app.audio import CHUNK_SIZE, get_webm_duration, InvalidAudioError
+from app.catalog import get_catalog, SeenQuestionSets
+from app.metrics import backend_call
 from app.content.ielts_seeds import SECTIONS, SUBSECTIONS, QUESTIONS, TOPICS
-from app.models import (Section, Subsection, QuestionSet, UserProgress,
-                        UserSubsectionAttempt, UserSubsectionAnswer,
-                        UserSpeakingAttemptResult)
+from app.models import (Section, Subsection, Topic, QuestionSet, Question,
+                        UserProgress, UserSubsectionAttempt,
+                        UserSubsectionAnswer, UserSpeakingAttemptResult)
+from app.services import services
 from config.database import db
 
-amplitude = Amplitude(os.environ.get('AMPLITUDE_API_KEY'))
 
+def seed_content() -> None:
+    """
+    Insert or update the IELTS content from app.content.ielts_seeds.
+
+    Idempotent: every table is written with a bulk upsert keyed on its
+    natural key, so running it again only applies changed descriptions and
+    adds new content. Question sets are matched by their subsection, topic
+    and list of questions, so editing a question adds a new set. Sets that
+    are no longer in the seed data are deactivated rather than deleted, past
+    attempts still refer to them and their questions.
+    """
+    section_ids = _upsert(Section, SECTIONS, ('name',))
 
-def create_and_fill_out_tables(models):
-    # inserting sections
-    for section in SECTIONS:
-        new_section = models.Section(**section)
-        db.session.add(new_section)
-
-    db.session.commit()
-
-    # inserting subsections
-    for subsection in SUBSECTIONS:
-        section = models.Section.query.filter_by(
-            name=subsection["section"]).first()
-        subsection["section"] = section
-        new_subsection = models.Subsection(**subsection)
-        db.session.add(new_subsection)
-    db.session.commit()
-
-    # inserting PART 1 topics
-    for question_set in QUESTIONS:
-        subsection = models.Subsection.query.filter_by(
-            name=question_set["subsection"]).first()
-
-        # inserting new subsection_question
-        new_question_set = models.QuestionSet(subsection=subsection)
-        db.session.add(new_question_set)
-
-        # inserting questions inside topic
-        for question in question_set["questions"]:
-            new_question = models.Question(text=question,
-                                           question_set=new_question_set)
-            db.session.add(new_question)
+    subsection_rows = [{**{k: v for k, v in sub.items() if k != 'section'},
+                        'section_id': section_ids[(sub['section'],)]}
+                       for sub in SUBSECTIONS]
+    subsection_ids = _upsert(Subsection, subsection_rows,
+                             ('section_id', 'part_number'), returning=('name',))
+    subsection_ids = {name: id_ for (name,), id_ in subsection_ids.items()}
 
-    db.session.commit()
+    topic_ids = _upsert(Topic, [{'name': t['name'], 'description': t['description']}
+                                for t in TOPICS], ('name',))
 
-    # inserting PART 2-3 topics
+    # question sets, matched on their subsection, topic and questions
+    discussion_subsection_id = subsection_ids["Two-way Discussion"]
+    seeded = [(subsection_ids[qs['subsection']], None, tuple(qs['questions'])) for qs in QUESTIONS]
     for topic in TOPICS:
-        subsection = models.Subsection.query.filter_by(
-            name=topic["subsection"]).first()
-
-        # inserting new topic
-        new_topic = models.Topic(name=topic["name"],
-                                 description=topic["description"])
-        db.session.add(new_topic)
-
-        # inserting topic GENERAL questions
-        new_question_set = models.QuestionSet(subsection=subsection,
-                                              topic=new_topic)
-        db.session.add(new_question_set)
-
-        for question in topic["general_questions"]:
-            new_question = models.Question(text=question,
-                                           question_set=new_question_set)
-            db.session.add(new_question)
-
-        # inserting topic DISCUSSION questions
-        subsection = models.Subsection.query.filter_by(
-            name="Two-way Discussion").first()
-        new_question_set = models.QuestionSet(subsection=subsection,
-                                              topic=new_topic)
-
-        for question in topic["discussion_questions"]:
-            new_question = models.Question(text=question,
-                                           question_set=new_question_set)
-            db.session.add(new_question)
+        topic_id = topic_ids[(topic['name'],)]
+        seeded.append((subsection_ids[topic['subsection']], topic_id,
+                       tuple(topic['general_questions'])))
+        seeded.append((discussion_subsection_id, topic_id, tuple(topic['discussion_questions'])))
+
+    existing = {}
+    for question_set_id, subsection_id, topic_id, text in db.session.execute(
+            select(QuestionSet.id, QuestionSet.subsection_id, QuestionSet.topic_id, Question.text)
+            .join(Question, Question.question_set_id == QuestionSet.id)
+            .order_by(QuestionSet.id, Question.id)):
+        existing.setdefault((question_set_id, subsection_id, topic_id), []).append(text)
+    existing = {(subsection_id, topic_id, tuple(texts)): question_set_id
+                for (question_set_id, subsection_id, topic_id), texts in existing.items()}
+
+    # deactivate before inserting: only one set per subsection and topic may be active
+    seeded_ids = [existing[key] for key in seeded if key in existing]
+    db.session.execute(update(QuestionSet).where(QuestionSet.id.not_in(seeded_ids))
+                       .values(is_active=False))
+    db.session.execute(update(QuestionSet).where(QuestionSet.id.in_(seeded_ids))
+                       .values(is_active=True))
+
+    missing = [key for key in dict.fromkeys(seeded) if key not in existing]
+    if missing:
+        new_ids = db.session.scalars(
+            insert(QuestionSet).returning(QuestionSet.id, sort_by_parameter_order=True),
+            [{'subsection_id': subsection_id, 'topic_id': topic_id}
+             for subsection_id, topic_id, _ in missing]).all()
+        db.session.execute(insert(Question).values(
+            [{'question_set_id': question_set_id, 'text': text}
+             for (_, _, texts), question_set_id in zip(missing, new_ids) for text in texts]))
 
     db.session.commit()
 
 
-def measure_time(func):
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(
-            f"🕐 Function {func.__name__} executed in {int(execution_time)} seconds.")
-        return result
+def _upsert(model, rows: list, key: tuple, returning: tuple = ()) -> dict:
+    """
+    Bulk insert rows, updating the remaining columns of rows that already exist.
 
-    return wrapper
+    Args:
+        model: Model class to write to.
+        rows (list): Column values per row.
+        key (tuple): Column names of the natural key, backed by a unique constraint.
+        returning (tuple): Column names to key the result by instead of `key`.
+
+    Returns:
+        dict: Row ids by the `returning` (default: `key`) column values.
+    """
+    if not rows:
+        return {}
+    stmt = pg_insert(model).values(rows)
+    updates = {column: stmt.excluded[column] for column in rows[0] if column not in key}
+    # a no-op update on the key still makes RETURNING include existing rows
+    updates = updates or {key[0]: stmt.excluded[key[0]]}
+    returning = returning or key
+    stmt = stmt.on_conflict_do_update(index_elements=key, set_=updates).returning(
+        model.id, *(getattr(model, column) for column in returning))
+    return {tuple(row[1:]): row[0] for row in db.session.execute(stmt)}
 
 
 # speaking_practice_get helpers
 
 def get_current_subsection_and_last_topic(user_progress, section):
     if user_progress:
-        subsection = Subsection.query.get(user_progress.next_subsection_id)
+        subsection = get_catalog().subsection(user_progress.next_subsection_id)
         last_topic = user_progress.get_last_topic()
     else:
-        subsection = Subsection.get_by_section_and_part(section, 1)
+        subsection = get_catalog().subsection_by_part(section.id, 1)
         last_topic = None
     return subsection, last_topic
 
 
 def get_practice_data(subsection, last_topic):
-    question_set = QuestionSet.get_random_for_subsection(subsection,
-                                                         last_topic)
+    # avoid question sets this user has already been given
+    seen = SeenQuestionSets.from_token(session.get('seen_question_sets'))
+    question_set = get_catalog().random_question_set(
+        subsection.id, last_topic.id if last_topic else None, seen)
+    seen.add(question_set)
+    session['seen_question_sets'] = seen.to_token()
+
     topic_name = question_set.topic.name if question_set.topic else None
     topic_desc = question_set.topic.description if question_set.topic else None
     practice = {"part": subsection.part_number,
@@ -139,21 +149,48 @@ def get_audio_files(questions_set) -> tuple:
             audio_files.append(file)
     audio_files = tuple(audio_files)
 
-    # if Speaking part 2 (cue card)
-    if questions_set.topic and len(audio_files) == 1:
-        return audio_files
-
-    # if Speaking part 1 or part 3
-    if len(audio_files) == len(questions_set.questions):
+    # if Speaking part 2 (cue card), or part 1 or part 3
+    if ((questions_set.topic and len(audio_files) == 1)
+            or len(audio_files) == len(questions_set.questions)):
+        check_audio_durations(audio_files, questions_set.subsection)
         return audio_files
 
     flash("An error has occurred, please try again")
     abort(400, "Audio recordings do not match question count.")
 
 
+def check_audio_durations(audio_files: tuple, subsection) -> None:
+    """
+    Abort unless every answer fits the subsection's time limit and the whole
+    submission fits AUDIO_MAX_REQUEST_SECONDS.
+
+    Durations are read from the WebM headers of the spooled uploads, nothing
+    is decoded or copied.
+    """
+    config = current_app.config
+    answer_limit = subsection.time_limit_minutes * 60 + config['AUDIO_ANSWER_GRACE_SECONDS']
+
+    total = 0
+    for file in audio_files:
+        try:
+            duration = get_webm_duration(file.stream)
+        except InvalidAudioError:
+            flash("An error has occurred, please try again")
+            abort(400, "Invalid audio recording.")
+        if duration > answer_limit:
+            flash("Your answer is longer than the time limit, please try again")
+            abort(413, "Audio recording exceeds the answer time limit.")
+        total += duration
+
+    if total > config['AUDIO_MAX_REQUEST_SECONDS']:
+        flash("Your answers are too long, please try again")
+        abort(413, "Audio recordings exceed the submission time limit.")
+
+
 def commit_changes():
     try:
-        db.session.commit()
+        with backend_call('postgres'):
+            db.session.commit()
     except IntegrityError:
         db.session.rollback()
         flash("An error has occurred, please try again")
@@ -167,7 +204,7 @@ def commit_changes():
 
 
 # for azure assess_pronunciation func
-def get_chunk(audio_source, chunk_size=1024):
+def get_chunk(audio_source, chunk_size=CHUNK_SIZE):
     while True:
         chunk = audio_source.read(chunk_size)
         if not chunk:
@@ -186,11 +223,10 @@ def convert_audio_to_opus_bytesio(file_storage: FileStorage) -> BytesIO:
     Returns:
     BytesIO: The converted audio file in opus format, stored in a BytesIO object.
     """
-    # Convert FileStorage to Bytes
-    blob = BytesIO(file_storage.read())
+    from pydub import AudioSegment
 
-    # Load the file in webm format
-    audio = AudioSegment.from_file(blob, format="webm")
+    # Load the file in webm format straight from the upload
+    audio = AudioSegment.from_file(file_storage.stream, format="webm")
 
     # Set audio parameters
     audio = audio.set_frame_rate(16000)
@@ -325,7 +361,7 @@ def get_avg_score_from_answers_speech_eval(qa_data: tuple, score_name: str) -> o
 def save_speaking_results_to_database(user, question_set, speaking_result,
                                       answers_evaluation):
     # Get the 'speaking' section
-    section = Section.get_by_name("speaking")
+    section = get_catalog().section_by_name("speaking")
     # Get the current user's progress in this section
     user_progress = user.get_section_progress(section.id)
 
@@ -357,7 +393,7 @@ def save_speaking_results_to_database(user, question_set, speaking_result,
 def send_amplitude_event(user_id: UUID, event_name: str,
                          event_properties: dict[str, str] = None) -> None:
     """
-    Sends an event to Amplitude with the specified properties if amplitude_device_id is available.
+    Queues an event for Amplitude with the specified properties if amplitude_device_id is available.
 
     Args:
         user_id: UUID of the user for whom the event is being sent.
@@ -377,16 +413,14 @@ def send_amplitude_event(user_id: UUID, event_name: str,
     amplitude_device_id = session.get('amplitude_device_id')
 
     if amplitude_device_id:
-        # If the amplitude device ID exists, track the event with amplitude
-        amplitude.track(
-            BaseEvent(
-                event_type=event_name.lower(),
-                user_id=str(user_id),
-                device_id=amplitude_device_id,
-                event_properties=event_properties
-            ))
-
-        # Flush the tracked events to Amplitude
-        amplitude.flush()
+        # Queued for the background dispatcher, the request does not wait for Amplitude
+        services.get('analytics').track({
+            'event_type': event_name.lower(),
+            'user_id': str(user_id),
+            'device_id': amplitude_device_id,
+            'event_properties': event_properties or {},
+            'time': int(time.time() * 1000),
+            'insert_id': str(uuid.uuid4()),  # lets Amplitude deduplicate resent batches
+        })
     else:
         print(f'amplitude_device_id not found, user: {user_id}')
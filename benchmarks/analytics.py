@@ -0,0 +1,59 @@
+"""
+Time spent in the request by analytics tracking, against a slow local sink.
+
+Compares posting every event synchronously (what a track + flush per request
+amounts to) with queueing it on the AnalyticsDispatcher, then checks that
+every queued event reached the sink after shutdown and that a full queue
+drops events instead of blocking.
+
+Usage:
+    python -m benchmarks.analytics
+"""
+import time
+
+import requests
+
+from app.analytics import AnalyticsDispatcher
+from fakes.analytics_sink import AnalyticsSink
+
+EVENTS = 200
+SINK_DELAY = 0.05
+
+
+def event(i: int) -> dict:
+    return {'event_type': 'benchmark', 'user_id': 'benchmark', 'device_id': 'benchmark',
+            'insert_id': str(i), 'time': int(time.time() * 1000)}
+
+
+def main():
+    sink = AnalyticsSink(delay=SINK_DELAY).start()
+
+    started = time.perf_counter()
+    for i in range(20):
+        requests.post(sink.url, json={'api_key': 'x', 'events': [event(i)]}, timeout=10)
+    sync_ms = (time.perf_counter() - started) / 20 * 1000
+
+    dispatcher = AnalyticsDispatcher(sink.url, 'x', batch_size=50, flush_interval=0.2)
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        dispatcher.track(event(i))
+    queued_ms = (time.perf_counter() - started) / EVENTS * 1000
+    dispatcher.shutdown(timeout=10)
+
+    print(f'synchronous post: {sync_ms:8.3f} ms per event')
+    print(f'queued:           {queued_ms:8.3f} ms per event')
+    print(f'dispatcher stats: {dispatcher.stats()}, sink received {len(sink.events) - 20}')
+    assert dispatcher.sent == EVENTS
+
+    sink.delay = 1
+    full = AnalyticsDispatcher(sink.url, 'x', max_queue_size=10, batch_size=5)
+    started = time.perf_counter()
+    for i in range(100):
+        full.track(event(i))
+    print(f'full queue: {full.stats()} in {(time.perf_counter() - started) * 1000:.1f} ms')
+    assert full.dropped > 0
+    sink.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Peak memory of the audio handling in concurrent evaluations.
+
+Runs the audio work of SpeechEvaluator for CONCURRENCY simultaneous
+evaluations with the API calls replaced by reading the request bodies, once
+the previous way (a BytesIO copy per stage, pydub decoding and 1 KB chunks)
+and once with AudioBuffer (mmap of the spooled upload, memoryview chunks and
+ffmpeg piping). Each variant runs in a fresh interpreter and reports the peak
+of Python allocations (tracemalloc) and the peak RSS of the process.
+
+Usage:
+    python -m benchmarks.audio_memory [--seconds 120] [--answers 1] [--concurrency 4]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+VARIANTS = ('before', 'after')
+
+
+def ffmpeg_binary() -> str:
+    if shutil.which('ffmpeg'):
+        return 'ffmpeg'
+    import imageio_ffmpeg  # not a dependency of the app, only used when ffmpeg is not on PATH
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def make_recording(path: str, seconds: int) -> None:
+    # 48 kHz stereo Opus, what browsers' MediaRecorder produces
+    subprocess.run([ffmpeg_binary(), '-loglevel', 'error', '-y', '-f', 'lavfi',
+                    '-i', f'sine=frequency=220:duration={seconds}:sample_rate=48000',
+                    '-ac', '2', '-c:a', 'libopus', '-b:a', '64k', path], check=True)
+
+
+def spooled_upload(path: str):
+    upload = tempfile.SpooledTemporaryFile(max_size=256 * 1024, mode='rb+')
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, upload)
+    upload.seek(0)
+    return upload
+
+
+def evaluate_before(upload) -> int:
+    from pydub import AudioSegment
+
+    # Whisper: BytesIO(audio_file.read())
+    upload.seek(0)
+    sent = len(BytesIO(upload.read()).read())
+    upload.seek(0)
+
+    # Azure: pydub conversion from another copy, then 1 KB chunks
+    # (codec given so that pydub does not need ffprobe, decoding is the same)
+    audio = AudioSegment.from_file(BytesIO(upload.read()), format='webm', codec='opus')
+    audio = audio.set_frame_rate(16000).set_channels(1)
+    output = BytesIO()
+    audio.export(output, format='opus')
+    output.seek(0)
+    for chunk in iter(lambda: output.read(1024), b''):
+        sent += len(chunk)
+    return sent
+
+
+def evaluate_after(upload) -> int:
+    from app.audio import AudioBuffer, transcode_to_opus
+
+    audio = AudioBuffer.from_upload(upload)
+    reader = audio.reader()
+    sent = sum(len(chunk) for chunk in iter(lambda: reader.read(64 * 1024), b''))
+    for chunk in transcode_to_opus(audio).chunks():
+        sent += chunk.nbytes
+    return sent
+
+
+def run_variant(variant: str, path: str, answers: int, concurrency: int) -> dict:
+    evaluate = evaluate_before if variant == 'before' else evaluate_after
+    uploads = [[spooled_upload(path) for _ in range(answers)] for _ in range(concurrency)]
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda files: [evaluate(f) for f in files], uploads))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'variant': variant, 'python_peak_mb': peak / 2 ** 20,
+            'rss_growth_mb': (rss_peak - rss_start) / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=120)
+    parser.add_argument('--answers', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--variant', choices=VARIANTS)
+    parser.add_argument('--recording')
+    args = parser.parse_args()
+
+    if args.variant:
+        os.environ.setdefault('FFMPEG_BINARY', ffmpeg_binary())
+        from pydub import AudioSegment
+        AudioSegment.converter = os.environ['FFMPEG_BINARY']
+        print(json.dumps(run_variant(args.variant, args.recording, args.answers, args.concurrency)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = os.path.join(tmp, 'answer.webm')
+        make_recording(recording, args.seconds)
+        size_kb = os.path.getsize(recording) / 1024
+        print(f'{args.concurrency} evaluations x {args.answers} answers of {args.seconds}s '
+              f'({size_kb:.0f} KB each)')
+        for variant in VARIANTS:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.audio_memory', '--variant', variant,
+                 '--recording', recording, '--answers', str(args.answers),
+                 '--concurrency', str(args.concurrency)],
+                check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            print(f"{variant:>6}: python peak {result['python_peak_mb']:7.1f} MB "
+                  f"({result['python_peak_mb'] / args.concurrency:6.1f} MB per evaluation), "
+                  f"RSS growth {result['rss_growth_mb']:7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
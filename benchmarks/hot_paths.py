@@ -0,0 +1,182 @@
+"""
+Micro-benchmarks of the CPU-bound code on the evaluation and results paths.
+
+Runs each benchmark on the committed fixtures (benchmarks/fixtures: a WebM
+answer and Azure assessments of three long answers) and compares the best
+time per call with benchmarks/baselines/hot_paths.json. Exits with status 1
+when any benchmark is slower than its baseline by more than --threshold, so
+it can gate a change. Baselines are machine specific: record them with
+--update on the machine that runs the check.
+
+The content catalog is read from the database once, everything else runs
+in memory; API calls are never made.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.hot_paths
+        [--threshold 0.25] [--update] [--only NAME ...]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from unittest import mock
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines', 'hot_paths.json')
+REPEATS = 5
+MIN_SECONDS = 0.2  # per repeat, calls are batched until they take this long
+
+
+def load_fixtures():
+    with open(os.path.join(FIXTURES, 'answer.webm'), 'rb') as f:
+        webm = f.read()
+    with open(os.path.join(FIXTURES, 'azure_assessments.json')) as f:
+        answers = json.load(f)
+    return webm, answers
+
+
+def build_benchmarks(app) -> dict:
+    """name -> zero-argument callable, each set up with its inputs."""
+    from flask import render_template
+
+    from app.audio import AudioBuffer, transcode_to_opus
+    from app.catalog import get_catalog
+    from app.ielts_speaking import add_scores
+    from app.models import (UserProgress, UserSubsectionAnswer, UserSubsectionAttempt,
+                            UserSpeakingAttemptResult)
+    from app.speaking_eval import ChatGPT, SpeechEvaluator
+    from app.utils import get_words_low_pron_accuracy
+    from config.jinja_filters import convert_answer_object_to_html
+
+    webm, answers = load_fixtures()
+    transcripts = tuple(answer['transcript'] for answer in answers)
+    assessments = tuple(answer['assessment'] for answer in answers)
+    gpt_evaluation = {'coherence': {'score': 6}, 'lexicalResource': {'score': 7},
+                      'grammaticalRangeAndAccuracy': {'score': 6},
+                      'generalFeedback': 'Well done, keep practising linking your ideas.'}
+
+    catalog = get_catalog()
+    speaking = catalog.section_by_name('speaking')
+    part_1 = catalog.subsection_by_part(speaking.id, 1)
+    question_set = catalog.random_question_set(part_1.id)
+
+    # transient rows, exactly what the results page gets from the database
+    user_answers = [UserSubsectionAnswer(
+        question_id=question.id, transcribed_answer=transcript,
+        pronunciation_assessment_json=assessment,
+        accuracy_score=assessment['NBest'][0]['AccuracyScore'],
+        fluency_score=assessment['NBest'][0]['FluencyScore'],
+        completeness_score=assessment['NBest'][0]['CompletenessScore'],
+        pronunciation_score=assessment['NBest'][0]['PronScore'])
+        for question, transcript, assessment in zip(question_set, transcripts, assessments)]
+    attempt = UserSubsectionAttempt(subsection_id=part_1.id, question_set_id=question_set.id,
+                                    created_at=datetime.utcnow() - timedelta(minutes=5),
+                                    user_answers=user_answers)
+    attempt.results = UserSpeakingAttemptResult(
+        general_feedback=gpt_evaluation['generalFeedback'], fluency_coherence_score=6,
+        grammatical_range_accuracy_score=6, lexical_resource_score=7, pronunciation_score=7)
+    user_progress = UserProgress(id=1, section_id=speaking.id)
+
+    # the three fixture answers joined into one long answer of ~470 words
+    long_words = [word for assessment in assessments for word in assessment['NBest'][0]['Words']]
+    long_answer = UserSubsectionAnswer(pronunciation_assessment_json={
+        'RecognitionStatus': 'Success', 'NBest': [{'Words': long_words}]})
+
+    def render_results_page():
+        with app.test_request_context():
+            return render_template('subsection_results.html', result=attempt.results,
+                                   speaking_scores=attempt.results.get_speaking_scores(),
+                                   attempt=attempt, answers=attempt.user_answers,
+                                   pron_scores=attempt.get_overall_pron_scores(),
+                                   user_progress=user_progress)
+
+    gpt_response = json.dumps(gpt_evaluation)
+
+    def build_prompt():
+        # the prompt is built and the reply parsed, the API call is replaced
+        with mock.patch.object(ChatGPT, '_get_chat_completion', return_value=gpt_response):
+            dialog = SpeechEvaluator.get_dialog_text(question_set, transcripts)
+            return ChatGPT.evaluate_speech(dialog, part_1)
+
+    legacy_answers = [{'question': question, 'answer_transcription': transcript}
+                      for question, transcript in zip(question_set, transcripts)]
+
+    return {
+        'transcode_to_opus': lambda: transcode_to_opus(AudioBuffer(webm)),
+        'convert_answer_object_to_html': lambda: convert_answer_object_to_html(long_answer),
+        'get_words_low_pron_accuracy': lambda: get_words_low_pron_accuracy(user_answers),
+        'calculate_ielts_scores': lambda: SpeechEvaluator.calculate_ielts_scores(gpt_evaluation,
+                                                                                 assessments),
+        'legacy_add_scores': lambda: add_scores(copy.deepcopy(gpt_evaluation), legacy_answers,
+                                                assessments),
+        'get_overall_pron_scores': attempt.get_overall_pron_scores,
+        'get_dialog_text': lambda: SpeechEvaluator.get_dialog_text(question_set, transcripts),
+        'build_prompt': build_prompt,
+        'render_subsection_results': render_results_page,
+    }
+
+
+def measure(func) -> dict:
+    """Best and median seconds per call over REPEATS batches."""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * MIN_SECONDS / max(elapsed, 1e-9)))
+    times = sorted(t / number for t in timer.repeat(REPEATS, number))
+    return {'best': times[0], 'median': times[len(times) // 2], 'calls': number}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown over the baseline, 0.25 = 25%%')
+    parser.add_argument('--update', action='store_true', help='write the results as the new baselines')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='run only these benchmarks')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    results = {}
+    failed = []
+    with app.app_context():
+        benchmarks = build_benchmarks(app)
+        for name, func in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            func()  # warm up caches and lazy imports
+            results[name] = measure(func)
+            best = results[name]['best']
+            baseline = baselines.get(name)
+            if baseline is None:
+                verdict = 'no baseline'
+            else:
+                change = best / baseline['best'] - 1
+                verdict = f'{change:+.1%}'
+                if change > args.threshold:
+                    verdict += '  REGRESSION'
+                    failed.append(name)
+            print(f'{name:<30} {best * 1e6:>12.1f} us  (median {results[name]["median"] * 1e6:.1f})  {verdict}')
+
+    if args.update:
+        baselines.update({name: {'best': r['best'], 'median': r['median']} for name, r in results.items()})
+        os.makedirs(os.path.dirname(BASELINES), exist_ok=True)
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baselines written to {BASELINES}')
+    elif failed:
+        print(f'{len(failed)} benchmark(s) slower than baseline by more than {args.threshold:.0%}: '
+              f'{", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
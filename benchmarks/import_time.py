@@ -0,0 +1,66 @@
+"""
+Import-time budget for worker startup.
+
+Runs `python -X importtime` on create_app() in a fresh interpreter and fails
+(exit status 1) if the imports take longer than the budget, or if one of the
+heavy modules that must only be imported on first use gets imported.
+tests/test_import_time.py enforces both in the test suite; this script
+also lists the slowest packages.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.import_time [budget_ms]
+"""
+import subprocess
+import sys
+from typing import Optional
+
+BUDGET_MS = 700
+
+# imported lazily by the speaking evaluation and analytics on first use
+LAZY_MODULES = ('openai', 'pydub', 'alembic')
+
+STARTUP = 'from app import create_app; create_app()'
+
+
+def import_times(code: str, env: Optional[dict] = None) -> list:
+    """(module, self us, cumulative us, depth) for every import done by `code`, run with `env`."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            check=True, capture_output=True, text=True, env=env).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def main() -> int:
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    times = import_times(STARTUP)
+
+    total_ms = sum(cumulative for _, _, cumulative, depth in times if depth == 0) / 1000
+    lazy_imported = sorted({name.split('.')[0] for name, *_ in times} & set(LAZY_MODULES))
+
+    print(f'create_app() imports: {total_ms:.0f} ms (budget {budget_ms:.0f} ms)')
+    print('slowest packages (own import time):')
+    packages = {}
+    for name, self_us, _, _ in times:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:10]:
+        print(f'  {package:<24}{self_us / 1000:>8.1f} ms')
+
+    failed = False
+    if total_ms > budget_ms:
+        print(f'FAIL: imports exceed the budget by {total_ms - budget_ms:.0f} ms')
+        failed = True
+    if lazy_imported:
+        print(f"FAIL: imported at startup instead of on first use: {', '.join(lazy_imported)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Capacity of one dyno: simulated test-takers against gunicorn, the fake speech
+APIs and a local Postgres.
+
+Every simulated user registers and logs in, then loops over the real flow:
+open the speaking practice page, submit the fixture recording for each
+question, look at the section page and the history and open the section
+results linked from there. Concurrency is ramped up in stages and the report
+gives throughput, p50/p95/p99 latency and error rate per route and stage,
+and the saturation point: the first stage where adding users no longer adds
+throughput, or errors appear. Memory is read from the app's /metrics once a
+second, and the report gives the peak RSS of a worker and of all workers,
+the audio held in buffers and the memory reserved by running evaluations.
+
+Unless --url is given, gunicorn (run:app, so gunicorn.conf.py applies) and
+fakes.speech_apis are started as subprocesses with the app pointed at the
+fakes. POSTGRES_URL must point at a migrated and seeded database.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.load_test
+        [--stages 1,2,4,8,16] [--stage-seconds 60] [--workers 2]
+        [--latency-scale 1] [--memory-budget-mb 0] [--output load_test.json]
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+FIXTURE_AUDIO = os.path.join(os.path.dirname(__file__), 'fixtures', 'answer.webm')
+
+# EBML Void element of 16 bytes: appended with random content it makes every
+# submission unique, so the app's duplicate detection does not answer it from cache
+VOID_ELEMENT_HEADER = b'\xec\x90'
+
+# a stage saturates when more users add less than this share of throughput
+SATURATION_GAIN = 0.10
+# or when this share of its requests fail
+SATURATION_ERROR_RATE = 0.01
+
+METRICS_TOKEN = 'load-test'  # for the app started here
+MEMORY_POLL_SECONDS = 1
+MB = 1024 * 1024
+
+
+@dataclass
+class Sample:
+    stage: int
+    route: str
+    status: int  # 0 for connection errors and timeouts
+    seconds: float
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self.stage = 0
+        self._lock = threading.Lock()
+
+    def add(self, route: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(Sample(self.stage, route, status, seconds))
+
+
+class MemoryWatcher:
+    """Polls the app's memory gauges and keeps the peaks of every stage."""
+
+    def __init__(self, base_url: str, token: str, recorder: Recorder):
+        self.url = f'{base_url}/metrics'
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.recorder = recorder
+        self.peaks = defaultdict(lambda: defaultdict(float))  # stage -> name -> bytes
+        self.available = True
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'MemoryWatcher':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(MEMORY_POLL_SECONDS):
+            try:
+                response = requests.get(self.url, headers=self.headers, timeout=5)
+            except requests.RequestException:
+                continue
+            if response.status_code != 200:
+                self.available = False
+                return
+            values = defaultdict(list)
+            for family in text_string_to_metric_families(response.text):
+                for sample in family.samples:
+                    values[sample.name].append(sample.value)
+            peaks = self.peaks[self.recorder.stage]
+            for name, value in (('worker_rss', max(values['ielts_process_rss_bytes'], default=0)),
+                                ('total_rss', sum(values['ielts_process_rss_bytes'])),
+                                ('audio_buffers', sum(values['ielts_audio_buffer_bytes'])),
+                                ('reserved', sum(values['ielts_admission_memory_reserved_bytes']))):
+                peaks[name] = max(peaks[name], value)
+
+
+class SimulatedUser:
+    """One test-taker with their own cookie session."""
+
+    def __init__(self, base_url: str, recorder: Recorder, audio: bytes, timeout: float):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.audio = audio
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.email = f'load-{uuid.uuid4().hex[:12]}@example.com'
+
+    def request(self, route: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout,
+                                            allow_redirects=False, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(route, 0, time.perf_counter() - started)
+            return None
+        self.recorder.add(route, response.status_code, time.perf_counter() - started)
+        return response
+
+    def sign_up(self) -> bool:
+        password = uuid.uuid4().hex
+        for route, path, data in (
+                ('register', '/register', {'email': self.email, 'password': password,
+                                           'password2': password}),
+                ('login', '/login', {'email': self.email, 'password': password})):
+            page = self.request(f'{route}_form', 'GET', path)
+            token = page is not None and re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                                                   page.text)
+            if not token:
+                return False
+            response = self.request(route, 'POST', path, data={**data, 'csrf_token': token.group(1)})
+            if response is None or response.status_code != 302:
+                return False
+        return True
+
+    def practice_once(self) -> None:
+        page = self.request('speaking_practice_get', 'GET', '/section/speaking/practice')
+        practice = page is not None and re.search(r'const practice = (\{.*?\});</script>', page.text)
+        if practice:
+            practice = json.loads(practice.group(1))
+            # part 2 is one answer to the cue card, parts 1 and 3 one per question
+            answers = 1 if practice['topic_name'] and practice['part'] == 2 else len(practice['questions'])
+            files = {f'audio_{i}': (f'audio_{i}.webm',
+                                    self.audio + VOID_ELEMENT_HEADER + os.urandom(16), 'audio/webm')
+                     for i in range(answers)}
+            self.request('speaking_practice_post', 'POST', '/section/speaking/practice',
+                         data={'question_set_id': practice['question_id']}, files=files,
+                         headers={'Idempotency-Key': str(uuid.uuid4())})
+
+        self.request('render_section', 'GET', '/section/speaking')
+        history = self.request('get_sections_history', 'GET', '/history')
+        if history is not None:
+            for path in sorted(set(re.findall(r'href="(/section/results/\d+/)"', history.text)))[:3]:
+                self.request('get_section_results', 'GET', path)
+
+
+def run_stages(base_url: str, recorder: Recorder, stages: list, stage_seconds: float,
+               timeout: float) -> None:
+    with open(FIXTURE_AUDIO, 'rb') as f:
+        audio = f.read()
+    users = []
+    stop = threading.Event()
+    threads = []
+
+    def loop(user):
+        while not stop.is_set():
+            user.practice_once()
+
+    for stage, concurrency in enumerate(stages):
+        recorder.stage = stage
+        while len(users) < concurrency:
+            user = SimulatedUser(base_url, recorder, audio, timeout)
+            if not user.sign_up():
+                raise SystemExit(f'Could not register and log in {user.email}, is the app running?')
+            users.append(user)
+            thread = threading.Thread(target=loop, args=(user,), daemon=True)
+            thread.start()
+            threads.append(thread)
+        print(f'stage {stage}: {concurrency} users for {stage_seconds:.0f}s', file=sys.stderr)
+        time.sleep(stage_seconds)
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(samples: list, seconds: float) -> dict:
+    latencies = sorted(s.seconds for s in samples)
+    errors = sum(1 for s in samples if s.status == 0 or s.status >= 400)
+    statuses = defaultdict(int)
+    for s in samples:
+        statuses[str(s.status)] += 1
+    return {'requests': len(samples), 'throughput_rps': round(len(samples) / seconds, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+            'statuses': dict(statuses)}
+
+
+def build_report(recorder: Recorder, stages: list, stage_seconds: float,
+                 memory: MemoryWatcher = None) -> dict:
+    report = {'stages': []}
+    for stage, concurrency in enumerate(stages):
+        samples = [s for s in recorder.samples if s.stage == stage]
+        routes = defaultdict(list)
+        for s in samples:
+            routes[s.route].append(s)
+        # completed evaluations per minute is the number that sizes the dyno
+        evaluations = [s for s in routes['speaking_practice_post'] if s.status == 200]
+        report['stages'].append({
+            'users': concurrency,
+            'overall': summarize(samples, stage_seconds),
+            'evaluations_per_minute': round(len(evaluations) / stage_seconds * 60, 2),
+            'routes': {route: summarize(route_samples, stage_seconds)
+                       for route, route_samples in sorted(routes.items())},
+        })
+        if memory is not None and memory.available:
+            report['stages'][-1]['memory_mb'] = {
+                f'peak_{name}': round(value / MB, 1) for name, value in sorted(memory.peaks[stage].items())}
+    report['saturation'] = find_saturation(report['stages'])
+    return report
+
+
+def find_saturation(stages: list) -> dict:
+    """The first stage that fails or stops scaling, and why."""
+    for previous, stage in zip([None] + stages, stages):
+        if stage['overall']['error_rate'] > SATURATION_ERROR_RATE:
+            return {'users': stage['users'], 'reason': f"error rate {stage['overall']['error_rate']:.1%}"}
+        if previous is None or not previous['evaluations_per_minute']:
+            continue
+        gain = stage['evaluations_per_minute'] / previous['evaluations_per_minute'] - 1
+        if gain < SATURATION_GAIN:
+            return {'users': stage['users'],
+                    'reason': f'{gain:+.0%} evaluations/min for {stage["users"] / previous["users"]:.1f}x users',
+                    'capacity_users': previous['users']}
+    return {'users': None, 'reason': 'not saturated, ramp further'}
+
+
+def print_report(report: dict) -> None:
+    header = f"{'users':>5} {'route':<24} {'req':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>6}"
+    print(header)
+    print('-' * len(header))
+    for stage in report['stages']:
+        rows = [('ALL', stage['overall'])] + list(stage['routes'].items())
+        for route, s in rows:
+            print(f"{stage['users']:>5} {route:<24} {s['requests']:>6} {s['throughput_rps']:>7} "
+                  f"{s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8} {s['error_rate']:>6.1%}")
+        print(f"{'':>5} evaluations/min: {stage['evaluations_per_minute']}")
+        if 'memory_mb' in stage:
+            print(f"{'':>5} peak memory MB: " + ', '.join(f'{name[5:]} {value}' for name, value
+                                                             in stage['memory_mb'].items()))
+    saturation = report['saturation']
+    print(f"\nSaturation: {saturation['users'] or '-'} users ({saturation['reason']})")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=5, allow_redirects=False)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f'{url} did not come up within {timeout}s')
+
+
+def start_servers(args, processes: list) -> str:
+    """Start the fake APIs and gunicorn, adding them to processes; returns the app URL."""
+    fakes_port, app_port = _free_port(), _free_port()
+    fakes = subprocess.Popen([sys.executable, '-m', 'fakes.speech_apis', '--port', str(fakes_port),
+                              '--latency-scale', str(args.latency_scale), '--seed', '1'])
+    processes.append(fakes)
+    fakes_url = f'http://127.0.0.1:{fakes_port}'
+    env = {**os.environ,
+           'OPENAI_BASE_URL': f'{fakes_url}/v1', 'OPENAI_API_KEY': 'load-test',
+           'AZURE_SPEECH_ENDPOINT': fakes_url, 'AZURE_API_KEY': 'load-test',
+           'METRICS_TOKEN': METRICS_TOKEN,
+           'EVALUATION_MEMORY_BUDGET_MB': str(args.memory_budget_mb),
+           'PROMETHEUS_MULTIPROC_DIR': os.path.join('/tmp', f'load-test-metrics-{app_port}')}
+    app = subprocess.Popen(['gunicorn', 'run:app', '--bind', f'127.0.0.1:{app_port}',
+                            '--workers', str(args.workers), '--timeout', '300'], env=env)
+    processes.append(app)
+    app_url = f'http://127.0.0.1:{app_port}'
+    _wait_for(f'{fakes_url}/stats')
+    _wait_for(f'{app_url}/login')
+    return app_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='test a running app instead of starting gunicorn and the fakes')
+    parser.add_argument('--stages', default='1,2,4,8,16',
+                        help='comma separated numbers of concurrent users')
+    parser.add_argument('--stage-seconds', type=float, default=60)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='scale of the fake API latencies')
+    parser.add_argument('--timeout', type=float, default=300, help='client timeout per request')
+    parser.add_argument('--memory-budget-mb', type=int, default=0,
+                        help='EVALUATION_MEMORY_BUDGET_MB of the app started here')
+    parser.add_argument('--metrics-token', default=METRICS_TOKEN,
+                        help="the app's METRICS_TOKEN, to read its memory from /metrics")
+    parser.add_argument('--output', help='also write the report as JSON to this file')
+    args = parser.parse_args()
+    stages = [int(users) for users in args.stages.split(',')]
+
+    processes = []
+    memory = None
+    try:
+        base_url = (args.url or start_servers(args, processes)).rstrip('/')
+        recorder = Recorder()
+        memory = MemoryWatcher(base_url, args.metrics_token, recorder).start()
+        run_stages(base_url, recorder, stages, args.stage_seconds, args.timeout)
+    finally:
+        if memory is not None:
+            memory.stop()
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+            process.wait(30)
+
+    report = build_report(recorder, stages, args.stage_seconds, memory)
+    report['config'] = {'stages': stages, 'stage_seconds': args.stage_seconds,
+                        'workers': args.workers, 'latency_scale': args.latency_scale,
+                        'memory_budget_mb': args.memory_budget_mb, 'url': args.url}
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
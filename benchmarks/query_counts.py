@@ -0,0 +1,108 @@
+"""
+Statements per page against a per-route budget.
+
+Creates a throwaway user who has completed the speaking section SECTIONS
+times, so pages that list attempts have something to load, then requests
+every page with assert_max_queries. Prints the count per page and the
+repeated statement shapes, and exits with status 1 if a page goes over its
+budget: a new N+1 load shows up here long before it is slow in production.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.query_counts
+"""
+import json
+import os
+import sys
+import uuid
+
+from app import create_app
+from app import models
+from app.catalog import get_catalog
+from app.query_stats import assert_max_queries
+from app.utils import save_speaking_results_to_database
+from config import Config
+from config.database import db
+
+SECTIONS = 3  # completed speaking sections in the user's history
+
+# page -> most statements a request may execute, independent of history length
+BUDGETS = {
+    '/': 1,
+    '/section/speaking': 2,
+    '/section/speaking/practice': 2,
+    '/history': 2,
+    '/section/results/{user_progress_id}/': 2,
+    '/section/speaking/attempt/{attempt_id}/': 2,
+}
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+def complete_sections(app, user_id) -> dict:
+    """Save SECTIONS finished speaking sections, returns ids for the page URLs."""
+    with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'azure_assessments.json')) as f:
+        answers = json.load(f)
+    result = {'generalFeedback': 'Well done.', 'fluencyAndCoherence': {'score': 6},
+              'grammaticalRangeAndAccuracy': {'score': 6}, 'lexicalResource': {'score': 7},
+              'pronunciation': {'score': 6}}
+
+    with app.test_request_context():
+        catalog = get_catalog()
+        speaking = catalog.section_by_name('speaking')
+        user = db.session.get(models.User, user_id)
+        for _ in range(SECTIONS):
+            for subsection in speaking.subsections:
+                question_set = catalog.random_question_set(subsection.id)
+                answers_evaluation = [
+                    {'question': question, 'answer_transcription': answer['transcript'],
+                     'pronunciation_assessment': answer['assessment']}
+                    for question, answer in zip(question_set, answers)]
+                attempt = save_speaking_results_to_database(user, question_set, dict(result),
+                                                            answers_evaluation)
+        return {'user_progress_id': attempt.user_progress_id, 'attempt_id': attempt.id}
+
+
+def main():
+    app = create_app(BenchmarkConfig)
+    client = app.test_client()
+    email = f'bench-{uuid.uuid4().hex[:8]}@example.com'
+
+    with app.app_context():
+        user = models.User(email=email)
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    over_budget = []
+    try:
+        ids = complete_sections(app, user_id)
+        client.post('/login', data={'email': email, 'password': 'benchmark'})
+        client.get('/')  # loads the catalog and caches the user
+
+        print(f"{'page':<40}{'queries':>8}{'budget':>8}{'db ms':>8}")
+        for page, budget in BUDGETS.items():
+            url = page.format(**ids)
+            try:
+                with assert_max_queries(budget) as stats:
+                    status = client.get(url).status_code
+            except AssertionError as e:
+                over_budget.append(f'{url}: {e}')
+            print(f"{url:<40}{stats.count:>8}{budget:>8}{stats.seconds * 1000:>8.1f}  {status}")
+            for shape, n in stats.repeated(1):
+                print(f"    {n}x {shape[:100]}")
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(models.User, user_id))
+            db.session.commit()
+
+    if over_budget:
+        print('\n' + '\n\n'.join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Worker boot time: interpreter start to the first request being servable.
+
+Each run starts a fresh interpreter, imports the app, calls create_app(),
+loads the content catalog the way gunicorn's post_worker_init does, and
+reports the time spent in each step and the SQL statements issued.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.startup [runs]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+RUNS = 10
+
+WORKER_BOOT = r'''
+import json, time
+start = time.perf_counter()
+from sqlalchemy import event
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+
+from config.database import db
+from app.catalog import reload_catalog
+statements = []
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    reload_catalog()
+loaded = time.perf_counter()
+
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'catalog': loaded - created, 'total': loaded - start,
+                  'statements': len(statements)}))
+'''
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', WORKER_BOOT], check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    print(f'{runs} worker boots, median of each step:')
+    for step in ('import', 'create_app', 'catalog', 'total'):
+        print(f'  {step:<12}{statistics.median(r[step] for r in results) * 1000:>8.1f} ms')
+    print(f"  {'statements':<12}{max(r['statements'] for r in results):>8}")
+
+
+if __name__ == '__main__':
+    main()
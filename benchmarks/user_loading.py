@@ -0,0 +1,78 @@
+"""
+Queries saved per page view by the cached Flask-Login user loader.
+
+Logs a throwaway user in and requests a few authenticated pages, once with
+the user cache as is and once with it cleared before every request (the
+previous behaviour of querying `users` each time).
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.user_loading
+"""
+import uuid
+
+from sqlalchemy import event
+
+from app import create_app
+from app import models
+from config import Config
+from config.database import db
+
+PAGES = ('/', '/history', '/section/speaking')
+ROUNDS = 20
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+def count_queries(client, engine, clear_cache: bool) -> dict:
+    counts = {}
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for page in PAGES:
+            statements.clear()
+            for _ in range(ROUNDS):
+                if clear_cache:
+                    models._user_cache.clear()
+                client.get(page)
+            counts[page] = len(statements) / ROUNDS
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return counts
+
+
+def main():
+    app = create_app(BenchmarkConfig)
+    client = app.test_client()
+    email = f'bench-{uuid.uuid4().hex[:8]}@example.com'
+
+    with app.app_context():
+        user = models.User(email=email)
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    # requests must run outside of the app context, otherwise they share `g`
+    try:
+        client.post('/login', data={'email': email, 'password': 'benchmark'})
+        with app.app_context():
+            engine = db.engine
+        uncached = count_queries(client, engine, clear_cache=True)
+        cached = count_queries(client, engine, clear_cache=False)
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(models.User, user_id))
+            db.session.commit()
+
+    print(f"{'page':<20}{'uncached':>10}{'cached':>10}{'saved':>10}")
+    for page in PAGES:
+        saved = uncached[page] - cached[page]
+        print(f"{page:<20}{uncached[page]:>10.2f}{cached[page]:>10.2f}{saved:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,49 @@ class Config(object):
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('POSTGRES_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    MAX_CONTENT_LENGTH = 1 * 1024 * 1024  # Limit file size to 1 MB
+    MAX_CONTENT_LENGTH = 32 * 1024 * 1024  # Coarse byte cap, answers are limited by duration below
+    AUDIO_SPOOL_MAX_MEMORY = int(os.environ.get('AUDIO_SPOOL_MAX_MEMORY', 256 * 1024))  # larger uploads go to a temp file
+    AUDIO_ANSWER_GRACE_SECONDS = int(os.environ.get('AUDIO_ANSWER_GRACE_SECONDS', 10))  # on top of the subsection time limit
+    AUDIO_MAX_REQUEST_SECONDS = int(os.environ.get('AUDIO_MAX_REQUEST_SECONDS', 15 * 60))
+    EVALUATION_MAX_CONCURRENT = int(os.environ.get('EVALUATION_MAX_CONCURRENT', 4))  # per gunicorn worker
+    EVALUATION_MAX_PER_USER = int(os.environ.get('EVALUATION_MAX_PER_USER', 1))
+    EVALUATION_MAX_QUEUE = int(os.environ.get('EVALUATION_MAX_QUEUE', 8))
+    EVALUATION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('EVALUATION_QUEUE_TIMEOUT_SECONDS', 30))
+    EVALUATION_MEMORY_BUDGET_MB = int(os.environ.get('EVALUATION_MEMORY_BUDGET_MB', 0))  # per gunicorn worker, 0 disables
+    EVALUATION_MEMORY_OVERHEAD_MB = float(os.environ.get('EVALUATION_MEMORY_OVERHEAD_MB', 8))  # reserved per evaluation
+    EVALUATION_MEMORY_PER_AUDIO_BYTE = float(os.environ.get('EVALUATION_MEMORY_PER_AUDIO_BYTE', 3))  # plus this per byte of answers
+    MEMORY_SAMPLE_INTERVAL_MS = float(os.environ.get('MEMORY_SAMPLE_INTERVAL_MS', 100))  # RSS sampling
+    TRANSCRIPTION_EXECUTOR_WORKERS = int(os.environ.get('TRANSCRIPTION_EXECUTOR_WORKERS', 8))  # threads per gunicorn worker
+    ASSESSMENT_EXECUTOR_WORKERS = int(os.environ.get('ASSESSMENT_EXECUTOR_WORKERS', 4))
+    LLM_EXECUTOR_WORKERS = int(os.environ.get('LLM_EXECUTOR_WORKERS', 4))
+    TRANSCODE_EXECUTOR_WORKERS = int(os.environ.get('TRANSCODE_EXECUTOR_WORKERS', 2))
+    QUERY_REPEAT_WARN_THRESHOLD = int(os.environ.get('QUERY_REPEAT_WARN_THRESHOLD', 5))  # same statement per request
+    ADMIN_EMAILS = [e.strip() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()]  # internal pages
+    PROFILER_DIR = os.environ.get('PROFILER_DIR', '/tmp/ielts-practice-profiles')  # shared by the gunicorn workers
+    PROFILER_RETENTION = int(os.environ.get('PROFILER_RETENTION', 20))  # profiles kept per endpoint
+    PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 5))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for /metrics, unset disables it
+    TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER')  # 'jsonl' or 'otlp', unset disables tracing
+    TRACING_JSONL_PATH = os.environ.get('TRACING_JSONL_PATH', 'traces.jsonl')
+    TRACING_OTLP_ENDPOINT = os.environ.get('TRACING_OTLP_ENDPOINT', 'http://127.0.0.1:4318/v1/traces')
+    SUBMISSION_RESULT_TTL_SECONDS = int(os.environ.get('SUBMISSION_RESULT_TTL_SECONDS', 600))  # duplicates get the stored result
+    CONTENT_CATALOG_REFRESH_SECONDS = int(os.environ.get('CONTENT_CATALOG_REFRESH_SECONDS', 600))  # 0 disables reload
+    PROMPT_DIALOG_MAX_TOKENS = int(os.environ.get('PROMPT_DIALOG_MAX_TOKENS', 1500))  # longer answers are shortened
+    LLM_REASK_ATTEMPTS = int(os.environ.get('LLM_REASK_ATTEMPTS', 2))  # follow-ups for missing fields, 0 disables
+    LLM_MODELS = os.environ.get('LLM_MODELS', '*=gpt-3.5-turbo,gpt-4o-mini')  # part=primary,alternates;... '*' for the rest
+    LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get('LLM_CALL_TIMEOUT_SECONDS', 60))  # then the next model is tried
+    LLM_HEALTH_WINDOW_SECONDS = float(os.environ.get('LLM_HEALTH_WINDOW_SECONDS', 120))  # per gunicorn worker
+    LLM_HEALTH_MIN_CALLS = int(os.environ.get('LLM_HEALTH_MIN_CALLS', 5))  # in the window before a model is judged
+    LLM_MAX_ERROR_RATE = float(os.environ.get('LLM_MAX_ERROR_RATE', 0.5))
+    LLM_SLOW_SECONDS = float(os.environ.get('LLM_SLOW_SECONDS', 30))  # 90th percentile over this is unhealthy
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # unset uses api.openai.com
+    AZURE_SPEECH_ENDPOINT = os.environ.get('AZURE_SPEECH_ENDPOINT', 'https://germanywestcentral.stt.speech.microsoft.com')  # or a stand-in such as fakes.speech_apis
+    OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 0))  # in the client, on top of the pipeline's retries and failover
+    AMPLITUDE_API_KEY = os.environ.get('AMPLITUDE_API_KEY')
+    AMPLITUDE_API_URL = os.environ.get('AMPLITUDE_API_URL', 'https://api2.amplitude.com/batch')
+    ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', 10000))  # events beyond this are dropped
+    ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 100))
+    ANALYTICS_FLUSH_SECONDS = float(os.environ.get('ANALYTICS_FLUSH_SECONDS', 5))
 
 from .database import init_db
 from .auth import init_auth
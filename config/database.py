@@ -22,13 +22,6 @@ db = SQLAlchemy(metadata=metadata)
 def init_db(app):
     db.init_app(app)
 
-    with app.app_context():
-        # importing models
-        from app import models
-        # creating database
-        db.create_all()
-
-        # creating tables if not exists
-        if not models.Section.query.first():
-            from app.utils import create_and_fill_out_tables
-            create_and_fill_out_tables(models)
+    # importing models, the schema itself is managed by migrations
+    # (`flask db upgrade`) and the content by `flask content seed`
+    from app import models
@@ -0,0 +1,101 @@
+"""
+Local stand-in for Amplitude's batch HTTP API.
+
+Accepts `POST /batch` with the same body as https://api2.amplitude.com/batch
+and keeps the received events in memory; `GET /events` returns them as JSON.
+Point the app at it with AMPLITUDE_API_URL=http://127.0.0.1:8787/batch.
+
+Usage:
+    python -m fakes.analytics_sink [--port 8787] [--status 200] [--delay 0]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class AnalyticsSink(ThreadingHTTPServer):
+    """
+    Threaded HTTP server recording the analytics batches it receives.
+
+    Attributes:
+    - status: HTTP status returned for every batch, e.g. 429 or 503 to simulate outages.
+    - delay: Seconds to wait before answering, to simulate a slow API.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 status: int = 200, delay: float = 0):
+        super().__init__((host, port), _SinkHandler)
+        self.status = status
+        self.delay = delay
+        self.batches = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/batch'
+
+    @property
+    def events(self) -> list:
+        with self._lock:
+            return [event for batch in self.batches for event in batch]
+
+    def record(self, batch: list) -> None:
+        with self._lock:
+            self.batches.append(batch)
+
+    def start(self) -> 'AnalyticsSink':
+        """Serve from a daemon thread, for use inside benchmarks and scripts."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+    server: AnalyticsSink
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        try:
+            events = json.loads(body)['events']
+        except (ValueError, KeyError):
+            return self._reply(400, {'code': 400, 'error': 'invalid request body'})
+
+        if self.server.status != 200:
+            return self._reply(self.server.status, {'code': self.server.status})
+        self.server.record(events)
+        self._reply(200, {'code': 200, 'events_ingested': len(events),
+                          'payload_size_bytes': len(body)})
+
+    def do_GET(self):
+        if self.path != '/events':
+            return self._reply(404, {'code': 404})
+        self._reply(200, self.server.events)
+
+    def _reply(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--status', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0)
+    args = parser.parse_args()
+
+    sink = AnalyticsSink(port=args.port, status=args.status, delay=args.delay)
+    print(f'Analytics sink listening on {sink.url}')
+    sink.serve_forever()
@@ -0,0 +1,327 @@
+"""
+Local stand-in for the OpenAI and Azure speech endpoints used by the evaluation.
+
+Serves, on one port:
+- `POST /v1/audio/transcriptions` (Whisper, multipart upload)
+- `POST /v1/chat/completions` (returns an IELTS evaluation JSON as the message)
+- `POST /speech/recognition/conversation/cognitiveservices/v1` (Azure short
+  audio with a Pronunciation-Assessment header, returns NBest/Words)
+- `GET /stats` with the requests and responses per endpoint
+
+Every endpoint has its own latency distribution (log-normal around a median),
+error rate and 429 rate. Point the app at it with
+OPENAI_BASE_URL=http://127.0.0.1:8788/v1 AZURE_SPEECH_ENDPOINT=http://127.0.0.1:8788.
+
+Usage:
+    python -m fakes.speech_apis [--port 8788] [--seed 1] [--latency-scale 1]
+        [--set whisper.error_rate=0.05] [--set azure.rate_limit_rate=0.1] ...
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+@dataclass
+class EndpointProfile:
+    """
+    Simulated behaviour of one endpoint.
+
+    Attributes:
+    - median_latency: Median seconds before the response.
+    - latency_sigma: Spread of the log-normal latency; 0.5 puts p95 at about 2.3x the median.
+    - error_rate: Share of requests answered with a 500 or 503.
+    - rate_limit_rate: Share of requests answered with a 429.
+    - retry_after: Retry-After seconds sent with a 429.
+    """
+    median_latency: float
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: int = 1
+
+
+# Roughly what the real APIs take for a one minute answer
+DEFAULT_PROFILES = {
+    'whisper': EndpointProfile(median_latency=1.5),
+    'chat': EndpointProfile(median_latency=4.0, latency_sigma=0.4),
+    'azure': EndpointProfile(median_latency=2.0),
+}
+
+_ROUTES = {
+    '/v1/audio/transcriptions': 'whisper',
+    '/v1/chat/completions': 'chat',
+    '/speech/recognition/conversation/cognitiveservices/v1': 'azure',
+}
+
+ANSWERS = (
+    "I usually spend my weekends with my family, we often go to the park near our house "
+    "and sometimes we visit my grandparents in the countryside.",
+    "Well, I have been learning English for about five years now, mostly at school, "
+    "but recently I started watching films without subtitles which helps a lot.",
+    "My hometown is a small city in the north, it is quite famous for its old cathedral "
+    "and the river that goes right through the center.",
+    "To be honest I am not a big fan of cooking, but I enjoy making breakfast on Sundays, "
+    "especially pancakes with fresh berries.",
+    "I think technology has changed the way people communicate, because nowadays everyone "
+    "prefers sending messages instead of calling each other.",
+)
+
+# 100-nanosecond ticks, the unit of Azure's Offset and Duration
+_TICKS_PER_SECOND = 10_000_000
+# Opus at 16 kHz mono is about 2 KB per second of speech
+_OPUS_BYTES_PER_SECOND = 2000
+
+
+class SpeechApis(ThreadingHTTPServer):
+    """
+    Threaded HTTP server imitating Whisper, chat completions and Azure
+    pronunciation assessment.
+
+    Attributes:
+    - profiles: EndpointProfile per endpoint ('whisper', 'chat', 'azure'),
+      may be changed while the server runs.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 profiles: Optional[dict] = None, seed: Optional[int] = None):
+        super().__init__((host, port), _SpeechApisHandler)
+        self.profiles = {name: replace(profile) for name, profile in DEFAULT_PROFILES.items()}
+        self.profiles.update(profiles or {})
+        self.random = random.Random(seed)
+        self.responses = Counter()  # (endpoint, status) -> count
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def openai_base_url(self) -> str:
+        return f'{self.url}/v1'
+
+    def start(self) -> 'SpeechApis':
+        """Serve from a daemon thread, for use inside benchmarks and scripts."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {}
+            for (endpoint, status), count in self.responses.items():
+                stats.setdefault(endpoint, {})[str(status)] = count
+            return stats
+
+    def record(self, endpoint: str, status: int) -> None:
+        with self._lock:
+            self.responses[endpoint, status] += 1
+
+    def draw(self, endpoint: str) -> tuple[float, int]:
+        """Latency and status for the next request to endpoint."""
+        profile = self.profiles[endpoint]
+        with self._lock:
+            latency = profile.median_latency * math.exp(self.random.gauss(0, profile.latency_sigma))
+            roll = self.random.random()
+            error_status = self.random.choice((500, 503))
+        if roll < profile.rate_limit_rate:
+            return latency, 429
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            return latency, error_status
+        return latency, 200
+
+    def choice(self, options):
+        with self._lock:
+            return self.random.choice(options)
+
+    def uniform(self, low: float, high: float) -> float:
+        with self._lock:
+            return self.random.uniform(low, high)
+
+
+class _SpeechApisHandler(BaseHTTPRequestHandler):
+    server: SpeechApis
+    # keep-alive, like the real APIs; every response sets Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        endpoint = _ROUTES.get(path)
+        body = self._read_body()
+        if endpoint is None:
+            return self._reply(404, {'error': {'message': f'Unknown path {path}'}})
+
+        latency, status = self.server.draw(endpoint)
+        time.sleep(latency)
+        self.server.record(endpoint, status)
+        if status == 429:
+            return self._reply(429, _error_payload('Rate limit reached', 'rate_limit_exceeded'),
+                               {'Retry-After': str(self.server.profiles[endpoint].retry_after)})
+        if status != 200:
+            return self._reply(status, _error_payload('The server had an error', 'server_error'))
+
+        if endpoint == 'whisper':
+            self._transcription(body)
+        elif endpoint == 'chat':
+            self._chat_completion(body)
+        else:
+            self._pronunciation_assessment(body)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {})
+        self._reply(200, self.server.stats())
+
+    def _transcription(self, body: bytes) -> None:
+        form = _parse_multipart(body, self.headers.get('Content-Type', ''))
+        text = self.server.choice(ANSWERS)
+        if form.get('response_format', b'json') == b'text':
+            return self._reply(200, text + '\n', content_type='text/plain')
+        self._reply(200, {'text': text})
+
+    def _chat_completion(self, body: bytes) -> None:
+        request = json.loads(body)
+        prompt_chars = sum(len(message.get('content') or '') for message in request['messages'])
+        evaluation = {
+            'coherence': {'score': round(self.server.uniform(4, 8))},
+            'lexicalResource': {'score': round(self.server.uniform(4, 8))},
+            'grammaticalRangeAndAccuracy': {'score': round(self.server.uniform(4, 8))},
+            'generalFeedback': "You answered every question with relevant detail. Work on "
+                               "linking your ideas and using a wider range of vocabulary.",
+        }
+        content = json.dumps(evaluation, separators=(',', ':'))
+        prompt_tokens, completion_tokens = prompt_chars // 4, len(content) // 4
+        self._reply(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex[:24]}', 'object': 'chat.completion',
+            'created': int(time.time()), 'model': request.get('model', 'gpt-3.5-turbo'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def _pronunciation_assessment(self, body: bytes) -> None:
+        try:
+            params = json.loads(base64.b64decode(self.headers['Pronunciation-Assessment']))
+            reference = params['ReferenceText']
+        except (TypeError, ValueError, KeyError):
+            return self._reply(400, {'error': 'Missing or invalid Pronunciation-Assessment header'})
+        words = re.findall(r"[\w']+", reference.lower())
+        if not body or not words:
+            return self._reply(200, {'RecognitionStatus': 'NoMatch', 'Offset': 0, 'Duration': 0})
+
+        duration = max(len(body) / _OPUS_BYTES_PER_SECOND, 0.3 * len(words)) * _TICKS_PER_SECOND
+        offset = int(0.3 * _TICKS_PER_SECOND)
+        step = int((duration - offset) / len(words))
+        word_results = []
+        for i, word in enumerate(words):
+            accuracy = round(min(100.0, self.server.uniform(55, 110)), 1)
+            word_results.append({
+                'Word': word, 'AccuracyScore': accuracy,
+                'ErrorType': 'Mispronunciation' if accuracy < 60 else 'None',
+                'Offset': offset + i * step, 'Duration': int(step * 0.8),
+            })
+        accuracy = round(sum(w['AccuracyScore'] for w in word_results) / len(words), 1)
+        fluency = round(self.server.uniform(60, 95), 1)
+        completeness = 100.0
+        self._reply(200, {
+            'RecognitionStatus': 'Success', 'Offset': offset, 'Duration': int(duration) - offset,
+            'NBest': [{
+                'Confidence': round(self.server.uniform(0.8, 0.98), 4),
+                'Lexical': ' '.join(words), 'ITN': ' '.join(words),
+                'MaskedITN': ' '.join(words), 'Display': reference,
+                'AccuracyScore': accuracy, 'FluencyScore': fluency,
+                'CompletenessScore': completeness,
+                'PronScore': round(0.6 * accuracy + 0.2 * fluency + 0.2 * completeness, 1),
+                'Words': word_results,
+            }],
+        })
+
+    def _read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            # Azure uploads are streamed in chunks without a Content-Length
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _reply(self, status: int, payload, headers: Optional[dict] = None,
+               content_type: str = 'application/json') -> None:
+        body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _error_payload(message: str, code: str) -> dict:
+    return {'error': {'message': message, 'type': 'requests', 'param': None, 'code': code}}
+
+
+def _parse_multipart(body: bytes, content_type: str) -> dict:
+    """Form fields of a multipart body, name -> raw value."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        return {}
+    fields_ = {}
+    for part in body.split(b'--' + match.group(1).encode())[1:-1]:
+        head, _, value = part.strip(b'\r\n').partition(b'\r\n\r\n')
+        name = re.search(rb'name="([^"]*)"', head)
+        if name:
+            fields_[name.group(1).decode()] = value
+    return fields_
+
+
+def _parse_setting(profiles: dict, setting: str) -> None:
+    """Apply an `endpoint.field=value` setting, e.g. `azure.rate_limit_rate=0.1`."""
+    key, _, value = setting.partition('=')
+    endpoint, _, field_name = key.partition('.')
+    types = {f.name: f.type for f in fields(EndpointProfile)}
+    if endpoint not in profiles or field_name not in types:
+        raise argparse.ArgumentTypeError(f'Unknown setting {key!r}')
+    setattr(profiles[endpoint], field_name, types[field_name](value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8788)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='multiply every median latency, 0 answers immediately')
+    parser.add_argument('--set', action='append', default=[], metavar='ENDPOINT.FIELD=VALUE',
+                        help='override an EndpointProfile field, may be repeated')
+    args = parser.parse_args()
+
+    profiles = {name: replace(profile, median_latency=profile.median_latency * args.latency_scale)
+                for name, profile in DEFAULT_PROFILES.items()}
+    for setting in args.set:
+        _parse_setting(profiles, setting)
+
+    apis = SpeechApis(port=args.port, profiles=profiles, seed=args.seed)
+    print(f'Fake speech APIs listening on {apis.url}')
+    for name, profile in profiles.items():
+        print(f'  {name}: {profile}')
+    apis.serve_forever()
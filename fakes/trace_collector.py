@@ -0,0 +1,123 @@
+"""
+Local stand-in for an OpenTelemetry collector's OTLP/HTTP JSON traces endpoint.
+
+Accepts `POST /v1/traces` with OTLP/JSON `resourceSpans` and keeps the spans
+in memory; `GET /spans` returns them flattened, and with --output they are
+also appended to a JSONL file. Point the app at it with
+TRACING_EXPORTER=otlp TRACING_OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces.
+
+Usage:
+    python -m fakes.trace_collector [--port 4318] [--output traces.jsonl]
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class TraceCollector(ThreadingHTTPServer):
+    """
+    Threaded HTTP server recording the spans it receives.
+
+    Attributes:
+    - output: Optional JSONL file every received span is appended to.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, output: Optional[str] = None):
+        super().__init__((host, port), _CollectorHandler)
+        self.output = output
+        self._spans = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1/traces'
+
+    @property
+    def spans(self) -> list:
+        with self._lock:
+            return list(self._spans)
+
+    def traces(self) -> dict:
+        """Received spans grouped by trace id."""
+        traces = {}
+        for span in self.spans:
+            traces.setdefault(span['trace_id'], []).append(span)
+        return traces
+
+    def record(self, spans: list) -> None:
+        with self._lock:
+            self._spans.extend(spans)
+            if self.output:
+                with open(self.output, 'a') as f:
+                    f.writelines(json.dumps(span) + '\n' for span in spans)
+
+    def start(self) -> 'TraceCollector':
+        """Serve from a daemon thread, for use inside benchmarks and scripts."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _flatten(payload: dict) -> list:
+    """OTLP/JSON resourceSpans to the span dicts written by JsonlExporter."""
+    spans = []
+    for resource_spans in payload['resourceSpans']:
+        for scope_spans in resource_spans['scopeSpans']:
+            for span in scope_spans['spans']:
+                start, end = int(span['startTimeUnixNano']), int(span['endTimeUnixNano'])
+                spans.append({
+                    'trace_id': span['traceId'], 'span_id': span['spanId'],
+                    'parent_id': span.get('parentSpanId') or None, 'name': span['name'],
+                    'start_time_ns': start, 'end_time_ns': end,
+                    'duration_ms': round((end - start) / 1e6, 3),
+                    'status': 'error' if span.get('status', {}).get('code') == 2 else 'ok',
+                    'attributes': {a['key']: next(iter(a['value'].values()))
+                                   for a in span.get('attributes', ())},
+                })
+    return spans
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    server: TraceCollector
+
+    def do_POST(self):
+        if self.path != '/v1/traces':
+            return self._reply(404, {})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            spans = _flatten(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, {'message': 'invalid OTLP/JSON body'})
+        self.server.record(spans)
+        self._reply(200, {'partialSuccess': {}})
+
+    def do_GET(self):
+        if self.path != '/spans':
+            return self._reply(404, {})
+        self._reply(200, self.server.spans)
+
+    def _reply(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    collector = TraceCollector(port=args.port, output=args.output)
+    print(f'Trace collector listening on {collector.url}')
+    collector.serve_forever()
@@ -0,0 +1,42 @@
+# Gunicorn picks this file up automatically from the working directory.
+import os
+import shutil
+
+# Workers write their metrics here so /metrics can add them up; must be set
+# before the app (and prometheus_client) is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/ielts-practice-metrics')
+
+
+def on_starting(server):
+    """Start each server with empty metric files, values from a previous run would be added in."""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def post_worker_init(worker):
+    """Load the content catalog and start the executors once per worker, before it accepts requests."""
+    from app.catalog import reload_catalog
+    from app.executors import init_executors
+
+    with worker.wsgi.app_context():
+        reload_catalog()
+    init_executors(worker.wsgi.config)
+
+
+def worker_exit(server, worker):
+    """Finish queued evaluation tasks and analytics events before the worker goes away."""
+    from app.executors import shutdown_executors
+    from app.services import services
+
+    shutdown_executors()
+    dispatcher = services.built('analytics')
+    if dispatcher is not None:
+        dispatcher.shutdown()
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a dead worker; its counters and histograms are kept."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
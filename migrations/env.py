@@ -0,0 +1,47 @@
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+from config.database import db
+from app import models  # noqa: F401  registers the tables on db.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# the app's URL unless one was passed in, e.g. by the app itself
+if not config.get_main_option('sqlalchemy.url'):
+    config.set_main_option('sqlalchemy.url', os.environ['POSTGRES_URL'])
+
+target_metadata = db.metadata
+
+
+def run_migrations_offline() -> None:
+    """Emit the migration SQL to stdout without connecting to the database."""
+    context.configure(url=config.get_main_option('sqlalchemy.url'),
+                      target_metadata=target_metadata,
+                      literal_binds=True,
+                      dialect_opts={'paramstyle': 'named'})
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = engine_from_config(config.get_section(config.config_ini_section, {}),
+                                     prefix='sqlalchemy.',
+                                     poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
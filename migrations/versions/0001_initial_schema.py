@@ -0,0 +1,142 @@
+"""initial schema
+
+The schema as it was created by db.create_all(). Databases created that
+way are stamped as 0001 by `flask db upgrade` instead of running it.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 14:27:39.309414
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('sections',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__sections')),
+    sa.UniqueConstraint('name', name=op.f('uq__sections__name'))
+    )
+    op.create_table('topics',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__topics'))
+    )
+    op.create_table('users',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('email', sa.String(length=255), nullable=False),
+    sa.Column('is_email_verified', sa.Boolean(), nullable=True),
+    sa.Column('hashed_password', sa.String(length=128), nullable=True),
+    sa.Column('google_account_id', sa.String(length=255), nullable=True),
+    sa.Column('first_name', sa.String(length=255), nullable=True),
+    sa.Column('last_name', sa.String(length=255), nullable=True),
+    sa.Column('profile_picture', sa.String(length=255), nullable=True),
+    sa.Column('locale', sa.String(length=10), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__users')),
+    sa.UniqueConstraint('google_account_id', name=op.f('uq__users__google_account_id')),
+    sa.UniqueConstraint('id', name=op.f('uq__users__id'))
+    )
+    op.create_index(op.f('ix__email'), 'users', ['email'], unique=True)
+    op.create_table('subsections',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('part_number', sa.Integer(), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.Column('time_limit_minutes', sa.Integer(), nullable=False),
+    sa.Column('section_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['section_id'], ['sections.id'], name=op.f('fk__subsections__section_id__sections')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__subsections'))
+    )
+    op.create_table('question_sets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subsection_id', sa.Integer(), nullable=False),
+    sa.Column('topic_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['subsection_id'], ['subsections.id'], name=op.f('fk__question_sets__subsection_id__subsections')),
+    sa.ForeignKeyConstraint(['topic_id'], ['topics.id'], name=op.f('fk__question_sets__topic_id__topics')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__question_sets')),
+    sa.UniqueConstraint('subsection_id', 'topic_id', name='uix_1')
+    )
+    op.create_table('user_progress',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('section_id', sa.Integer(), nullable=False),
+    sa.Column('next_subsection_id', sa.Integer(), nullable=True),
+    sa.Column('is_completed', sa.Boolean(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['next_subsection_id'], ['subsections.id'], name=op.f('fk__user_progress__next_subsection_id__subsections')),
+    sa.ForeignKeyConstraint(['section_id'], ['sections.id'], name=op.f('fk__user_progress__section_id__sections')),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk__user_progress__user_id__users')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__user_progress'))
+    )
+    op.create_table('questions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('text', sa.String(length=1000), nullable=False),
+    sa.Column('question_set_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['question_set_id'], ['question_sets.id'], name=op.f('fk__questions__question_set_id__question_sets')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__questions'))
+    )
+    op.create_table('user_subsection_attempts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_progress_id', sa.Integer(), nullable=False),
+    sa.Column('subsection_id', sa.Integer(), nullable=False),
+    sa.Column('question_set_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['question_set_id'], ['question_sets.id'], name=op.f('fk__user_subsection_attempts__question_set_id__question_sets')),
+    sa.ForeignKeyConstraint(['subsection_id'], ['subsections.id'], name=op.f('fk__user_subsection_attempts__subsection_id__subsections')),
+    sa.ForeignKeyConstraint(['user_progress_id'], ['user_progress.id'], name=op.f('fk__user_subsection_attempts__user_progress_id__user_progress')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__user_subsection_attempts'))
+    )
+    op.create_table('user_speaking_attempt_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_subsection_attempt_id', sa.Integer(), nullable=False),
+    sa.Column('general_feedback', sa.Text(), nullable=True),
+    sa.Column('fluency_coherence_score', sa.Integer(), nullable=False),
+    sa.Column('grammatical_range_accuracy_score', sa.Integer(), nullable=False),
+    sa.Column('lexical_resource_score', sa.Integer(), nullable=False),
+    sa.Column('pronunciation_score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_subsection_attempt_id'], ['user_subsection_attempts.id'], name=op.f('fk__user_speaking_attempt_results__user_subsection_attempt_id__user_subsection_attempts')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__user_speaking_attempt_results')),
+    sa.UniqueConstraint('user_subsection_attempt_id', name=op.f('uq__user_speaking_attempt_results__user_subsection_attempt_id'))
+    )
+    op.create_table('user_subsection_answers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_subsection_attempt_id', sa.Integer(), nullable=False),
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('transcribed_answer', sa.Text(), nullable=True),
+    sa.Column('pronunciation_assessment_json', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('accuracy_score', sa.Float(), nullable=True),
+    sa.Column('fluency_score', sa.Float(), nullable=True),
+    sa.Column('completeness_score', sa.Float(), nullable=True),
+    sa.Column('pronunciation_score', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['question_id'], ['questions.id'], name=op.f('fk__user_subsection_answers__question_id__questions')),
+    sa.ForeignKeyConstraint(['user_subsection_attempt_id'], ['user_subsection_attempts.id'], name=op.f('fk__user_subsection_answers__user_subsection_attempt_id__user_subsection_attempts')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__user_subsection_answers'))
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_subsection_answers')
+    op.drop_table('user_speaking_attempt_results')
+    op.drop_table('user_subsection_attempts')
+    op.drop_table('questions')
+    op.drop_table('user_progress')
+    op.drop_table('question_sets')
+    op.drop_table('subsections')
+    op.drop_index(op.f('ix__email'), table_name='users')
+    op.drop_table('users')
+    op.drop_table('topics')
+    op.drop_table('sections')
@@ -0,0 +1,36 @@
+"""user data indexes
+
+Indexes for the access paths of every user page: progress lookups by user
+(and the unfinished progress per section), attempts of a progress record
+newest first, and answers of an attempt.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 14:27:51.832818
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix__user_progress__user_id', 'user_progress', ['user_id'], unique=False)
+    op.create_index('ix__user_progress__user_id_section_id__not_completed', 'user_progress', ['user_id', 'section_id'], unique=False, postgresql_where=sa.text('NOT is_completed'))
+    op.create_index('ix__user_subsection_attempts__user_progress_id_id', 'user_subsection_attempts', ['user_progress_id', sa.text('id DESC')], unique=False)
+    op.create_index('ix__user_subsection_answers__user_subsection_attempt_id', 'user_subsection_answers', ['user_subsection_attempt_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix__user_subsection_answers__user_subsection_attempt_id', table_name='user_subsection_answers')
+    op.drop_index('ix__user_subsection_attempts__user_progress_id_id', table_name='user_subsection_attempts')
+    op.drop_index('ix__user_progress__user_id_section_id__not_completed', table_name='user_progress', postgresql_where=sa.text('NOT is_completed'))
+    op.drop_index('ix__user_progress__user_id', table_name='user_progress')
@@ -0,0 +1,33 @@
+"""content natural keys
+
+Unique constraints the content seed upserts on: subsections by part number
+within a section, topics by name and questions by text within a set.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 14:29:30.777628
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_unique_constraint(op.f('uq__questions__question_set_id_text'), 'questions', ['question_set_id', 'text'])
+    op.create_unique_constraint(op.f('uq__subsections__section_id_part_number'), 'subsections', ['section_id', 'part_number'])
+    op.create_unique_constraint(op.f('uq__topics__name'), 'topics', ['name'])
+
+
+def downgrade() -> None:
+    op.drop_constraint(op.f('uq__topics__name'), 'topics', type_='unique')
+    op.drop_constraint(op.f('uq__subsections__section_id_part_number'), 'subsections', type_='unique')
+    op.drop_constraint(op.f('uq__questions__question_set_id_text'), 'questions', type_='unique')
@@ -0,0 +1,29 @@
+"""attempt result llm model
+
+The ChatGPT model that evaluated an attempt, so score drift can be traced
+to model changes and failovers. Earlier attempts keep NULL.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 16:02:11.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user_speaking_attempt_results', sa.Column('llm_model', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('user_speaking_attempt_results', 'llm_model')
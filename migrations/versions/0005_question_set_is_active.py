@@ -0,0 +1,30 @@
+"""question set is active
+
+Question sets the content seed no longer contains are deactivated instead
+of deleted: they are not given out any more, but attempts made with them
+keep their questions. Existing sets start active.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 18:12:40.527193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('question_sets', sa.Column('is_active', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('question_sets', 'is_active')
@@ -0,0 +1,31 @@
+"""question set active per topic
+
+An edited Part 2 or 3 question set is replaced by a new set like a Part 1
+set is, so only the active sets stay unique per subsection and topic.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 19:40:03.118562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_constraint('uix_1', 'question_sets', type_='unique')
+    op.create_index('ix__question_sets__subsection_id_topic_id__active', 'question_sets', ['subsection_id', 'topic_id'], unique=True, postgresql_where=sa.text('is_active'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix__question_sets__subsection_id_topic_id__active', table_name='question_sets', postgresql_where=sa.text('is_active'))
+    op.create_unique_constraint('uix_1', 'question_sets', ['subsection_id', 'topic_id'])
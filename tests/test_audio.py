@@ -0,0 +1,34 @@
+from io import BytesIO
+
+import pytest
+
+from app.audio import InvalidAudioError, get_webm_duration
+
+EBML_HEADER = bytes.fromhex('1A45DFA3 80')
+SEGMENT_INFO = bytes.fromhex('18538067 01FFFFFFFFFFFFFF 1549A966 01FFFFFFFFFFFFFF')
+
+
+def webm(*elements: str) -> BytesIO:
+    return BytesIO(EBML_HEADER + SEGMENT_INFO + b''.join(bytes.fromhex(e) for e in elements))
+
+
+def test_duration_element():
+    # TimecodeScale 1 ms, Duration 2500.0 as a float
+    assert get_webm_duration(webm('2AD7B1 83 0F4240', '4489 84 451C4000')) == 2.5
+
+
+def test_duration_from_last_block():
+    # Cluster at 1000 ticks with a SimpleBlock 500 ticks later
+    assert get_webm_duration(webm('1F43B675 01FFFFFFFFFFFFFF', 'E7 82 03E8',
+                                  'A3 84 81 01F4 00')) == 1.5
+
+
+@pytest.mark.parametrize('elements', [
+    ('4489 83 451C40',),  # Duration that is neither a float nor a double
+    ('4489 88 451C4000',),  # Duration cut short
+    ('2AD7B1 89 000000000000000001',),  # TimecodeScale wider than 8 bytes
+    ('2AD7B1 83 0F42',),  # TimecodeScale cut short
+])
+def test_malformed_element_is_invalid_audio(elements):
+    with pytest.raises(InvalidAudioError):
+        get_webm_duration(webm(*elements))
@@ -0,0 +1,46 @@
+from app.catalog import (CatalogQuestionSet, CatalogSection, CatalogSubsection,
+                         ContentCatalog, SeenQuestionSets)
+
+SUBSECTION = CatalogSubsection(id=7, name='Introduction and Interview', part_number=1,
+                               description='', time_limit_minutes=5, section_id=1)
+
+
+def catalog(count: int, first_id: int = 1) -> ContentCatalog:
+    question_sets = tuple(CatalogQuestionSet(id=first_id + i, subsection=SUBSECTION, topic=None,
+                                             questions=(), index=i)
+                          for i in range(count))
+    section = CatalogSection(id=1, name='Speaking', description='', subsections=(SUBSECTION,))
+    return ContentCatalog((section,), question_sets, version='test')
+
+
+def test_token_size_does_not_depend_on_ids():
+    question_set = catalog(1, first_id=1_000_000).question_set(1_000_000)
+    seen = SeenQuestionSets()
+    seen.add(question_set)
+
+    token = seen.to_token()
+    assert len(token) < 10
+    assert question_set in SeenQuestionSets.from_token(token)
+
+
+def test_picks_the_only_unseen_question_set():
+    content = catalog(50)
+    seen = SeenQuestionSets()
+    for question_set_id in range(1, 50):
+        seen.add(content.question_set(question_set_id))
+
+    for _ in range(20):
+        assert content.random_question_set(SUBSECTION.id, seen=seen).id == 50
+
+
+def test_picks_any_question_set_once_all_are_seen():
+    content = catalog(3)
+    seen = SeenQuestionSets()
+    for question_set_id in range(1, 4):
+        seen.add(content.question_set(question_set_id))
+
+    assert content.random_question_set(SUBSECTION.id, seen=seen) is not None
+
+
+def test_invalid_token_gives_an_empty_set():
+    assert not SeenQuestionSets.from_token('not a token')
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from benchmarks.import_time import BUDGET_MS, LAZY_MODULES, STARTUP, import_times
+
+
+@pytest.fixture(scope='module')
+def times():
+    # create_app() does not connect, any database URL will do
+    env = {**os.environ, 'POSTGRES_URL': 'postgresql://localhost/import_time'}
+    # the fastest of a few runs: the first may still be writing bytecode
+    # caches, and any of them can be slowed down by other processes
+    return min((import_times(STARTUP, env) for _ in range(5)), key=total_ms)
+
+
+def total_ms(times: list) -> float:
+    return sum(cumulative for _, _, cumulative, depth in times if depth == 0) / 1000
+
+
+def test_startup_imports_within_budget(times):
+    assert total_ms(times) <= BUDGET_MS
+
+
+def test_heavy_modules_are_imported_on_first_use(times):
+    assert not {name.split('.')[0] for name, *_ in times} & set(LAZY_MODULES)
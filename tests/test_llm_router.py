@@ -0,0 +1,32 @@
+from unittest import mock
+
+import pytest
+
+from app.llm_router import ModelRouter
+
+
+def failing_call(model):
+    raise ConnectionError(model)
+
+
+def test_failover_skips_unhealthy_models():
+    router = ModelRouter({'*': ('primary', 'unhealthy', 'healthy')}, min_calls=1)
+    router.health('unhealthy').record(1, failed=True)
+    func = mock.Mock(side_effect=failing_call)
+
+    with pytest.raises(ConnectionError):
+        router.call(1, func)
+
+    assert [call.kwargs['model'] for call in func.call_args_list] == ['primary', 'healthy']
+
+
+def test_only_the_first_model_is_tried_when_none_is_healthy():
+    router = ModelRouter({'*': ('primary', 'alternate')}, min_calls=1)
+    for model in ('primary', 'alternate'):
+        router.health(model).record(1, failed=True)
+    func = mock.Mock(side_effect=failing_call)
+
+    with pytest.raises(ConnectionError):
+        router.call(1, func)
+
+    assert func.call_count == 1
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from app.executors import EXECUTORS, init_executors
+from app.pipeline import Pipeline, RetryPolicy, Stage, StageError, StageTimeout
+
+
+@pytest.fixture(scope='module', autouse=True)
+def executors():
+    init_executors({config_key: 4 for config_key in EXECUTORS.values()})
+
+
+def test_partly_finished_mapped_stage_does_not_spin():
+    pipeline = Pipeline('test', [
+        Stage('sleep', lambda seconds: time.sleep(seconds) or seconds,
+              inputs=('durations',), outputs=('slept',), map_over=('durations',),
+              executor='llm')])
+
+    cpu_started = time.process_time()
+    run = pipeline.run(durations=(0.01, 1.0))
+
+    assert run['slept'] == (0.01, 1.0)
+    # a busy-waiting request thread burns about a second of CPU here
+    assert time.process_time() - cpu_started < 0.3
+
+
+def test_timed_out_stage_stops_retrying():
+    calls = []
+
+    def flaky():
+        calls.append(time.perf_counter())
+        time.sleep(0.1)
+        raise ConnectionError('backend down')
+
+    pipeline = Pipeline('test', [
+        Stage('call', flaky, outputs=('result',), executor='llm', timeout=0.15,
+              retry=RetryPolicy(attempts=5, wait_seconds=0.1))])
+
+    # no retry fits before the deadline, so the call gives up at once
+    with pytest.raises(StageError):
+        pipeline.run()
+    time.sleep(0.5)  # time for all five attempts if they went on
+
+    assert len(calls) == 1
+
+
+def test_failed_run_stops_retries_of_other_stages():
+    calls = []
+
+    def flaky():
+        calls.append(time.perf_counter())
+        raise ConnectionError('backend down')
+
+    def broken():
+        time.sleep(0.05)
+        raise ValueError('bad input')
+
+    pipeline = Pipeline('test', [
+        Stage('retried', flaky, outputs=('a',), executor='llm',
+              retry=RetryPolicy(attempts=5, wait_seconds=0.1)),
+        Stage('broken', broken, outputs=('b',), executor='transcode')])
+
+    with pytest.raises(StageError) as error:
+        pipeline.run()
+    time.sleep(0.5)
+
+    assert error.value.stage == 'broken'
+    assert len(calls) == 1
+
+
+def test_stage_timeout_stops_retries_of_running_call():
+    calls = []
+
+    def slow_then_flaky():
+        calls.append(time.perf_counter())
+        time.sleep(0.2)
+        raise ConnectionError('backend down')
+
+    pipeline = Pipeline('test', [
+        Stage('call', slow_then_flaky, outputs=('result',), executor='llm', timeout=0.1,
+              retry=RetryPolicy(attempts=5, wait_seconds=0))])
+
+    with pytest.raises(StageTimeout):
+        pipeline.run()
+    time.sleep(0.6)
+
+    assert len(calls) == 1
@@ -0,0 +1,72 @@
+"""
+The hot user-data queries are planned on their indexes.
+
+Sequential scans are disabled for the session, so the check is meaningful
+on a small local database too. Needs a database migrated to head.
+"""
+import json
+import uuid
+
+import pytest
+from sqlalchemy import desc, text
+
+from app import create_app
+from app.models import UserProgress, UserSubsectionAttempt, UserSubsectionAnswer
+from config import Config
+from config.database import db
+
+
+class TestConfig(Config):
+    TESTING = True
+
+
+USER_ID, SECTION_ID, USER_PROGRESS_ID, ATTEMPT_ID = uuid.uuid4(), 1, 1, 1
+
+# the user-data queries of the app, keyed by the index each should use;
+# built when called, Model.query needs an app context
+HOT_QUERIES = {
+    # User.get_section_progress
+    'ix__user_progress__user_id_section_id__not_completed': lambda: UserProgress.query.filter(
+        UserProgress.user_id == USER_ID,
+        UserProgress.section_id == SECTION_ID,
+        ~UserProgress.is_completed),
+    # User.get_sections_history
+    'ix__user_progress__user_id': lambda: UserProgress.query.filter(
+        UserProgress.user_id == USER_ID),
+    # UserProgress.get_last_topic
+    'ix__user_subsection_attempts__user_progress_id_id': lambda: db.session.query(
+        UserSubsectionAttempt.question_set_id
+    ).filter(
+        UserSubsectionAttempt.user_progress_id == USER_PROGRESS_ID
+    ).order_by(desc(UserSubsectionAttempt.id)).limit(1),
+    # UserSubsectionAttempt.user_answers
+    'ix__user_subsection_answers__user_subsection_attempt_id': lambda: UserSubsectionAnswer.query.filter(
+        UserSubsectionAnswer.user_subsection_attempt_id == ATTEMPT_ID),
+}
+
+
+@pytest.fixture(scope='module')
+def app():
+    if not Config.SQLALCHEMY_DATABASE_URI:
+        pytest.skip('POSTGRES_URL is not set')
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.session.execute(text('SET enable_seqscan = off'))
+        yield app
+        db.session.rollback()
+
+
+def used_indexes(plan: dict) -> set:
+    indexes = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', ()):
+        indexes |= used_indexes(child)
+    return indexes
+
+
+@pytest.mark.parametrize('index_name', HOT_QUERIES)
+def test_query_uses_index(app, index_name):
+    query = HOT_QUERIES[index_name]()
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    assert index_name in used_indexes(plan[0]['Plan'])
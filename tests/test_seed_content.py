@@ -0,0 +1,72 @@
+from unittest import mock
+
+import pytest
+from sqlalchemy import select
+
+from app import create_app
+from app.catalog import load_catalog
+from app.content.ielts_seeds import QUESTIONS, TOPICS
+from app.models import QuestionSet, Subsection, Topic
+from app.utils import seed_content
+from config import Config
+from config.database import db
+
+
+class TestConfig(Config):
+    TESTING = True
+
+
+@pytest.fixture
+def app():
+    if not Config.SQLALCHEMY_DATABASE_URI:
+        pytest.skip('POSTGRES_URL is not set')
+    app = create_app(TestConfig)
+    with app.app_context():
+        # seed within one transaction and roll it back afterwards
+        with mock.patch.object(db.session, 'commit', db.session.flush):
+            yield app
+        db.session.rollback()
+
+
+def test_edited_part_1_question_set_replaces_the_old_one(app):
+    seed_content()
+    old_ids = _part_1_question_set_ids()
+
+    edited = [{**QUESTIONS[0], 'questions': ['Where is your hometown?', *QUESTIONS[0]['questions'][1:]]},
+              *QUESTIONS[1:]]
+    with mock.patch('app.utils.QUESTIONS', edited):
+        seed_content()
+    catalog = load_catalog()
+    new_ids = _part_1_question_set_ids() - old_ids
+
+    assert len(new_ids) == 1
+    replaced = next(catalog.question_set(qs_id) for qs_id in old_ids
+                    if [q.text for q in catalog.question_set(qs_id)] == QUESTIONS[0]['questions'])
+    # the replaced set is never given out, but still resolves for past attempts
+    assert not replaced.is_active
+    for _ in range(20):
+        assert catalog.random_question_set(replaced.subsection_id).id not in old_ids
+
+
+def test_edited_part_2_question_set_replaces_the_old_one(app):
+    seed_content()
+    topic = TOPICS[0]
+    topic_id = db.session.scalar(select(Topic.id).where(Topic.name == topic['name']))
+    subsection_id = db.session.scalar(select(Subsection.id).where(Subsection.name == topic['subsection']))
+    replaced = load_catalog().random_question_set(subsection_id, topic_id)
+
+    edited_questions = [*topic['general_questions'][1:], 'Why it mattered to you']
+    with mock.patch('app.utils.TOPICS', [{**topic, 'general_questions': edited_questions}, *TOPICS[1:]]):
+        seed_content()
+    catalog = load_catalog()
+    current = catalog.random_question_set(subsection_id, topic_id)
+
+    # only the new wording, in the seeded order
+    assert current.id != replaced.id
+    assert [q.text for q in current] == edited_questions
+    assert not catalog.question_set(replaced.id).is_active
+    assert [q.text for q in catalog.question_set(replaced.id)] == topic['general_questions']
+
+
+def _part_1_question_set_ids():
+    return set(db.session.scalars(select(QuestionSet.id).where(QuestionSet.topic_id.is_(None))))
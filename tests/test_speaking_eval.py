@@ -0,0 +1,58 @@
+from unittest import mock
+
+import pytest
+
+from app import create_app
+from app.catalog import get_catalog
+from app.executors import init_executors
+from app.llm_output import MalformedEvaluationError, parse_evaluation
+from app.pipeline import StageError
+from app.audio import AudioBuffer
+from app.speaking_eval import RESCORING_PIPELINE, AzurePronunciationAssessor, ChatGPT
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+
+
+@pytest.fixture(scope='module')
+def app():
+    if not Config.SQLALCHEMY_DATABASE_URI:
+        pytest.skip('POSTGRES_URL is not set')
+    app = create_app(TestConfig)
+    init_executors(app.config)
+    with app.app_context():
+        yield app
+
+
+def test_malformed_reply_is_not_retried_by_the_pipeline(app):
+    catalog = get_catalog()
+    subsection = catalog.section_by_name('speaking').subsections[0]
+    question_set = catalog.random_question_set(subsection.id)
+    replies = mock.Mock(return_value='{"coherence": {"score": 7}}')
+
+    with mock.patch.object(ChatGPT, '_get_chat_completion', replies):
+        with pytest.raises(StageError) as error:
+            RESCORING_PIPELINE.run(questions_set=question_set, subsection=question_set.subsection,
+                                   transcripts=('An answer.',) * len(question_set.questions),
+                                   pron_scores=())
+
+    assert isinstance(error.value.cause, MalformedEvaluationError)
+    # the first reply and one follow-up per LLM_REASK_ATTEMPTS, no second round
+    assert replies.call_count == 1 + app.config['LLM_REASK_ATTEMPTS']
+
+
+def test_azure_endpoint_is_read_from_the_config(app):
+    response = mock.Mock(status_code=200, json=mock.Mock(return_value={}))
+    with mock.patch.dict(app.config, AZURE_SPEECH_ENDPOINT='http://127.0.0.1:8788'), \
+            mock.patch('app.speaking_eval.requests.post', return_value=response) as post:
+        AzurePronunciationAssessor.get_assessment(AudioBuffer(b'audio'), 'An answer.')
+
+    assert post.call_args.kwargs['url'].startswith('http://127.0.0.1:8788/speech/')
+
+
+@pytest.mark.parametrize('score', ['NaN', 'Infinity', '-Infinity', '1e999', '"nan"', '"inf"'])
+def test_non_finite_score_is_reported_missing(score):
+    parsed = parse_evaluation(f'{{"coherence": {{"score": {score}}}}}', ('coherence',))
+    assert parsed.missing == ('coherence',)